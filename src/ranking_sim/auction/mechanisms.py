@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, Protocol, List
 
+import numpy as np
+
 from ranking_sim.data.schema import Impression, AuctionResult
 
 
@@ -45,4 +47,149 @@ class SecondPriceSingleSlot:
         raw_price = second_score / winner_pctr
         price_cpc = float(min(winner_bid, raw_price))
 
-        return AuctionResult(winner_ad_id=winner, ranked_ad_ids=ranked, price_cpc=price_cpc)
\ No newline at end of file
+        return AuctionResult(winner_ad_id=winner, ranked_ad_ids=ranked, price_cpc=price_cpc)
+
+class BatchAuction(Protocol):
+    def price_batch(
+        self,
+        scores: np.ndarray,
+        bids: np.ndarray,
+        pctr: np.ndarray,
+        position_bias: np.ndarray,
+    ) -> np.ndarray:
+        """
+        CPC prices for K shown slots of B impressions.
+
+        scores:        (B, K + 1) ranked scores; column K is the best
+                       non-shown score. NaN marks a missing ad (an
+                       unfilled slot, or nothing ranked below the last
+                       shown ad), so a real score of 0 stays distinct
+        bids, pctr:    (B, K) for the shown ads, in rank order
+        position_bias: (K,) examination probability per slot
+
+        Mechanisms may also define eligible(bids, pctr, scores) -> (B, C)
+        bool mask; ineligible candidates are removed before ranking and
+        may leave slots unfilled.
+        """
+
+
+def quality_factor(scores: np.ndarray, bids: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+    """
+    Per-ad score per unit of bid, q = score / bid. Every built-in policy is
+    linear in bid (bid * f(pCTR)), so an ad keeps its slot while
+    bid * q >= next score, and q = pCTR for BidTimesPCTR.
+    """
+    return scores / np.maximum(bids, eps)
+
+
+@dataclass(frozen=True)
+class FirstPriceCPC:
+    """Every shown ad pays its own bid per click."""
+
+    def price_batch(
+        self,
+        scores: np.ndarray,
+        bids: np.ndarray,
+        pctr: np.ndarray,
+        position_bias: np.ndarray,
+    ) -> np.ndarray:
+        return np.array(bids, dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class GSP:
+    """
+    Generalized second price, per click:
+      price_k = min(bid_k, score_{k+1} / q_k)
+    i.e. the lowest bid that keeps slot k. With score = bid * pCTR this is
+    next-score / own-pCTR. An ad with no next score (a lone candidate, or
+    the last filled slot with nothing ranked below it) pays 0, which a
+    ReservePrice wrapper raises to its floor. last_pays_bid makes it pay
+    its bid instead, like SecondPriceSingleSlot.
+    """
+    eps: float = 1e-12
+    last_pays_bid: bool = False
+
+    def price_batch(
+        self,
+        scores: np.ndarray,
+        bids: np.ndarray,
+        pctr: np.ndarray,
+        position_bias: np.ndarray,
+    ) -> np.ndarray:
+        K = bids.shape[1]
+        q = np.maximum(quality_factor(scores[:, :K], bids, self.eps), self.eps)
+        nxt = scores[:, 1:K + 1]
+        price = np.minimum(bids, np.nan_to_num(nxt, nan=0.0) / q)
+        if self.last_pays_bid:
+            price = np.where(np.isnan(nxt), bids, price)
+        return price
+
+
+@dataclass(frozen=True)
+class VCG:
+    """
+    VCG for separable position effects theta_k = position_bias[k]. The ad
+    in slot k pays the externality it imposes on the ads below it,
+      sum_{j>k} (theta_{j-1} - theta_j) * score_j,
+    with theta_K = 0 and score_K the first non-shown score, converted to a
+    per-click price by dividing by theta_k * q_k and capped at the bid.
+    """
+    eps: float = 1e-12
+
+    def price_batch(
+        self,
+        scores: np.ndarray,
+        bids: np.ndarray,
+        pctr: np.ndarray,
+        position_bias: np.ndarray,
+    ) -> np.ndarray:
+        K = bids.shape[1]
+        if K == 0:
+            return np.zeros_like(bids, dtype=np.float64)
+        theta = np.append(np.asarray(position_bias, dtype=np.float64)[:K], 0.0)
+        # term[:, j-1] = (theta_{j-1} - theta_j) * score_j for j = 1..K
+        term = (theta[:-1] - theta[1:])[None, :] * np.nan_to_num(scores[:, 1:K + 1], nan=0.0)
+        externality = np.cumsum(term[:, ::-1], axis=1)[:, ::-1]
+
+        q = np.maximum(quality_factor(scores[:, :K], bids, self.eps), self.eps)
+        denom = np.maximum(theta[:K][None, :] * q, self.eps)
+        return np.minimum(bids, externality / denom)
+
+
+@dataclass(frozen=True)
+class ReservePrice:
+    """
+    Reserve price and quality floor around another mechanism.
+
+    Candidates with bid < reserve_cpc, pCTR < min_pctr or score < min_score
+    are not eligible. Shown ads pay at least the reserve: the larger of
+    reserve_cpc and min_score / q_k, on top of the inner price, capped
+    at the bid.
+    """
+    inner: BatchAuction = field(default_factory=GSP)
+    reserve_cpc: float = 0.0
+    min_pctr: float = 0.0
+    min_score: float = 0.0
+    eps: float = 1e-12
+
+    def eligible(self, bids: np.ndarray, pctr: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        ok = bids >= self.reserve_cpc
+        if self.min_pctr > 0.0:
+            ok &= pctr >= self.min_pctr
+        if self.min_score > 0.0:
+            ok &= scores >= self.min_score
+        return ok
+
+    def price_batch(
+        self,
+        scores: np.ndarray,
+        bids: np.ndarray,
+        pctr: np.ndarray,
+        position_bias: np.ndarray,
+    ) -> np.ndarray:
+        K = bids.shape[1]
+        price = self.inner.price_batch(scores, bids, pctr, position_bias)
+        q = np.maximum(quality_factor(scores[:, :K], bids, self.eps), self.eps)
+        floor = np.maximum(self.reserve_cpc, self.min_score / q)
+        return np.minimum(bids, np.maximum(price, floor))
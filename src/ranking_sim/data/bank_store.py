@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Protocol, Sequence
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch, prefetch
+from ranking_sim.data.feature_bank import bulk_draws, frame_to_matrix, sampled_batch
+from ranking_sim.data.schema import Impression
+
+_META_FILE = "meta.json"
+_COLUMNS_FILE = "columns.npy"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("pyarrow is not installed. pip install pyarrow") from e
+    return pa, pq
+
+
+def _parquet_feature_names(pf) -> List[str]:
+    """Schema columns minus a stored pandas index."""
+    meta = pf.schema_arrow.pandas_metadata or {}
+    index_cols = {c for c in meta.get("index_columns", []) if isinstance(c, str)}
+    return [name for name in pf.schema_arrow.names if name not in index_cols]
+
+
+def _scan_categories(pf, names: Sequence[str]) -> Optional[List[list]]:
+    """
+    Sorted category lists of the dictionary-encoded columns, collected one
+    row group at a time (row groups may carry different dictionaries).
+    Returns None when the bank has no categorical columns.
+    """
+    pa, _ = _require_pyarrow()
+    cat_names = [n for n in names if pa.types.is_dictionary(pf.schema_arrow.field(n).type)]
+    if not cat_names:
+        return None
+    seen: Dict[str, set] = {n: set() for n in cat_names}
+    for g in range(pf.num_row_groups):
+        table = pf.read_row_group(g, columns=cat_names)
+        for n in cat_names:
+            for chunk in table.column(n).chunks:
+                seen[n].update(v for v in chunk.dictionary.to_pylist() if v is not None)
+    return [sorted(seen[n]) for n in cat_names]
+
+
+def _digest_header(feature_names: Sequence[str], dtype: np.dtype, shape) -> "hashlib._Hash":
+    # Same byte stream as models.pctr_cache.feature_bank_digest over the
+    # (N, F) row-major matrix, so both sources share pCTR cache entries.
+    h = hashlib.sha256()
+    h.update("\x1f".join(feature_names).encode())
+    h.update(str(np.dtype(dtype)).encode())
+    h.update(repr(tuple(shape)).encode())
+    return h
+
+
+def _iter_row_groups(pf, names, pandas_categorical, dtype) -> Iterator[np.ndarray]:
+    for g in range(pf.num_row_groups):
+        frame = pf.read_row_group(g, columns=list(names)).to_pandas()
+        yield frame_to_matrix(frame, names, pandas_categorical, dtype=dtype)
+
+
+def build_column_cache(
+    parquet_path: str,
+    cache_dir: str,
+    feature_names: Optional[Sequence[str]] = None,
+    pandas_categorical: Optional[List[list]] = None,
+    dtype: np.dtype = np.float32,
+    overwrite: bool = False,
+) -> "ColumnStore":
+    """
+    Convert a Parquet feature bank into a column-major (F, N) .npy matrix
+    under cache_dir, one row group at a time, so peak memory is one row
+    group whatever the bank size. Categoricals become codes as in
+    frame_to_matrix. Unless `overwrite`, an existing cache is reused if it
+    was built from the same file (size and mtime) with the same
+    feature_names, pandas_categorical and dtype arguments, and rebuilt
+    otherwise.
+    """
+    _, pq = _require_pyarrow()
+    st = os.stat(parquet_path)
+    source = {"path": os.path.abspath(parquet_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    dtype = np.dtype(dtype)
+    # As requested (None = taken from the file), in the JSON form meta.json stores.
+    requested = json.loads(json.dumps({
+        "feature_names": list(feature_names) if feature_names is not None else None,
+        "pandas_categorical": pandas_categorical,
+        "dtype": dtype.str,
+    }))
+
+    meta_path = os.path.join(cache_dir, _META_FILE)
+    if not overwrite and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("source") == source and meta.get("requested") == requested:
+            return ColumnStore(cache_dir)
+
+    pf = pq.ParquetFile(parquet_path)
+    names = list(feature_names) if feature_names is not None else _parquet_feature_names(pf)
+    if pandas_categorical is None:
+        pandas_categorical = _scan_categories(pf, names)
+    N, F = pf.metadata.num_rows, len(names)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = os.path.join(cache_dir, f"{_COLUMNS_FILE}.tmp{os.getpid()}.npy")
+    columns = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=(F, N))
+    h = _digest_header(names, dtype, (N, F))
+    start = 0
+    for m in _iter_row_groups(pf, names, pandas_categorical, dtype):
+        columns[:, start:start + len(m)] = m.T
+        h.update(np.ascontiguousarray(m).data)
+        start += len(m)
+    columns.flush()
+    del columns
+    os.replace(tmp, os.path.join(cache_dir, _COLUMNS_FILE))
+
+    meta = {
+        "feature_names": names,
+        "n_rows": N,
+        "dtype": dtype.str,
+        "digest": h.hexdigest(),
+        "pandas_categorical": pandas_categorical,
+        "source": source,
+        "requested": requested,
+    }
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    return ColumnStore(cache_dir)
+
+
+class BankStore(Protocol):
+    feature_names: List[str]
+
+    @property
+    def n_rows(self) -> int: ...
+
+    @property
+    def bank_digest(self) -> str: ...
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Return the (len(rows), F) feature rows, in the order given."""
+
+
+class ColumnStore:
+    """
+    Read-only view of a build_column_cache directory. The (F, N) matrix is
+    memory-mapped; take() gathers rows in sorted order so each column is
+    read front to back, and only touched pages are paged in.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, _META_FILE)) as f:
+            meta = json.load(f)
+        self.feature_names: List[str] = list(meta["feature_names"])
+        self.pandas_categorical: Optional[List[list]] = meta.get("pandas_categorical")
+        self._digest: str = meta["digest"]
+        self.columns: np.ndarray = np.load(os.path.join(cache_dir, _COLUMNS_FILE), mmap_mode="r")
+
+    @property
+    def n_rows(self) -> int:
+        return int(self.columns.shape[1])
+
+    @property
+    def bank_digest(self) -> str:
+        return self._digest
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        order = np.argsort(rows, kind="stable")
+        out = np.empty((len(rows), len(self.feature_names)), dtype=self.columns.dtype)
+        out[order] = self.columns[:, rows[order]].T
+        return out
+
+
+class ParquetStore:
+    """
+    Reads feature rows straight from a Parquet bank, one row group at a
+    time: take() decodes only the row groups its rows fall in. Memory is
+    bounded by one decoded row group, but uniform sampling touches most
+    groups per call, so prefer a ColumnStore for repeated runs.
+    """
+
+    def __init__(
+        self,
+        parquet_path: str,
+        feature_names: Optional[Sequence[str]] = None,
+        pandas_categorical: Optional[List[list]] = None,
+        dtype: np.dtype = np.float32,
+    ) -> None:
+        _, pq = _require_pyarrow()
+        self.parquet_path = parquet_path
+        self._pf = pq.ParquetFile(parquet_path)
+        self.feature_names: List[str] = (
+            list(feature_names) if feature_names is not None else _parquet_feature_names(self._pf)
+        )
+        self.pandas_categorical = (
+            pandas_categorical if pandas_categorical is not None else _scan_categories(self._pf, self.feature_names)
+        )
+        self.dtype = np.dtype(dtype)
+        sizes = [self._pf.metadata.row_group(g).num_rows for g in range(self._pf.num_row_groups)]
+        self._offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self._digest: Optional[str] = None
+
+    @property
+    def n_rows(self) -> int:
+        return int(self._offsets[-1])
+
+    @property
+    def bank_digest(self) -> str:
+        """Computed on first use with one streaming pass over the file."""
+        if self._digest is None:
+            h = _digest_header(self.feature_names, self.dtype, (self.n_rows, len(self.feature_names)))
+            for m in _iter_row_groups(self._pf, self.feature_names, self.pandas_categorical, self.dtype):
+                h.update(np.ascontiguousarray(m).data)
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        out = np.empty((len(rows), len(self.feature_names)), dtype=self.dtype)
+        group = np.searchsorted(self._offsets, rows, side="right") - 1
+        for g in np.unique(group).tolist():
+            sel = np.flatnonzero(group == g)
+            frame = self._pf.read_row_group(g, columns=self.feature_names).to_pandas()
+            m = frame_to_matrix(frame, self.feature_names, self.pandas_categorical, dtype=self.dtype)
+            out[sel] = m[rows[sel] - self._offsets[g]]
+        return out
+
+
+@dataclass
+class StreamingBankSource:
+    """
+    Out-of-core counterpart of FeatureBankSource for banks larger than RAM.
+
+    Rows are sampled across the whole bank with the same per-chunk draws as
+    FeatureBankSource(rng_mode="bulk"), so both give identical impressions
+    for the same bank, seed and chunk_size. Only the sampled rows are read
+    from `store`; with prefetch > 0 the next chunks are gathered on a
+    background thread while the current one is being scored. Peak memory
+    is about (prefetch + 1) batches.
+    """
+    store: BankStore
+    n_impressions: int
+    n_candidates: int
+    seed: int
+    chunk_size: int = 4096
+    n_advertisers: int = 200
+    prefetch: int = 2
+
+    rng_mode = "bulk"
+
+    @property
+    def feature_names(self) -> List[str]:
+        return self.store.feature_names
+
+    @property
+    def bank_digest(self) -> str:
+        return self.store.bank_digest
+
+    def _batches(self) -> Iterator[ImpressionBatch]:
+        C = int(self.n_candidates)
+        for chunk_index, start in enumerate(range(0, self.n_impressions, self.chunk_size)):
+            stop = min(start + self.chunk_size, self.n_impressions)
+            idx, advertiser_ids, bids = bulk_draws(
+                self.seed, chunk_index, stop - start, C, self.store.n_rows, self.n_advertisers
+            )
+            yield sampled_batch(start, advertiser_ids, bids, self.store.take(idx), self.feature_names)
+
+    def iter_batches(self) -> Iterator[ImpressionBatch]:
+        return prefetch(self._batches(), self.prefetch)
+
+    def __iter__(self) -> Iterator[Impression]:
+        for batch in self.iter_batches():
+            yield from batch.impressions()
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Protocol, TypeVar
+
+import numpy as np
+
+from ranking_sim.data.schema import AdCandidate, Impression
+
+T = TypeVar("T")
+
+
+class FeatureRow(Mapping[str, float]):
+    """
+    Read-only dict-like view of one row of a feature matrix.
+
+    Lets AdCandidate.features point into a columnar batch instead of
+    holding its own copy of every feature value.
+    """
+    __slots__ = ("_matrix", "_row", "_index")
+
+    def __init__(self, matrix: np.ndarray, row: int, index: Dict[str, int]) -> None:
+        self._matrix = matrix
+        self._row = row
+        self._index = index
+
+    def __getitem__(self, key: str) -> float:
+        return float(self._matrix[self._row, self._index[key]])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return f"FeatureRow({dict(self)!r})"
+
+
+@dataclass(frozen=True)
+class ImpressionBatch:
+    """
+    Columnar block of B impressions with C candidates each.
+
+    Row i of every (B, C) array belongs to imp_ids[i]. Features are stored
+    flattened as a (B * C, F) matrix, candidate-major within an impression,
+    so the block can be handed to a model without reshaping.
+    """
+    imp_ids: np.ndarray          # (B,) int64
+    ad_ids: np.ndarray           # (B, C) int64
+    advertiser_ids: np.ndarray   # (B, C) int64
+    bids: np.ndarray             # (B, C) float64 CPC bids
+    features: np.ndarray         # (B * C, F)
+    feature_names: List[str]
+    contexts: Optional[List[Dict[str, Any]]] = None
+
+    @property
+    def n_impressions(self) -> int:
+        return int(self.ad_ids.shape[0])
+
+    @property
+    def n_candidates(self) -> int:
+        return int(self.ad_ids.shape[1])
+
+    def __len__(self) -> int:
+        return self.n_impressions
+
+    def impressions(self) -> Iterator[Impression]:
+        """Materialize Impression objects whose features are FeatureRow views."""
+        index = {name: j for j, name in enumerate(self.feature_names)}
+        C = self.n_candidates
+        imp_ids = self.imp_ids.tolist()
+        ad_ids = self.ad_ids.tolist()
+        advertiser_ids = self.advertiser_ids.tolist()
+        bids = self.bids.tolist()
+
+        for i, imp_id in enumerate(imp_ids):
+            candidates = [
+                AdCandidate(
+                    ad_id=ad_ids[i][j],
+                    advertiser_id=advertiser_ids[i][j],
+                    bid_cpc=bids[i][j],
+                    features=FeatureRow(self.features, i * C + j, index),
+                )
+                for j in range(C)
+            ]
+            context = self.contexts[i] if self.contexts is not None else {}
+            yield Impression(imp_id=imp_id, context=context, candidates=candidates)
+
+
+class ImpressionSource(Protocol):
+    def iter_batches(self) -> Iterator[ImpressionBatch]:
+        """Yield impressions as columnar ImpressionBatch blocks, in order."""
+
+    def __iter__(self) -> Iterator[Impression]:
+        """Yield the same impressions one Impression object at a time."""
+
+
+@dataclass
+class ArraySource:
+    """
+    Impression source over precomputed (N, C) bid / advertiser arrays.
+
+    Row i is impression i; ad ids follow the feature-bank convention
+    imp_id * 10_000 + j. `features` may be omitted when pCTRs come from a
+    cache, in which case batches carry a zero-width feature matrix. Arrays
+    may be np.memmap, and only one chunk is materialized at a time.
+    """
+    bids: np.ndarray                        # (N, C)
+    advertiser_ids: np.ndarray              # (N, C)
+    chunk_size: int = 65_536
+    features: Optional[np.ndarray] = None   # (N * C, F)
+    feature_names: Optional[List[str]] = None
+
+    @property
+    def n_impressions(self) -> int:
+        return int(self.bids.shape[0])
+
+    @property
+    def n_candidates(self) -> int:
+        return int(self.bids.shape[1])
+
+    def iter_batches(self) -> Iterator[ImpressionBatch]:
+        C = self.n_candidates
+        names = list(self.feature_names or [])
+        for start in range(0, self.n_impressions, self.chunk_size):
+            stop = min(start + self.chunk_size, self.n_impressions)
+            imp_ids = np.arange(start, stop, dtype=np.int64)
+            if self.features is not None:
+                features = np.asarray(self.features[start * C:stop * C])
+            else:
+                features = np.empty(((stop - start) * C, 0), dtype=np.float32)
+            yield ImpressionBatch(
+                imp_ids=imp_ids,
+                ad_ids=imp_ids[:, None] * 10_000 + np.arange(C, dtype=np.int64)[None, :],
+                advertiser_ids=np.asarray(self.advertiser_ids[start:stop], dtype=np.int64),
+                bids=np.asarray(self.bids[start:stop], dtype=np.float64),
+                features=features,
+                feature_names=names,
+            )
+
+    def __iter__(self) -> Iterator[Impression]:
+        for batch in self.iter_batches():
+            yield from batch.impressions()
+
+    @classmethod
+    def from_source(cls, source: ImpressionSource, **kwargs) -> "ArraySource":
+        """Materialize the bids / advertiser ids of another source (features dropped)."""
+        bids, advertiser_ids = [], []
+        for batch in source.iter_batches():
+            bids.append(batch.bids)
+            advertiser_ids.append(batch.advertiser_ids)
+        return cls(bids=np.concatenate(bids), advertiser_ids=np.concatenate(advertiser_ids), **kwargs)
+
+
+@dataclass(frozen=True)
+class _Failure:
+    exc: BaseException
+
+
+_DONE = object()
+
+
+def prefetch(items: Iterable[T], depth: int = 2) -> Iterator[T]:
+    """
+    Pull `items` on a background thread, staying up to `depth` items ahead
+    of the consumer, so building the next batch (I/O, gathers) overlaps
+    with scoring the current one. Exceptions are re-raised in the consumer;
+    closing the generator early stops the producer. depth <= 0 disables it.
+    """
+    if depth <= 0:
+        yield from items
+        return
+
+    q: "queue.Queue[object]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item: object) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failure(e))
+            return
+        put(_DONE)
+
+    worker = threading.Thread(target=produce, name="batch-prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        worker.join()
@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch, ImpressionSource
+from ranking_sim.data.schema import Impression
+
+PRECISIONS = {"float32": np.float32, "int16": np.int16, "int8": np.int8}
+AUTO = "auto"
+
+_META_FILE = "meta.json"
+_ARRAYS = ("imp_ids", "ad_ids", "advertiser_ids", "bids", "scale", "offset")
+
+
+def _iter_batches(source: Union[ImpressionSource, Iterable[ImpressionBatch]]) -> Iterator[ImpressionBatch]:
+    iter_batches = getattr(source, "iter_batches", None)
+    return iter_batches() if iter_batches is not None else iter(source)
+
+
+@dataclass
+class CandidateStore:
+    """
+    Compact columnar store of N impressions x C candidates.
+
+    Ids are int64 / int32 arrays and bids float64. Each feature column has
+    its own storage dtype (column_dtypes), and columns of one dtype share
+    an (N * C, F_dtype) code matrix in `codes`:
+
+      "float32": the feature values themselves.
+      "int16" / "int8": affine quantization, value = offset + scale * code
+                 with per-column scale / offset and the type's minimum
+                 reserved for NaN. Whole-valued columns that fit the type
+                 get scale 1 and round-trip exactly.
+
+    Quantized columns named in `categories` are dictionary-encoded
+    instead: code k stands for categories[name][k] (e.g. a pandas
+    category code), so they round-trip exactly.
+
+    Batches from an all-float32 store are zero-copy views, so predictors
+    read the store directly. As soon as one column is quantized, every
+    batch is decoded into a new float32 (B * C, F) block, i.e. one copy
+    per batch. Implements ImpressionSource.
+    """
+    imp_ids: np.ndarray          # (N,) int64
+    ad_ids: np.ndarray           # (N, C) int64
+    advertiser_ids: np.ndarray   # (N, C) int32
+    bids: np.ndarray             # (N, C) float64
+    codes: Dict[str, np.ndarray]  # storage dtype -> (N * C, F_dtype) codes, columns in feature order
+    feature_names: List[str]
+    column_dtypes: List[str]     # (F,) storage dtype of each feature column
+    scale: np.ndarray            # (F,) float32; 1 where unused
+    offset: np.ndarray           # (F,) float32; 0 where unused
+    categories: Dict[str, list] = field(default_factory=dict)
+    chunk_size: int = 4096
+
+    def __post_init__(self) -> None:
+        dtypes = np.asarray(self.column_dtypes)
+        # Feature columns held by each code matrix.
+        self._columns = {dt: np.flatnonzero(dtypes == dt) for dt in self.codes}
+        self._cat_tables = {}
+        for name, values in self.categories.items():
+            j = self.feature_names.index(name)
+            dt = self.column_dtypes[j]
+            pos = int(np.searchsorted(self._columns[dt], j))
+            self._cat_tables[j] = (dt, pos, np.append(np.asarray(values, dtype=np.float32), np.float32(np.nan)))
+
+    @property
+    def precision(self) -> str:
+        """Storage dtype shared by every feature column, or "mixed"."""
+        kinds = set(self.column_dtypes)
+        return kinds.pop() if len(kinds) == 1 else "mixed"
+
+    @property
+    def n_impressions(self) -> int:
+        return int(self.ad_ids.shape[0])
+
+    @property
+    def n_candidates(self) -> int:
+        return int(self.ad_ids.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        arrays = sum(getattr(self, name).nbytes for name in _ARRAYS)
+        return int(arrays + sum(codes.nbytes for codes in self.codes.values()))
+
+    @property
+    def bytes_per_candidate(self) -> float:
+        return self.nbytes / max(1, self.n_impressions * self.n_candidates)
+
+    @classmethod
+    def from_source(
+        cls,
+        source: Union[ImpressionSource, Iterable[ImpressionBatch]],
+        precision: Union[str, Mapping[str, str]] = "float32",
+        categorical: Sequence[str] = (),
+        chunk_size: int = 4096,
+        max_error: Optional[float] = None,
+    ) -> "CandidateStore":
+        """
+        Encode every batch of `source`.
+
+        `precision` is one storage dtype for every column, or a mapping
+        from feature name to dtype (unlisted columns stay float32). "auto"
+        picks per column from its range: whole-valued columns get the
+        smallest integer type that holds them exactly, categorical columns
+        the smallest that holds their dictionary, and continuous columns
+        int16, or with `max_error` the smallest type whose rounding error
+        (half a quantization step) stays within it, falling back to
+        float32. Anything but float32 needs per-column ranges first, so
+        the source is read twice (it must be re-iterable, as
+        FeatureBankSource and ArraySource are).
+        """
+        specs = [precision] if isinstance(precision, str) else list(precision.values())
+        for spec in specs:
+            if spec != AUTO and spec not in PRECISIONS:
+                raise ValueError(f"unknown precision: {spec!r}; expected one of {sorted(PRECISIONS) + [AUTO]}")
+
+        names: Optional[List[str]] = None
+        stats: Optional[_ColumnStats] = None
+        if any(spec != "float32" for spec in specs):
+            for batch in _iter_batches(source):
+                if stats is None:
+                    names = list(batch.feature_names)
+                    stats = _ColumnStats(len(names))
+                stats.update(batch.features, [names.index(name) for name in categorical])
+
+        parts: Dict[str, list] = {name: [] for name in ("imp_ids", "ad_ids", "advertiser_ids", "bids")}
+        code_parts: Dict[str, list] = {}
+        layout = None
+        for batch in _iter_batches(source):
+            if layout is None:
+                names = list(batch.feature_names)
+                layout = _Layout.build(names, precision, categorical, stats, max_error)
+                code_parts = {dt: [] for dt in layout.columns}
+            parts["imp_ids"].append(np.asarray(batch.imp_ids, dtype=np.int64))
+            parts["ad_ids"].append(np.asarray(batch.ad_ids, dtype=np.int64))
+            parts["advertiser_ids"].append(np.asarray(batch.advertiser_ids, dtype=np.int32))
+            parts["bids"].append(np.asarray(batch.bids, dtype=np.float64))
+            for dt, codes in layout.encode(batch.features).items():
+                code_parts[dt].append(codes)
+
+        if layout is None:
+            raise ValueError("source yielded no batches")
+        return cls(
+            **{name: np.concatenate(p) for name, p in parts.items()},
+            codes={dt: np.concatenate(p) for dt, p in code_parts.items()},
+            feature_names=names,
+            column_dtypes=layout.column_dtypes,
+            scale=layout.scale,
+            offset=layout.offset,
+            categories=layout.categories,
+            chunk_size=chunk_size,
+        )
+
+    def decode(self, start: int, stop: int) -> np.ndarray:
+        """
+        Float32 features of code rows [start, stop): a view for an
+        all-float32 store, otherwise a newly decoded block.
+        """
+        if self._columns.keys() == {"float32"}:
+            return self.codes["float32"][start:stop]
+        blocks = {dt: self.codes[dt][start:stop] for dt in self._columns}
+        n_rows = next(iter(blocks.values())).shape[0] if blocks else max(0, stop - start)
+        out = np.empty((n_rows, len(self.feature_names)), dtype=np.float32)
+        for dt, cols in self._columns.items():
+            codes = blocks[dt]
+            if codes.dtype.kind == "f":
+                out[:, cols] = codes
+                continue
+            values = codes.astype(np.float32)
+            values *= self.scale[cols]
+            values += self.offset[cols]
+            values[codes == np.iinfo(codes.dtype).min] = np.nan
+            out[:, cols] = values
+        for j, (dt, pos, table) in self._cat_tables.items():
+            idx = blocks[dt][:, pos].astype(np.int64)
+            out[:, j] = table[np.where(idx < 0, len(table) - 1, idx)]  # NaN code -> last entry
+        return out
+
+    def slice_batch(self, start: int, stop: int) -> ImpressionBatch:
+        C = self.n_candidates
+        return ImpressionBatch(
+            imp_ids=self.imp_ids[start:stop],
+            ad_ids=self.ad_ids[start:stop],
+            advertiser_ids=self.advertiser_ids[start:stop],
+            bids=self.bids[start:stop],
+            features=self.decode(start * C, stop * C),
+            feature_names=self.feature_names,
+        )
+
+    def iter_batches(self) -> Iterator[ImpressionBatch]:
+        for start in range(0, self.n_impressions, self.chunk_size):
+            yield self.slice_batch(start, min(start + self.chunk_size, self.n_impressions))
+
+    def __iter__(self) -> Iterator[Impression]:
+        for batch in self.iter_batches():
+            yield from batch.impressions()
+
+    def impression(self, i: int) -> Impression:
+        """Row i as an Impression whose candidates' features are views of the decoded row block."""
+        return next(self.slice_batch(i, i + 1).impressions())
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        for dt, codes in self.codes.items():
+            np.save(os.path.join(path, f"codes_{dt}.npy"), codes)
+        meta = {
+            "feature_names": self.feature_names,
+            "column_dtypes": self.column_dtypes,
+            "categories": self.categories,
+            "chunk_size": self.chunk_size,
+        }
+        with open(os.path.join(path, _META_FILE), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CandidateStore":
+        """Reopen a saved store; with mmap the arrays are memory-mapped read-only."""
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in _ARRAYS}
+        codes = {
+            dt: np.load(os.path.join(path, f"codes_{dt}.npy"), mmap_mode=mode)
+            for dt in PRECISIONS if dt in meta["column_dtypes"]
+        }
+        return cls(**arrays, codes=codes, **meta)
+
+
+class _ColumnStats:
+    """Per-column range, whole-valuedness and categorical values, batch by batch."""
+
+    def __init__(self, n_features: int) -> None:
+        self.lo = np.full(n_features, np.inf)
+        self.hi = np.full(n_features, -np.inf)
+        self.whole = np.ones(n_features, dtype=bool)
+        self.uniques: Dict[int, np.ndarray] = {}
+
+    def update(self, X: np.ndarray, categorical: Sequence[int]) -> None:
+        with np.errstate(invalid="ignore"):
+            self.lo = np.minimum(self.lo, np.nanmin(X, axis=0, initial=np.inf))
+            self.hi = np.maximum(self.hi, np.nanmax(X, axis=0, initial=-np.inf))
+            self.whole &= np.all(np.isnan(X) | (X == np.rint(X)), axis=0)
+        for j in categorical:
+            col = X[:, j]
+            u = np.unique(col[~np.isnan(col)])
+            self.uniques[j] = u if j not in self.uniques else np.union1d(self.uniques[j], u)
+
+
+@dataclass
+class _Layout:
+    """Storage dtype, scale and offset of every column, and how to encode a batch."""
+    column_dtypes: List[str]
+    scale: np.ndarray
+    offset: np.ndarray
+    categories: Dict[str, list]
+    names: List[str]
+
+    def __post_init__(self) -> None:
+        dtypes = np.asarray(self.column_dtypes)
+        self.columns = {dt: np.flatnonzero(dtypes == dt) for dt in PRECISIONS if dt in self.column_dtypes}
+
+    @classmethod
+    def build(
+        cls,
+        names: List[str],
+        precision: Union[str, Mapping[str, str]],
+        categorical: Sequence[str],
+        stats: Optional[_ColumnStats],
+        max_error: Optional[float] = None,
+    ) -> "_Layout":
+        F = len(names)
+        scale = np.ones(F, dtype=np.float32)
+        offset = np.zeros(F, dtype=np.float32)
+        column_dtypes: List[str] = []
+        categories: Dict[str, list] = {}
+        for j, name in enumerate(names):
+            spec = precision if isinstance(precision, str) else precision.get(name, "float32")
+            if spec == "float32":
+                column_dtypes.append(spec)
+                continue
+            if name in categorical:
+                values = stats.uniques.get(j, np.empty(0))
+                if spec == AUTO:
+                    spec = "int8" if len(values) <= np.iinfo(np.int8).max else "int16"
+                if len(values) > np.iinfo(PRECISIONS[spec]).max:
+                    raise ValueError(f"{name!r} has {len(values)} categories, too many for {spec}")
+                categories[name] = values.tolist()
+                column_dtypes.append(spec)
+                continue
+            lo, hi, whole = stats.lo[j], stats.hi[j], bool(stats.whole[j])
+            if spec == AUTO:
+                spec = _auto_dtype(lo, hi, whole, max_error)
+            if spec == "float32":
+                column_dtypes.append(spec)
+                continue
+            scale[j], offset[j] = _affine_params(np.dtype(PRECISIONS[spec]), lo, hi, whole)
+            column_dtypes.append(spec)
+        return cls(column_dtypes, scale, offset, categories, list(names))
+
+    def encode(self, X: np.ndarray) -> Dict[str, np.ndarray]:
+        out = {}
+        for dt, cols in self.columns.items():
+            dtype = np.dtype(PRECISIONS[dt])
+            block = X[:, cols]
+            if dtype.kind == "f":
+                out[dt] = np.array(block, dtype=dtype)
+                continue
+            info = np.iinfo(dtype)
+            nan = np.isnan(block)
+            q = np.rint((np.where(nan, 0.0, block) - self.offset[cols]) / self.scale[cols])
+            codes = np.clip(q, info.min + 1, info.max).astype(dtype)
+            codes[nan] = info.min
+            for pos, j in enumerate(cols.tolist()):
+                values = self.categories.get(self.names[j])
+                if values is not None:
+                    col = np.where(nan[:, pos], 0.0, block[:, pos])
+                    idx = np.searchsorted(np.asarray(values, dtype=np.float64), col)
+                    codes[:, pos] = np.where(nan[:, pos], info.min, idx)
+            out[dt] = codes
+        return out
+
+
+def _auto_dtype(lo: float, hi: float, whole: bool, max_error: Optional[float]) -> str:
+    span = hi - lo
+    if not np.isfinite(span):
+        return "int8"  # all NaN
+    for dt in ("int8", "int16"):
+        n_steps = np.iinfo(PRECISIONS[dt]).max - (np.iinfo(PRECISIONS[dt]).min + 1)
+        if whole and span <= n_steps:
+            return dt
+        if max_error is not None and not whole and 0.5 * span / n_steps <= max_error:
+            return dt
+    return "int16" if max_error is None else "float32"
+
+
+def _affine_params(dtype: np.dtype, lo: float, hi: float, whole: bool):
+    """(scale, offset) mapping [lo, hi] onto the type's codes above its NaN code."""
+    info = np.iinfo(dtype)
+    q_lo = info.min + 1  # info.min is the NaN code
+    if not np.isfinite(hi - lo):
+        return 1.0, 0.0
+    span = hi - lo
+    if whole and span <= info.max - q_lo:
+        scale = 1.0  # one code per integer: exact
+    else:
+        scale = span / (info.max - q_lo) if span > 0 else 1.0
+    return scale, lo - np.float64(np.float32(scale)) * q_lo
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch
+from ranking_sim.data.schema import Impression
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def frame_to_matrix(
+    frame: "pd.DataFrame",
+    feature_names: Optional[Sequence[str]] = None,
+    pandas_categorical: Optional[List[list]] = None,
+    dtype: np.dtype = np.float32,
+) -> np.ndarray:
+    """
+    Convert a feature DataFrame into a dense (N, F) matrix.
+
+    Categorical columns are replaced by their integer codes (missing -> NaN),
+    which is what LightGBM does internally for pandas input. Pass the
+    booster's `pandas_categorical` so codes line up with the training data.
+    """
+    names = list(frame.columns if feature_names is None else feature_names)
+    out = np.empty((len(frame), len(names)), dtype=dtype)
+
+    cat_i = 0
+    for j, name in enumerate(names):
+        col = frame[name]
+        if str(col.dtype) == "category":
+            if pandas_categorical is not None:
+                col = col.cat.set_categories(pandas_categorical[cat_i])
+            cat_i += 1
+            codes = col.cat.codes.to_numpy()
+            out[:, j] = np.where(codes < 0, np.nan, codes)
+        else:
+            out[:, j] = col.to_numpy(dtype=dtype, na_value=np.nan)
+    return out
+
+
+def bulk_draws(
+    seed: int,
+    chunk_index: int,
+    n_impressions: int,
+    n_candidates: int,
+    n_rows: int,
+    n_advertisers: int,
+):
+    """
+    Bank row indices, advertiser ids and raw bids for one chunk, drawn as
+    whole (B, C) arrays from child SeedSequence `chunk_index` of `seed`.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk_index,)))
+    shape = (n_impressions, n_candidates)
+    idx = rng.integers(0, n_rows, size=shape)
+    advertiser_ids = rng.integers(0, n_advertisers, size=shape)
+    bids = rng.lognormal(mean=-0.2, sigma=0.7, size=shape)
+    return idx, advertiser_ids, bids
+
+
+def sampled_batch(
+    start: int,
+    advertiser_ids: np.ndarray,
+    bids: np.ndarray,
+    features: np.ndarray,
+    feature_names: List[str],
+) -> ImpressionBatch:
+    """Wrap sampled (B, C) draws and their gathered (B * C, F) features as a batch."""
+    B, C = bids.shape
+    imp_ids = np.arange(start, start + B, dtype=np.int64)
+    return ImpressionBatch(
+        imp_ids=imp_ids,
+        ad_ids=imp_ids[:, None] * 10_000 + np.arange(C, dtype=np.int64)[None, :],
+        advertiser_ids=advertiser_ids,
+        bids=np.clip(bids, 0.05, 10.0),
+        features=features,
+        feature_names=feature_names,
+    )
+
+
+@dataclass
+class FeatureBankSource:
+    """
+    Columnar impression generator over a feature bank.
+
+    Each impression gets n_candidates rows sampled with replacement from the
+    bank, an advertiser id in [0, n_advertisers) and a clipped lognormal CPC
+    bid. Features are gathered straight from the (N, F) matrix into each
+    batch, so no per-candidate dicts are built unless Impression objects are
+    explicitly requested.
+
+    rng_mode:
+      "legacy": draws in the same order as the original per-row generator,
+                so a given seed produces identical impressions.
+      "bulk":   draws whole (B, C) arrays per chunk from a child SeedSequence
+                of `seed` (faster; the stream depends on chunk_size).
+    """
+    features: np.ndarray      # (N, F) feature bank
+    feature_names: List[str]
+    n_impressions: int
+    n_candidates: int
+    seed: int
+    chunk_size: int = 4096
+    n_advertisers: int = 200
+    rng_mode: str = "legacy"
+
+    def __post_init__(self) -> None:
+        if self.rng_mode not in ("legacy", "bulk"):
+            raise ValueError(f"unknown rng_mode: {self.rng_mode!r}")
+        if self.features.ndim != 2 or self.features.shape[1] != len(self.feature_names):
+            raise ValueError("features must be (N, F) with one column per feature name")
+
+    @classmethod
+    def from_frame(
+        cls,
+        feature_bank: "pd.DataFrame",
+        n_impressions: int,
+        n_candidates: int,
+        seed: int,
+        feature_names: Optional[Sequence[str]] = None,
+        pandas_categorical: Optional[List[list]] = None,
+        dtype: np.dtype = np.float32,
+        **kwargs,
+    ) -> "FeatureBankSource":
+        names = list(feature_bank.columns if feature_names is None else feature_names)
+        matrix = frame_to_matrix(feature_bank, names, pandas_categorical, dtype=dtype)
+        return cls(
+            features=matrix,
+            feature_names=names,
+            n_impressions=n_impressions,
+            n_candidates=n_candidates,
+            seed=seed,
+            **kwargs,
+        )
+
+    def iter_batches(self) -> Iterator[ImpressionBatch]:
+        legacy_rng = np.random.default_rng(self.seed) if self.rng_mode == "legacy" else None
+
+        C = int(self.n_candidates)
+        for chunk_index, start in enumerate(range(0, self.n_impressions, self.chunk_size)):
+            stop = min(start + self.chunk_size, self.n_impressions)
+            if legacy_rng is not None:
+                idx, advertiser_ids, bids = self._draw_legacy(legacy_rng, stop - start)
+            else:
+                idx, advertiser_ids, bids = bulk_draws(
+                    self.seed, chunk_index, stop - start, C, len(self.features), self.n_advertisers
+                )
+            yield sampled_batch(start, advertiser_ids, bids, self.features[idx.reshape(-1)], self.feature_names)
+
+    def __iter__(self) -> Iterator[Impression]:
+        for batch in self.iter_batches():
+            yield from batch.impressions()
+
+    def _draw_legacy(self, rng: np.random.Generator, B: int):
+        # Same call sequence as the original generator: one index draw per
+        # impression, then interleaved scalar advertiser / bid draws.
+        N = len(self.features)
+        C = int(self.n_candidates)
+        idx = np.empty((B, C), dtype=np.int64)
+        advertiser_ids = np.empty((B, C), dtype=np.int64)
+        bids = np.empty((B, C), dtype=np.float64)
+        for i in range(B):
+            idx[i] = rng.integers(0, N, size=C)
+            adv_row = advertiser_ids[i]
+            bid_row = bids[i]
+            for j in range(C):
+                adv_row[j] = rng.integers(0, self.n_advertisers)
+                bid_row[j] = rng.lognormal(mean=-0.2, sigma=0.7)
+        return idx, advertiser_ids, bids
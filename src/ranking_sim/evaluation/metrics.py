@@ -1,10 +1,23 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import Dict
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
 
 from ranking_sim.data.schema import SimStepResult
-from ranking_sim.evaluation.ranking_metrics import ndcg
+from ranking_sim.evaluation.ranking_metrics import ndcg, ndcg_batch
+from ranking_sim.evaluation.stats import BatchMeans, RunningMoments, shard_bootstrap_ci
+
+_POS_FIELDS = ("pos_imps", "pos_clicks", "pos_rev", "pos_pctr_sum", "pos_bid_sum")
+
+# Per-impression quantities that get streaming variance / CIs.
+CI_METRICS = {
+    "clicks_per_impression": "imp_clicks",
+    "revenue_per_impression": "imp_revenue",
+    "ndcg": "imp_ndcg",
+}
+
 
 @dataclass
 class MetricsAggregator:
@@ -16,35 +29,268 @@ class MetricsAggregator:
     ndcg_sum: float = 0.0
     ndcg_count: int = 0
     ndcg_k: int = 4  # default; will match n_slots if you set it
+    # Ideal DCG over the "shown" slots or over all "candidates" (the latter
+    # needs candidate_rels passed to update / update_many). With
+    # "candidates" it is NDCG@ndcg_k: empty slots count as relevance 0
+    # against the ideal top-ndcg_k candidates.
+    ndcg_ideal: str = "shown"
+
+    # Per-position accumulators, index = position. Sized to ndcg_k and grown
+    # on demand if a longer slate shows up.
+    pos_imps: np.ndarray = field(default=None)       # how many times pos existed
+    pos_clicks: np.ndarray = field(default=None)     # clicks at pos
+    pos_rev: np.ndarray = field(default=None)        # revenue at pos
+    pos_pctr_sum: np.ndarray = field(default=None)   # sum pCTR at pos
+    pos_bid_sum: np.ndarray = field(default=None)    # sum bid at pos
+
+    # Streaming per-impression moments (O(1) memory) for error bars.
+    imp_clicks: RunningMoments = field(default_factory=RunningMoments)
+    imp_revenue: RunningMoments = field(default_factory=RunningMoments)
+    imp_ndcg: RunningMoments = field(default_factory=RunningMoments)
+    ci_level: float = 0.95
+    # Optional batch-means CIs over consecutive blocks of this many impressions.
+    batch_means_size: Optional[int] = None
+    batch_means: Optional[Dict[str, BatchMeans]] = None
+
+    def __post_init__(self) -> None:
+        if self.ndcg_ideal not in ("shown", "candidates"):
+            raise ValueError(f"unknown ndcg_ideal: {self.ndcg_ideal!r}")
+        if self.batch_means_size and self.batch_means is None:
+            self.batch_means = {name: BatchMeans(int(self.batch_means_size)) for name in CI_METRICS}
+        n = max(0, int(self.ndcg_k))
+        if self.pos_imps is None:
+            self.pos_imps = np.zeros(n, dtype=np.int64)
+        if self.pos_clicks is None:
+            self.pos_clicks = np.zeros(n, dtype=np.int64)
+        for name in ("pos_rev", "pos_pctr_sum", "pos_bid_sum"):
+            if getattr(self, name) is None:
+                setattr(self, name, np.zeros(n, dtype=np.float64))
+
+    @property
+    def n_positions(self) -> int:
+        return len(self.pos_imps)
 
-    # Per-position accumulators
-    pos_imps: Dict[int, int] = field(default_factory=dict)          # how many times pos existed
-    pos_clicks: Dict[int, int] = field(default_factory=dict)        # clicks at pos
-    pos_rev: Dict[int, float] = field(default_factory=dict)         # revenue at pos
-    pos_pctr_sum: Dict[int, float] = field(default_factory=dict)    # sum pCTR at pos
-    pos_bid_sum: Dict[int, float] = field(default_factory=dict)     # sum bid at pos
+    def _ensure_positions(self, n: int) -> None:
+        if n <= self.n_positions:
+            return
+        for name in _POS_FIELDS:
+            old = getattr(self, name)
+            new = np.zeros(n, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
 
-    def update(self, step: SimStepResult) -> None:
+    def update(self, step: SimStepResult, candidate_rels: Optional[Sequence[float]] = None) -> None:
         self.impressions += 1
         self.clicks += int(step.total_clicks)
         self.revenue += float(step.total_revenue)
         self.avg_shown += float(len(step.shown_ad_ids))
 
+        if step.slot_outcomes:
+            self._ensure_positions(max(int(s.position) for s in step.slot_outcomes) + 1)
         for s in step.slot_outcomes:
             pos = int(s.position)
-            self.pos_imps[pos] = self.pos_imps.get(pos, 0) + 1
-            self.pos_clicks[pos] = self.pos_clicks.get(pos, 0) + int(s.clicked)
-            self.pos_rev[pos] = self.pos_rev.get(pos, 0.0) + float(s.revenue)
-            self.pos_pctr_sum[pos] = self.pos_pctr_sum.get(pos, 0.0) + float(s.pctr)
-            self.pos_bid_sum[pos] = self.pos_bid_sum.get(pos, 0.0) + float(s.bid_cpc)
-        
+            self.pos_imps[pos] += 1
+            self.pos_clicks[pos] += int(s.clicked)
+            self.pos_rev[pos] += float(s.revenue)
+            self.pos_pctr_sum[pos] += float(s.pctr)
+            self.pos_bid_sum[pos] += float(s.bid_cpc)
+
         # NDCG@K using pCTR as graded relevance for the shown list.
         # rels are in ranked order already (position 0..K-1).
         rels = [float(s.pctr) for s in step.slot_outcomes]
+        ideal_rels = self._ideal_rels(candidate_rels)
+        imp_ndcg = None
         if rels:
-            self.ndcg_sum += float(ndcg(rels, k=min(self.ndcg_k, len(rels))))
+            k = self.ndcg_k if ideal_rels is not None else min(self.ndcg_k, len(rels))
+            imp_ndcg = float(ndcg(rels, k=k, ideal_rels=ideal_rels))
+            self.ndcg_sum += imp_ndcg
             self.ndcg_count += 1
 
+        self.imp_clicks.update(float(step.total_clicks))
+        self.imp_revenue.update(float(step.total_revenue))
+        if imp_ndcg is not None:
+            self.imp_ndcg.update(imp_ndcg)
+        if self.batch_means is not None:
+            self.batch_means["clicks_per_impression"].update_many(np.array([float(step.total_clicks)]))
+            self.batch_means["revenue_per_impression"].update_many(np.array([float(step.total_revenue)]))
+            if imp_ndcg is not None:
+                self.batch_means["ndcg"].update_many(np.array([imp_ndcg]))
+
+    def update_many(
+        self,
+        pctr: np.ndarray,
+        bids: np.ndarray,
+        clicked: np.ndarray,
+        revenue: np.ndarray,
+        shown: Optional[np.ndarray] = None,
+        candidate_rels: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Add B impressions from (B, K) slot-level arrays in rank order.
+        `shown` masks slots that were not filled (default: all filled);
+        filled slots must come before unfilled ones in each row.
+        `candidate_rels` is the (B, C) candidate pCTR matrix, used for the
+        ideal DCG when ndcg_ideal == "candidates".
+
+        Returns the (B,) per-impression NDCG (NaN where no slot was
+        filled), for callers that break it down further.
+        """
+        B, K = pctr.shape
+        if shown is None:
+            shown = np.ones((B, K), dtype=bool)
+        else:
+            shown = np.asarray(shown, dtype=bool)
+            pctr = np.where(shown, pctr, 0.0)
+            bids = np.where(shown, bids, 0.0)
+            clicked = clicked & shown
+            revenue = np.where(shown, revenue, 0.0)
+        self._ensure_positions(K)
+
+        n_shown = shown.sum(axis=1)
+        self.impressions += B
+        self.clicks += int(clicked.sum())
+        self.revenue += float(revenue.sum())
+        self.avg_shown += float(n_shown.sum())
+
+        self.pos_imps[:K] += shown.sum(axis=0)
+        self.pos_clicks[:K] += clicked.sum(axis=0)
+        self.pos_rev[:K] += revenue.sum(axis=0)
+        self.pos_pctr_sum[:K] += pctr.sum(axis=0)
+        self.pos_bid_sum[:K] += bids.sum(axis=0)
+
+        # Unfilled slots carry rel 0, which leaves both DCG and the shown
+        # ideal DCG unchanged, so each row matches ndcg() in update. Against
+        # the candidates' ideal, rows are padded to ndcg_k for the same reason.
+        has_slots = n_shown > 0
+        imp_ndcg = np.empty(0, dtype=np.float64)
+        row_ndcg = np.full(B, np.nan)
+        if K > 0 and has_slots.any():
+            ideal_rels = self._ideal_rels(candidate_rels)
+            rels = pctr
+            if ideal_rels is not None and self.ndcg_k > K:
+                rels = np.pad(pctr, ((0, 0), (0, int(self.ndcg_k) - K)))
+            scores = ndcg_batch(rels, k=int(self.ndcg_k), ideal_rels=ideal_rels)
+            imp_ndcg = scores[has_slots]
+            row_ndcg[has_slots] = imp_ndcg
+            self.ndcg_sum += float(imp_ndcg.sum())
+            self.ndcg_count += int(has_slots.sum())
+
+        per_imp = {
+            "clicks_per_impression": clicked.sum(axis=1),
+            "revenue_per_impression": revenue.sum(axis=1),
+            "ndcg": imp_ndcg,
+        }
+        for name, values in per_imp.items():
+            getattr(self, CI_METRICS[name]).update_many(values)
+            if self.batch_means is not None:
+                self.batch_means[name].update_many(values)
+        return row_ndcg
+
+    def _ideal_rels(self, candidate_rels):
+        if self.ndcg_ideal == "shown":
+            return None
+        if candidate_rels is None:
+            raise ValueError('ndcg_ideal="candidates" needs candidate_rels')
+        return candidate_rels
+
+    def merge(self, other: "MetricsAggregator") -> "MetricsAggregator":
+        """
+        Combine two shards into a new aggregator. Associative, so any
+        reduction tree over shards gives the same counts and (up to float
+        summation order) the same sums.
+        """
+        if (self.ndcg_k, self.ndcg_ideal) != (other.ndcg_k, other.ndcg_ideal):
+            raise ValueError("cannot merge aggregators with different ndcg_k / ndcg_ideal")
+        if (self.batch_means is None) != (other.batch_means is None) or (
+            self.batch_means is not None and self.batch_means_size != other.batch_means_size
+        ):
+            raise ValueError(
+                f"cannot merge aggregators with different batch_means_size "
+                f"({self.batch_means_size} vs {other.batch_means_size})"
+            )
+        out = MetricsAggregator(
+            impressions=self.impressions + other.impressions,
+            clicks=self.clicks + other.clicks,
+            revenue=self.revenue + other.revenue,
+            avg_shown=self.avg_shown + other.avg_shown,
+            ndcg_sum=self.ndcg_sum + other.ndcg_sum,
+            ndcg_count=self.ndcg_count + other.ndcg_count,
+            ndcg_k=self.ndcg_k,
+            ndcg_ideal=self.ndcg_ideal,
+            imp_clicks=self.imp_clicks.merge(other.imp_clicks),
+            imp_revenue=self.imp_revenue.merge(other.imp_revenue),
+            imp_ndcg=self.imp_ndcg.merge(other.imp_ndcg),
+            ci_level=self.ci_level,
+            batch_means_size=self.batch_means_size,
+        )
+        if self.batch_means is not None:
+            out.batch_means = {name: self.batch_means[name].merge(other.batch_means[name]) for name in CI_METRICS}
+        out._ensure_positions(max(self.n_positions, other.n_positions))
+        for name in _POS_FIELDS:
+            acc = getattr(out, name)
+            for part in (getattr(self, name), getattr(other, name)):
+                acc[:len(part)] += part
+        return out
+
+    def state_dict(self) -> dict:
+        """
+        JSON-serializable state. Floats go through repr, so
+        from_state(json.loads(json.dumps(state_dict()))) restores the
+        aggregator bit for bit.
+        """
+        state = {
+            "impressions": int(self.impressions),
+            "clicks": int(self.clicks),
+            "revenue": float(self.revenue),
+            "avg_shown": float(self.avg_shown),
+            "ndcg_sum": float(self.ndcg_sum),
+            "ndcg_count": int(self.ndcg_count),
+            "ndcg_k": int(self.ndcg_k),
+            "ndcg_ideal": self.ndcg_ideal,
+            "ci_level": float(self.ci_level),
+            "batch_means_size": self.batch_means_size,
+        }
+        for name in _POS_FIELDS:
+            state[name] = getattr(self, name).tolist()
+        for name in CI_METRICS.values():
+            m = getattr(self, name)
+            state[name] = [int(m.n), float(m.mean), float(m.m2)]
+        if self.batch_means is not None:
+            state["batch_means"] = {
+                name: [[int(bm.batches.n), float(bm.batches.mean), float(bm.batches.m2)],
+                       float(bm.partial_sum), int(bm.partial_n), int(bm.n_dropped)]
+                for name, bm in self.batch_means.items()
+            }
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> "MetricsAggregator":
+        out = cls(
+            **{k: state[k] for k in (
+                "impressions", "clicks", "revenue", "avg_shown", "ndcg_sum", "ndcg_count",
+                "ndcg_k", "ndcg_ideal", "ci_level", "batch_means_size",
+            )},
+            **{name: RunningMoments(*state[name]) for name in CI_METRICS.values()},
+        )
+        for name in _POS_FIELDS:
+            setattr(out, name, np.asarray(state[name], dtype=getattr(out, name).dtype))
+        if state.get("batch_means") is not None:
+            out.batch_means = {}
+            for name, (batches, partial_sum, partial_n, *dropped) in state["batch_means"].items():
+                bm = BatchMeans(int(out.batch_means_size), RunningMoments(*batches))
+                bm.partial_sum, bm.partial_n = partial_sum, partial_n
+                bm.n_dropped = int(dropped[0]) if dropped else 0
+                out.batch_means[name] = bm
+        return out
+
+    def moments(self, metric: str) -> RunningMoments:
+        """Running moments of a per-impression metric (see CI_METRICS)."""
+        return getattr(self, CI_METRICS[metric])
+
+    def ci_half_width(self, metric: str, level: Optional[float] = None) -> float:
+        lo, hi = self.moments(metric).ci(self.ci_level if level is None else level)
+        return 0.5 * (hi - lo)
+
     def finalize(self) -> dict:
         imps = max(1, self.impressions)
         ctr_per_slot = self.clicks / (imps*self.ndcg_k)
@@ -53,18 +299,18 @@ class MetricsAggregator:
 
         # Build position-level summary
         pos_summary = {}
-        for pos in sorted(self.pos_imps.keys()):
-            n = max(1, self.pos_imps[pos])
-            pos_ctr = self.pos_clicks.get(pos, 0) / n
+        for pos in np.flatnonzero(self.pos_imps).tolist():
+            n = int(self.pos_imps[pos])
             pos_summary[pos] = {
-                "imps": self.pos_imps[pos],
-                "ctr": pos_ctr,
-                "avg_pctr": self.pos_pctr_sum.get(pos, 0.0) / n,
-                "avg_bid_cpc": self.pos_bid_sum.get(pos, 0.0) / n,
-                "avg_rev_per_imp": self.pos_rev.get(pos, 0.0) / n,
+                "imps": n,
+                "ctr": int(self.pos_clicks[pos]) / n,
+                "avg_pctr": float(self.pos_pctr_sum[pos]) / n,
+                "avg_bid_cpc": float(self.pos_bid_sum[pos]) / n,
+                "avg_rev_per_imp": float(self.pos_rev[pos]) / n,
             }
         mean_ndcg = self.ndcg_sum / max(1, self.ndcg_count)
-        return {
+        ci = {name: self.moments(name).summary(self.ci_level) for name in CI_METRICS}
+        out = {
             "impressions": self.impressions,
             "clicks": self.clicks,
             "ctr_per_slot": self.clicks / (imps*self.ndcg_k),
@@ -74,5 +320,51 @@ class MetricsAggregator:
             "avg_ads_shown": self.avg_shown / imps,
             "mean_ndcg": mean_ndcg,
             "ndcg_k": self.ndcg_k,
+            "ndcg_ideal": self.ndcg_ideal,
             "pos": pos_summary,  # <- nested dict keyed by position
-        }
\ No newline at end of file
+            "ci_level": self.ci_level,
+            "ci": ci,  # <- per-impression mean / std / stderr / CI bounds
+        }
+        if self.batch_means is not None:
+            out["batch_means_ci"] = {name: bm.summary(self.ci_level) for name, bm in self.batch_means.items()}
+        return out
+
+
+@dataclass(frozen=True)
+class EarlyStop:
+    """
+    Stop a run once the CI half-width of a per-impression metric
+    (a CI_METRICS key) drops below `half_width`, or below
+    `half_width * |mean|` when `relative` is set.
+    """
+    metric: str = "revenue_per_impression"
+    half_width: float = 0.01
+    relative: bool = False
+    min_impressions: int = 1_000
+    check_every: int = 1_000  # impressions between checks in the per-step runner
+
+    def __post_init__(self) -> None:
+        if self.metric not in CI_METRICS:
+            raise ValueError(f"unknown metric {self.metric!r}; expected one of {sorted(CI_METRICS)}")
+
+    def should_stop(self, metrics: MetricsAggregator) -> bool:
+        if metrics.impressions < self.min_impressions:
+            return False
+        target = self.half_width
+        if self.relative:
+            target *= abs(metrics.moments(self.metric).mean)
+        return metrics.ci_half_width(self.metric) <= target
+
+
+def bootstrap_by_shard(
+    shards: Sequence[MetricsAggregator],
+    metric: str,
+    n_boot: int = 2000,
+    level: float = 0.95,
+    seed: int = 0,
+) -> Tuple[float, float]:
+    """Shard-bootstrap CI of a per-impression metric over independent shards."""
+    moments = [shard.moments(metric) for shard in shards]
+    sums = [m.mean * m.n for m in moments]
+    counts = [m.n for m in moments]
+    return shard_bootstrap_ci(sums, counts, n_boot=n_boot, level=level, seed=seed)
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+from ranking_sim.evaluation.stats import RunningMoments, z_value
+from ranking_sim.simulation.user import position_bias_vector
+from ranking_sim.simulation.vectorized import top_k
+
+ESTIMATORS = ("dm", "ips", "snips", "dr")
+OPE_METRICS = ("clicks_per_impression", "revenue_per_impression")
+
+_META_FILE = "meta.json"
+# (N, C) candidate arrays, then (N, K) slot arrays.
+_CANDIDATE_ARRAYS = ("bids", "pctr", "eligible")
+_SLOT_ARRAYS = ("shown", "filled", "clicked", "price_cpc", "log_propensity")
+
+
+@dataclass
+class SlateLog:
+    """
+    Logged slates for off-policy evaluation: every candidate's bid and
+    pCTR plus the eligibility mask, the shown column indices, clicks,
+    prices, and the logging ranker's prefix log-propensities
+    (SlotArrays.log_propensity). Filled by run_vectorized(slate_log=...)
+    under a stochastic ranker; blocks are kept as a list and
+    concatenated on first access.
+    """
+    n_slots: int
+    position_bias: List[float]
+    _parts: Dict[str, List[np.ndarray]] = field(default_factory=dict, init=False, repr=False)
+    _arrays: Optional[Dict[str, np.ndarray]] = field(default=None, init=False, repr=False)
+
+    def append(self, bids: np.ndarray, pctr: np.ndarray, slots) -> None:
+        if slots.log_propensity is None:
+            raise ValueError("slots carry no propensities; log with a stochastic ranker")
+        eligible = slots.eligible if slots.eligible is not None else np.ones(bids.shape, dtype=bool)
+        block = {
+            "bids": np.asarray(bids, dtype=np.float64),
+            "pctr": np.asarray(pctr, dtype=np.float64),
+            "eligible": np.asarray(eligible, dtype=bool),
+            "shown": np.asarray(slots.shown, dtype=np.int32),
+            "filled": slots.filled,
+            "clicked": slots.clicked,
+            "price_cpc": slots.price_cpc,
+            "log_propensity": slots.log_propensity,
+        }
+        for name, arr in block.items():
+            self._parts.setdefault(name, []).append(arr)
+        self._arrays = None
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        if self._arrays is None:
+            self._arrays = {name: np.concatenate(p) for name, p in self._parts.items()}
+            self._parts = {name: [a] for name, a in self._arrays.items()}
+        return self._arrays
+
+    @property
+    def n_impressions(self) -> int:
+        return int(self.arrays["bids"].shape[0]) if self._parts or self._arrays else 0
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        for name, arr in self.arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), arr)
+        with open(os.path.join(path, _META_FILE), "w") as f:
+            json.dump({"n_slots": self.n_slots, "position_bias": self.position_bias}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "SlateLog":
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        log = cls(n_slots=int(meta["n_slots"]), position_bias=list(meta["position_bias"]))
+        log._arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in _CANDIDATE_ARRAYS + _SLOT_ARRAYS
+        }
+        return log
+
+
+@dataclass
+class _SnipsAcc:
+    """
+    Streaming self-normalized IPS over K positions: V = sum_k S_wr[k] / S_w[k].
+    The K x K cross moments give the delta-method variance of the
+    per-impression influence sum_k w_k (r_k - V_k) / mean(w_k) exactly.
+    """
+    n: int = 0
+    s_w: Optional[np.ndarray] = None
+    s_wr: Optional[np.ndarray] = None
+    m_ww: Optional[np.ndarray] = None
+    m_wwr: Optional[np.ndarray] = None
+    m_wwrr: Optional[np.ndarray] = None
+
+    def update(self, w: np.ndarray, r: np.ndarray) -> None:
+        wr = w * r
+        parts = (
+            w.sum(axis=0),
+            wr.sum(axis=0),
+            w.T @ w,
+            wr.T @ w,      # [k, l] = sum w_k r_k w_l
+            wr.T @ wr,
+        )
+        if self.s_w is None:
+            self.s_w, self.s_wr, self.m_ww, self.m_wwr, self.m_wwrr = parts
+        else:
+            for name, p in zip(("s_w", "s_wr", "m_ww", "m_wwr", "m_wwrr"), parts):
+                setattr(self, name, getattr(self, name) + p)
+        self.n += len(w)
+
+    def summary(self, z: float) -> Dict[str, float]:
+        if not self.n or self.s_w is None:
+            return {"mean": math.nan, "stderr": math.inf, "lo": math.nan, "hi": math.nan}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            v = np.where(self.s_w > 0, self.s_wr / self.s_w, 0.0)
+            scale = np.where(self.s_w > 0, self.n / self.s_w, 0.0)
+        # sum_i (sum_k a_k w_k (r_k - v_k))^2 with a_k = n / S_w[k]
+        cross = self.m_wwrr - self.m_wwr * v[None, :] - self.m_wwr.T * v[:, None] + self.m_ww * np.outer(v, v)
+        var = float(scale @ cross @ scale) / self.n
+        mean = float(v.sum())
+        stderr = math.sqrt(max(var, 0.0) / self.n)
+        return {"mean": mean, "stderr": stderr, "lo": mean - z * stderr, "hi": mean + z * stderr}
+
+
+@dataclass
+class OPEResult:
+    estimates: Dict[str, Dict[str, Dict[str, float]]]   # estimator -> metric -> mean/stderr/lo/hi
+    ess: List[float]            # per-position effective sample size of the prefix weights
+    max_weight: float
+    n_impressions: int
+
+
+def _target_log_propensity(scores: np.ndarray, shown: np.ndarray, filled: np.ndarray, ranker) -> np.ndarray:
+    if ranker is not None:
+        return ranker.log_prefix_propensity(scores, shown, filled)
+    # Deterministic target: probability 1 while its top-K agrees with the logged prefix.
+    ranked = top_k(scores, shown.shape[1])
+    same = (ranked == shown) | ~filled
+    return np.where(np.logical_and.accumulate(same, axis=1), 0.0, -np.inf)
+
+
+def _target_dm(
+    scores: np.ndarray, q: Sequence[np.ndarray], K: int, ranker, rng: np.random.Generator, n_samples: int
+) -> List[np.ndarray]:
+    """(B,) expected sum over slots of each (B, C, K) reward model q under the target ranking."""
+    B = scores.shape[0]
+    rows = np.arange(B)[:, None]
+    pos = np.arange(K)[None, :]
+    if ranker is None:
+        draws = [top_k(scores, K)]
+    else:
+        draws = [ranker.sample(scores, K, rng) for _ in range(int(n_samples))]
+    out = [np.zeros(B) for _ in q]
+    for ranked in draws:
+        ok = np.take_along_axis(scores, ranked, axis=1) > -np.inf
+        for acc, qm in zip(out, q):
+            acc += np.where(ok, qm[rows, ranked, pos], 0.0).sum(axis=1)
+    return [acc / len(draws) for acc in out]
+
+
+def evaluate_policies(
+    log: SlateLog,
+    policies: Mapping[str, object],
+    ranker=None,
+    position_bias: Optional[Sequence[float]] = None,
+    chunk_size: int = 65_536,
+    n_samples: int = 16,
+    seed: int = 0,
+    ci_level: float = 0.95,
+) -> Dict[str, OPEResult]:
+    """
+    Estimate clicks and revenue per impression of each target policy from
+    a SlateLog, without simulating again.
+
+    Targets rank the logged candidates with policy.score_batch(bids,
+    pctr) (same eligibility as logged), either deterministically (ranker
+    None: top-K) or with a stochastic `ranker`. Rewards at slot k are
+    reweighted by the prefix ratio
+      w_k = P_target(shown[:k+1]) / P_log(shown[:k+1]),
+    which is unbiased whenever the reward at slot k depends only on the
+    ads at slots <= k (position-bias and cascade click models). Revenue
+    reuses the logged price_cpc, so its estimates are only unbiased when
+    the price does not depend on the ranking scores (FirstPriceCPC); GSP
+    and VCG prices follow the logging policy's scores and next-ranked ad
+    and come out biased for targets that rank differently.
+
+      dm:    direct method, reward model q(a, k) = pCTR_a * position_bias[k]
+             clicks and q * bid_a revenue (exact for position-bias clicks
+             and first-price CPC; biased under cascade clicks)
+      ips:   sum_k w_k r_k
+      snips: per-position self-normalized IPS
+      dr:    dm + sum_k w_k (r_k - q(shown_k, k))
+
+    Each policy costs one score_batch and a few (N, K) array ops per
+    chunk; the dm/dr target expectation of a stochastic ranker is
+    averaged over n_samples draws. Deterministic targets that rarely
+    agree with the logged slates get few non-zero weights (see `ess`).
+    """
+    A = log.arrays
+    N = int(A["bids"].shape[0])
+    K = int(A["shown"].shape[1])
+    pb = position_bias_vector(log.position_bias if position_bias is None else position_bias, K)
+    z = z_value(ci_level)
+    rng = np.random.default_rng(seed)
+
+    results: Dict[str, OPEResult] = {}
+    for name, policy in policies.items():
+        moments = {e: {m: RunningMoments() for m in OPE_METRICS} for e in ("dm", "ips", "dr")}
+        snips = {m: _SnipsAcc() for m in OPE_METRICS}
+        s_w = np.zeros(K)
+        s_ww = np.zeros(K)
+        max_w = 0.0
+
+        for start in range(0, N, chunk_size):
+            sl = slice(start, min(start + chunk_size, N))
+            bids = np.asarray(A["bids"][sl])
+            pctr = np.asarray(A["pctr"][sl])
+            shown = np.asarray(A["shown"][sl], dtype=np.int64)
+            filled = np.asarray(A["filled"][sl])
+            clicked = np.asarray(A["clicked"][sl], dtype=np.float64)
+            price = np.asarray(A["price_cpc"][sl])
+
+            scores = np.where(np.asarray(A["eligible"][sl]), policy.score_batch(bids, pctr), -np.inf)
+            target = _target_log_propensity(scores, shown, filled, ranker)
+            with np.errstate(invalid="ignore"):
+                w = np.where(filled, np.exp(target - np.asarray(A["log_propensity"][sl])), 0.0)
+
+            q_click = pctr[:, :, None] * pb[None, None, :]           # (B, C, K)
+            q_rev = q_click * bids[:, :, None]
+            dm_click, dm_rev = _target_dm(scores, (q_click, q_rev), K, ranker, rng, n_samples)
+
+            shown_pctr = np.take_along_axis(pctr, shown, axis=1)
+            shown_bid = np.take_along_axis(bids, shown, axis=1)
+            q_shown_click = np.where(filled, shown_pctr * pb[None, :], 0.0)
+            q_shown_rev = q_shown_click * shown_bid
+
+            for m, r, q_shown, dm in (
+                ("clicks_per_impression", clicked, q_shown_click, dm_click),
+                ("revenue_per_impression", price, q_shown_rev, dm_rev),
+            ):
+                moments["dm"][m].update_many(dm)
+                moments["ips"][m].update_many((w * r).sum(axis=1))
+                moments["dr"][m].update_many(dm + (w * (r - q_shown)).sum(axis=1))
+                snips[m].update(w, r)
+
+            s_w += w.sum(axis=0)
+            s_ww += np.square(w).sum(axis=0)
+            if w.size:
+                max_w = max(max_w, float(w.max()))
+
+        estimates = {e: {m: acc.summary(ci_level) for m, acc in moments[e].items()} for e in ("dm", "ips", "dr")}
+        estimates["snips"] = {m: snips[m].summary(z) for m in OPE_METRICS}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ess = np.where(s_ww > 0, np.square(s_w) / s_ww, 0.0)
+        results[name] = OPEResult(
+            estimates={e: estimates[e] for e in ESTIMATORS},
+            ess=ess.tolist(),
+            max_weight=max_w,
+            n_impressions=N,
+        )
+    return results
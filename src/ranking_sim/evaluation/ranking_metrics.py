@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import math
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
 
 
 def _discount(i: int) -> float:
@@ -17,8 +20,58 @@ def dcg(rels: List[float], k: int) -> float:
     return s
 
 
-def ndcg(rels_in_rank_order: List[float], k: int) -> float:
+def ndcg(rels_in_rank_order: List[float], k: int, ideal_rels: Optional[List[float]] = None) -> float:
+    """
+    Reference per-impression NDCG@k. The ideal ranking is built from
+    `ideal_rels` (e.g. every candidate's relevance) when given, otherwise
+    from the shown list itself.
+    """
     d = dcg(rels_in_rank_order, k)
-    ideal = sorted(rels_in_rank_order, reverse=True)
+    ideal = sorted(rels_in_rank_order if ideal_rels is None else ideal_rels, reverse=True)
     id_ = dcg(ideal, k)
-    return 0.0 if id_ <= 0.0 else d / id_
\ No newline at end of file
+    return 0.0 if id_ <= 0.0 else d / id_
+
+
+@lru_cache(maxsize=64)
+def discount_vector(k: int) -> np.ndarray:
+    """Read-only (k,) vector of 1 / log2(rank + 1), computed once per k."""
+    disc = 1.0 / np.log2(np.arange(int(k), dtype=np.float64) + 2.0)
+    disc.setflags(write=False)
+    return disc
+
+
+def dcg_batch(rels: np.ndarray, k: int) -> np.ndarray:
+    """(B,) DCG@k of a (B, K) relevance matrix in rank order."""
+    k = min(int(k), rels.shape[1])
+    return rels[:, :k] @ discount_vector(k)
+
+
+def ideal_dcg_batch(rels: np.ndarray, k: int) -> np.ndarray:
+    """
+    (B,) ideal DCG@k of a (B, C) relevance matrix. Only the k best entries
+    per row are needed, so they are selected with a partition and just
+    those k are sorted.
+    """
+    B, C = rels.shape
+    k = min(int(k), C)
+    if k <= 0:
+        return np.zeros(B, dtype=np.float64)
+    top = -np.partition(-rels, k - 1, axis=1)[:, :k] if k < C else rels
+    return -np.sort(-top, axis=1) @ discount_vector(k)
+
+
+def ndcg_batch(rels_in_rank_order: np.ndarray, k: int, ideal_rels: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    (B,) NDCG@k for B ranked lists at once.
+
+    rels_in_rank_order: (B, K) relevance of the shown items, position 0 first.
+                        Pad unfilled slots with 0.
+    ideal_rels:         optional (B, C) relevance of the full candidate set;
+                        the ideal DCG is then taken over all candidates
+                        instead of only the shown slots.
+    Rows whose ideal DCG is not positive get 0, as in ndcg().
+    """
+    k = min(int(k), rels_in_rank_order.shape[1])
+    d = dcg_batch(rels_in_rank_order, k)
+    id_ = ideal_dcg_batch(rels_in_rank_order if ideal_rels is None else ideal_rels, k)
+    return np.divide(d, id_, out=np.zeros_like(d), where=id_ > 0.0)
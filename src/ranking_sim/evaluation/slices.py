@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch
+
+SLICE_LEVELS = ("slot", "impression")
+
+# Accumulated per segment code, by level.
+_SLOT_FIELDS = ("shows", "clicks", "revenue", "pctr_sum", "bid_sum")
+_IMP_FIELDS = ("impressions", "clicks", "clicks_sq", "revenue", "revenue_sq", "ndcg_sum", "ndcg_sq", "ndcg_count")
+
+
+class SliceKey(Protocol):
+    name: str
+    level: str   # "slot": segments each shown slot; "impression": each impression
+
+    def codes(self, batch: ImpressionBatch, pctr: np.ndarray, shown: np.ndarray) -> np.ndarray:
+        """Non-negative int segment codes: (B, K) for slot keys, (B,) for impression keys."""
+
+    def label(self, code: int) -> Any:
+        """Human-readable segment for a code."""
+
+
+@dataclass(frozen=True)
+class AdvertiserSlice:
+    """Shown slots by advertiser id (ids are the codes, so they must be >= 0)."""
+    name: str = "advertiser_id"
+    level: str = "slot"
+
+    def codes(self, batch: ImpressionBatch, pctr: np.ndarray, shown: np.ndarray) -> np.ndarray:
+        return np.take_along_axis(batch.advertiser_ids, shown, axis=1)
+
+    def label(self, code: int) -> Any:
+        return int(code)
+
+
+@dataclass(frozen=True)
+class PCTRBuckets:
+    """
+    pCTR buckets split at `edges` (ascending; len(edges) + 1 buckets).
+    level="slot" buckets each shown ad's pCTR; level="impression" buckets
+    the impression by its best candidate's pCTR.
+    """
+    edges: Tuple[float, ...]
+    level: str = "slot"
+    name: str = "pctr_bucket"
+
+    @classmethod
+    def quantiles(cls, pctr: np.ndarray, n_buckets: int = 10, **kwargs) -> "PCTRBuckets":
+        """Buckets at the quantiles of a pCTR sample, e.g. deciles of a cached (N, C) matrix."""
+        qs = np.quantile(np.asarray(pctr, dtype=np.float64).reshape(-1), np.linspace(0.0, 1.0, n_buckets + 1)[1:-1])
+        return cls(edges=tuple(float(q) for q in np.unique(qs)), **kwargs)
+
+    def codes(self, batch: ImpressionBatch, pctr: np.ndarray, shown: np.ndarray) -> np.ndarray:
+        values = np.take_along_axis(pctr, shown, axis=1) if self.level == "slot" else pctr.max(axis=1)
+        return np.searchsorted(np.asarray(self.edges), values, side="right")
+
+    def label(self, code: int) -> Any:
+        lo = self.edges[code - 1] if code > 0 else -math.inf
+        hi = self.edges[code] if code < len(self.edges) else math.inf
+        return f"[{lo:.6g}, {hi:.6g})"
+
+
+@dataclass
+class ContextSlice:
+    """
+    Impressions by the value of one Impression.context field.
+
+    Codes are looked up in `codes_by_imp` (indexed by imp_id) when given,
+    see from_values; otherwise each batch's contexts are dictionary-encoded
+    as they arrive (one dict lookup per impression, missing -> None).
+    """
+    field_name: str
+    codes_by_imp: Optional[np.ndarray] = None
+    labels: List[Any] = field(default_factory=list)
+    name: str = ""
+    level: str = "impression"
+    _index: Dict[Any, int] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.name = self.name or self.field_name
+        self._index = {v: i for i, v in enumerate(self.labels)}
+
+    @classmethod
+    def from_values(cls, field_name: str, values: Sequence[Any], **kwargs) -> "ContextSlice":
+        """Precompute codes once from the field's value for every imp_id 0..N-1."""
+        labels, codes = np.unique(np.asarray(values), return_inverse=True)
+        return cls(field_name, codes_by_imp=codes.astype(np.int64), labels=labels.tolist(), **kwargs)
+
+    def codes(self, batch: ImpressionBatch, pctr: np.ndarray, shown: np.ndarray) -> np.ndarray:
+        if self.codes_by_imp is not None:
+            return self.codes_by_imp[batch.imp_ids]
+        if batch.contexts is None:
+            raise ValueError(f"batch has no contexts to slice by {self.field_name!r}; use ContextSlice.from_values")
+        out = np.empty(batch.n_impressions, dtype=np.int64)
+        for i, ctx in enumerate(batch.contexts):
+            v = ctx.get(self.field_name)
+            code = self._index.get(v)
+            if code is None:
+                code = self._index[v] = len(self.labels)
+                self.labels.append(v)
+            out[i] = code
+        return out
+
+    def label(self, code: int) -> Any:
+        return self.labels[code]
+
+
+@dataclass
+class SliceAggregator:
+    """
+    Metrics broken down by segment keys (SliceKey), for the array engine.
+
+    Each batch costs one codes() call per key and one np.bincount per
+    accumulated field, whatever the number of segments; accumulators are
+    dense per-code arrays grown on demand. Slot keys (advertiser, shown
+    pCTR) count shows, clicks, revenue, pCTR and bids of the shown slots;
+    impression keys (context fields, best-candidate pCTR) count
+    impressions, clicks, revenue and NDCG with squared sums for stderrs.
+    Pass one to run_vectorized(slices=...); it is updated in place.
+    """
+    keys: Sequence[SliceKey]
+    _acc: Dict[str, Dict[str, np.ndarray]] = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        names = [k.name for k in self.keys]
+        if len(set(names)) != len(names):
+            raise ValueError(f"slice key names must be unique, got {names}")
+        for key in self.keys:
+            if key.level not in SLICE_LEVELS:
+                raise ValueError(f"unknown slice level: {key.level!r}; expected one of {SLICE_LEVELS}")
+            fields = _SLOT_FIELDS if key.level == "slot" else _IMP_FIELDS
+            self._acc[key.name] = {f: np.zeros(0, dtype=np.float64) for f in fields}
+
+    def update(self, batch: ImpressionBatch, pctr: np.ndarray, slots, ndcg: Optional[np.ndarray] = None) -> None:
+        """
+        Add one batch: its (B, C) pCTRs, SlotArrays, and the per-impression
+        NDCG returned by MetricsAggregator.update_many (NaN = nothing shown).
+        """
+        filled = slots.filled
+        slot_weights = imp_weights = None
+        for key in self.keys:
+            codes = np.asarray(key.codes(batch, pctr, slots.shown), dtype=np.int64)
+            if key.level == "slot":
+                if slot_weights is None:
+                    slot_weights = {
+                        "shows": None,
+                        "clicks": slots.clicked[filled].astype(np.float64),
+                        "revenue": slots.revenue[filled],
+                        "pctr_sum": slots.pctr[filled],
+                        "bid_sum": slots.bids[filled],
+                    }
+                self._add(key.name, codes[filled], slot_weights)
+            else:
+                if imp_weights is None:
+                    clicks = (slots.clicked & filled).sum(axis=1).astype(np.float64)
+                    revenue = np.where(filled, slots.revenue, 0.0).sum(axis=1)
+                    has = ~np.isnan(ndcg) if ndcg is not None else np.zeros(len(codes), dtype=bool)
+                    nd = np.where(has, ndcg, 0.0) if ndcg is not None else np.zeros(len(codes))
+                    imp_weights = {
+                        "impressions": None,
+                        "clicks": clicks,
+                        "clicks_sq": clicks * clicks,
+                        "revenue": revenue,
+                        "revenue_sq": revenue * revenue,
+                        "ndcg_sum": nd,
+                        "ndcg_sq": nd * nd,
+                        "ndcg_count": has.astype(np.float64),
+                    }
+                self._add(key.name, codes, imp_weights)
+
+    def _add(self, name: str, codes: np.ndarray, weights: Dict[str, Optional[np.ndarray]]) -> None:
+        acc = self._acc[name]
+        n = max(len(next(iter(acc.values()))), int(codes.max()) + 1 if codes.size else 0)
+        for f, w in weights.items():
+            part = np.bincount(codes, weights=w, minlength=n)
+            if len(acc[f]) < n:
+                acc[f] = np.concatenate([acc[f], np.zeros(n - len(acc[f]))])
+            acc[f] += part
+
+    def merge(self, other: "SliceAggregator") -> "SliceAggregator":
+        """Combine two shards over the same keys (accumulators are plain sums)."""
+        out = SliceAggregator(self.keys)
+        for name, acc in out._acc.items():
+            for f in acc:
+                a, b = self._acc[name][f], other._acc[name][f]
+                merged = np.zeros(max(len(a), len(b)))
+                merged[:len(a)] += a
+                merged[:len(b)] += b
+                acc[f] = merged
+        return out
+
+    def table(self, name: str) -> Dict[str, np.ndarray]:
+        """Columns per segment code (index = code) of one key, including empty codes."""
+        key = next(k for k in self.keys if k.name == name)
+        a = self._acc[name]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if key.level == "slot":
+                n = a["shows"]
+                return {
+                    "shows": n,
+                    "clicks": a["clicks"],
+                    "revenue": a["revenue"],
+                    "ctr": a["clicks"] / n,
+                    "revenue_per_show": a["revenue"] / n,
+                    "avg_pctr": a["pctr_sum"] / n,
+                    "avg_bid_cpc": a["bid_sum"] / n,
+                }
+            n = a["impressions"]
+            out = {"impressions": n}
+            for metric, s, sq, cnt in (
+                ("clicks_per_impression", "clicks", "clicks_sq", n),
+                ("revenue_per_impression", "revenue", "revenue_sq", n),
+                ("ndcg", "ndcg_sum", "ndcg_sq", a["ndcg_count"]),
+            ):
+                mean = a[s] / cnt
+                var = np.maximum(a[sq] / cnt - mean * mean, 0.0) * cnt / (cnt - 1)
+                out[metric] = mean
+                out[metric + "_stderr"] = np.sqrt(var / cnt)
+            return out
+
+    def finalize(self) -> Dict[str, Dict[Any, Dict[str, float]]]:
+        """key name -> segment label -> metrics, for segments that were seen."""
+        out: Dict[str, Dict[Any, Dict[str, float]]] = {}
+        for key in self.keys:
+            t = self.table(key.name)
+            seen = np.flatnonzero(t["shows"] if key.level == "slot" else t["impressions"])
+            cols = {c: v[seen].tolist() for c, v in t.items()}
+            out[key.name] = {
+                key.label(code): {c: v[i] for c, v in cols.items()}
+                for i, code in enumerate(seen.tolist())
+            }
+        return out
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+
+def z_value(level: float) -> float:
+    """Two-sided normal critical value, e.g. 1.96 for level=0.95."""
+    return NormalDist().inv_cdf(0.5 + 0.5 * float(level))
+
+
+@dataclass
+class RunningMoments:
+    """
+    Streaming count / mean / sum of squared deviations (Welford).
+    Blocks and shards are combined with Chan et al.'s pairwise update,
+    so memory stays O(1) however many values are seen.
+    """
+    n: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+
+    def update(self, x: float) -> None:
+        x = float(x)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def update_many(self, xs: np.ndarray) -> None:
+        xs = np.asarray(xs, dtype=np.float64).reshape(-1)
+        if xs.size == 0:
+            return
+        mean_b = float(xs.mean())
+        self._combine(int(xs.size), mean_b, float(np.square(xs - mean_b).sum()))
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        out = RunningMoments(self.n, self.mean, self.m2)
+        out._combine(other.n, other.mean, other.m2)
+        return out
+
+    def _combine(self, n_b: int, mean_b: float, m2_b: float) -> None:
+        if n_b == 0:
+            return
+        n_a = self.n
+        n = n_a + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * n_a * n_b / n
+        self.n = n
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def stderr(self) -> float:
+        return math.sqrt(self.variance / self.n) if self.n > 1 else math.inf
+
+    def ci(self, level: float = 0.95) -> Tuple[float, float]:
+        h = z_value(level) * self.stderr
+        return self.mean - h, self.mean + h
+
+    def summary(self, level: float = 0.95) -> Dict[str, float]:
+        lo, hi = self.ci(level)
+        return {"mean": self.mean, "std": math.sqrt(self.variance), "stderr": self.stderr, "lo": lo, "hi": hi}
+
+
+@dataclass
+class BatchMeans:
+    """
+    Batch-means variance estimate: values are grouped into consecutive
+    batches of `batch_size` and the CI is built from the spread of batch
+    means. Only the running partial batch and the moments of completed
+    batch means are kept; values that end up in no complete batch (see
+    merge) are counted in n_dropped.
+    """
+    batch_size: int
+    batches: RunningMoments = field(default_factory=RunningMoments)
+    partial_sum: float = 0.0
+    partial_n: int = 0
+    n_dropped: int = 0
+
+    def update_many(self, xs: np.ndarray) -> None:
+        xs = np.asarray(xs, dtype=np.float64).reshape(-1)
+        bs = int(self.batch_size)
+
+        # Top up the open batch first.
+        take = min(bs - self.partial_n, xs.size)
+        self.partial_sum += float(xs[:take].sum())
+        self.partial_n += take
+        xs = xs[take:]
+        if self.partial_n == bs:
+            self.batches.update(self.partial_sum / bs)
+            self.partial_sum, self.partial_n = 0.0, 0
+
+        n_full = xs.size // bs
+        if n_full:
+            self.batches.update_many(xs[:n_full * bs].reshape(n_full, bs).mean(axis=1))
+        rest = xs[n_full * bs:]
+        self.partial_sum += float(rest.sum())
+        self.partial_n += int(rest.size)
+
+    def merge(self, other: "BatchMeans") -> "BatchMeans":
+        """
+        Completed batches are pooled. The two open batches are folded into
+        one while that stays within batch_size; otherwise `other`'s stays
+        open and self's is dropped, since its values cannot be split to
+        close a batch of exactly batch_size.
+        """
+        out = BatchMeans(self.batch_size, self.batches.merge(other.batches))
+        out.n_dropped = self.n_dropped + other.n_dropped
+        if self.partial_n + other.partial_n < out.batch_size:
+            out.partial_sum = self.partial_sum + other.partial_sum
+            out.partial_n = self.partial_n + other.partial_n
+        else:
+            out.partial_sum, out.partial_n = other.partial_sum, other.partial_n
+            out.n_dropped += self.partial_n
+        return out
+
+    def ci(self, level: float = 0.95) -> Tuple[float, float]:
+        return self.batches.ci(level)
+
+    def summary(self, level: float = 0.95) -> Dict[str, float]:
+        out = self.batches.summary(level)
+        out["n_batches"] = self.batches.n
+        out["n_dropped"] = self.n_dropped
+        return out
+
+
+def shard_bootstrap_ci(
+    sums: Sequence[float],
+    counts: Sequence[int],
+    n_boot: int = 2000,
+    level: float = 0.95,
+    seed: int = 0,
+) -> Tuple[float, float]:
+    """
+    Percentile bootstrap CI of a ratio mean (sum / count) by resampling
+    whole shards with replacement. Needs only one (sum, count) per shard.
+    """
+    sums = np.asarray(sums, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(sums), size=(int(n_boot), len(sums)))
+    est = sums[idx].sum(axis=1) / np.maximum(counts[idx].sum(axis=1), 1.0)
+    alpha = 1.0 - float(level)
+    lo, hi = np.quantile(est, [alpha / 2.0, 1.0 - alpha / 2.0])
+    return float(lo), float(hi)
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from typing import List, Sequence
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch
+from ranking_sim.data.schema import Impression
+
+
+def _missing_error(what: str, missing: Sequence[str]) -> KeyError:
+    return KeyError(
+        f"{what} missing required feature columns. "
+        f"Example missing columns: {list(missing)[:10]} (showing up to 10)."
+    )
+
+
+def stack_candidate_features(
+    impressions: Sequence[Impression],
+    feature_names: List[str],
+    dtype: np.dtype = np.float64,
+) -> np.ndarray:
+    """Stack every candidate's features into one (n_candidates_total, F) matrix in model column order."""
+    needed = set(feature_names)
+    n_rows = sum(len(imp.candidates) for imp in impressions)
+    X = np.empty((n_rows, len(feature_names)), dtype=dtype)
+
+    r = 0
+    for imp in impressions:
+        for c in imp.candidates:
+            if not needed.issubset(c.features.keys()):
+                raise _missing_error(f"Candidate {c.ad_id}", sorted(needed - set(c.features.keys())))
+            X[r] = [c.features[k] for k in feature_names]
+            r += 1
+    return X
+
+
+def batch_feature_matrix(batch: ImpressionBatch, feature_names: List[str]) -> np.ndarray:
+    """The batch's (B * C, F) feature matrix with columns reordered to feature_names if needed."""
+    if list(batch.feature_names) == list(feature_names):
+        return batch.features
+    index = {name: j for j, name in enumerate(batch.feature_names)}
+    missing = [k for k in feature_names if k not in index]
+    if missing:
+        raise _missing_error("Batch", missing)
+    return batch.features[:, [index[k] for k in feature_names]]
@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch
+from ranking_sim.data.schema import Impression
+from ranking_sim.models.features import batch_feature_matrix, stack_candidate_features
+
+# decision_type bit layout (LightGBM tree.h)
+_CATEGORICAL_MASK = 1
+_DEFAULT_LEFT_MASK = 2
+_MISSING_NONE = 0
+_MISSING_ZERO = 1
+_MISSING_NAN = 2
+_ZERO_THRESHOLD = 1e-35
+
+_SIGMOID_OBJECTIVES = ("binary", "cross_entropy", "xentropy")
+
+
+def _parse_blocks(text: str):
+    """Split a LightGBM model file into the header dict, per-tree dicts and pandas_categorical."""
+    header: Dict[str, str] = {}
+    trees: List[Dict[str, str]] = []
+    pandas_categorical = None
+    current = header
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("Tree="):
+            current = {}
+            trees.append(current)
+        elif line == "end of trees":
+            current = {}
+        elif line.startswith("pandas_categorical:"):
+            pandas_categorical = json.loads(line[len("pandas_categorical:"):] or "null")
+        elif line and not line.startswith("["):
+            # Bare flags such as "average_output" carry no value.
+            key, _, value = line.partition("=")
+            current[key] = value
+    return header, trees, pandas_categorical
+
+
+def _ints(block: Dict[str, str], key: str) -> np.ndarray:
+    return np.array(block[key].split(), dtype=np.int64) if block.get(key) else np.empty(0, dtype=np.int64)
+
+
+def _floats(block: Dict[str, str], key: str) -> np.ndarray:
+    return np.array(block[key].split(), dtype=np.float64) if block.get(key) else np.empty(0, dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class TreeEnsemble:
+    """
+    A LightGBM text model flattened into NumPy node arrays.
+
+    Internal nodes and leaves of all trees share one index space. Leaves
+    point to themselves on both sides, so traversal can run a fixed number
+    of steps for every (row, tree) pair without branching on "is leaf".
+    """
+    feature_names: List[str]
+    objective: str
+    sigmoid: float
+    average_output: bool
+    num_tree_per_iteration: int
+    roots: np.ndarray          # (T,) node index of each tree's root
+    feature: np.ndarray        # (nodes,) int64 split feature, 0 for leaves
+    threshold: np.ndarray      # (nodes,) float64
+    left: np.ndarray           # (nodes,) int64
+    right: np.ndarray          # (nodes,) int64
+    default_left: np.ndarray   # (nodes,) bool
+    missing_type: np.ndarray   # (nodes,) uint8 (0 none, 1 zero, 2 NaN)
+    is_categorical: np.ndarray  # (nodes,) bool
+    cat_start: np.ndarray      # (nodes,) int64 offset into cat_words
+    cat_len: np.ndarray        # (nodes,) int64 number of bitset words
+    cat_words: np.ndarray      # (W,) uint32 category bitsets
+    value: np.ndarray          # (nodes,) float64 leaf value, 0 for internal nodes
+    max_depth: int
+    pandas_categorical: Optional[list] = None
+    is_leaf: np.ndarray = field(init=False, repr=False)
+    nan_left: np.ndarray = field(init=False, repr=False)
+    _children: np.ndarray = field(init=False, repr=False)
+    _feature32: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "is_leaf", self.left == np.arange(len(self.left)))
+        # Side a NaN takes at a numerical split: the default side for NaN /
+        # zero missing types (NaN counts as zero there), else NaN is read as 0.0.
+        nan_left = np.where(self.missing_type == _MISSING_NONE, 0.0 <= self.threshold, self.default_left)
+        object.__setattr__(self, "nan_left", nan_left)
+        # Interleaved (left, right) children, so the next node is a single
+        # gather at 2 * node + go_right; int32 keeps the gathers cheap.
+        children = np.stack([self.left, self.right], axis=1).reshape(-1).astype(np.int32)
+        object.__setattr__(self, "_children", children)
+        object.__setattr__(self, "_feature32", self.feature.astype(np.int32))
+
+    @property
+    def n_trees(self) -> int:
+        return int(len(self.roots))
+
+    @classmethod
+    def from_model_file(cls, path: str) -> "TreeEnsemble":
+        with open(path) as f:
+            return cls.from_string(f.read())
+
+    @classmethod
+    def from_string(cls, text: str) -> "TreeEnsemble":
+        header, blocks, pandas_categorical = _parse_blocks(text)
+        if int(header.get("num_class", "1")) != 1:
+            raise ValueError("only single-output (num_class=1) models are supported")
+        objective_parts = header.get("objective", "").split()
+        objective = objective_parts[0] if objective_parts else ""
+        sigmoid = 1.0
+        for part in objective_parts[1:]:
+            if part.startswith("sigmoid:"):
+                sigmoid = float(part.split(":", 1)[1])
+
+        roots, feature, threshold, left, right = [], [], [], [], []
+        default_left, missing_type, is_cat, cat_start, cat_len, value = [], [], [], [], [], []
+        cat_words: List[np.ndarray] = []
+        n_words = 0
+        offset = 0
+        max_depth = 0
+
+        for block in blocks:
+            if int(block.get("is_linear", "0")):
+                raise ValueError("linear trees are not supported")
+            n_leaves = int(block["num_leaves"])
+            n_internal = n_leaves - 1
+            leaf_value = _floats(block, "leaf_value")  # shrinkage already applied
+            leaf_ids = offset + n_internal + np.arange(n_leaves)
+
+            if n_internal == 0:
+                roots.append(offset)
+                feature.append(np.zeros(1, dtype=np.int64))
+                threshold.append(np.zeros(1))
+                left.append(leaf_ids)
+                right.append(leaf_ids)
+                default_left.append(np.zeros(1, dtype=bool))
+                missing_type.append(np.zeros(1, dtype=np.uint8))
+                is_cat.append(np.zeros(1, dtype=bool))
+                cat_start.append(np.zeros(1, dtype=np.int64))
+                cat_len.append(np.zeros(1, dtype=np.int64))
+                value.append(leaf_value[:1])
+                offset += 1
+                continue
+
+            decision = _ints(block, "decision_type")
+            node_is_cat = (decision & _CATEGORICAL_MASK) > 0
+            node_thr = _floats(block, "threshold")
+            node_cat_start = np.zeros(n_internal, dtype=np.int64)
+            node_cat_len = np.zeros(n_internal, dtype=np.int64)
+            if int(block.get("num_cat", "0")) > 0:
+                boundaries = _ints(block, "cat_boundaries")
+                words = _ints(block, "cat_threshold").astype(np.uint32)
+                cat_idx = node_thr[node_is_cat].astype(np.int64)
+                node_cat_start[node_is_cat] = n_words + boundaries[cat_idx]
+                node_cat_len[node_is_cat] = boundaries[cat_idx + 1] - boundaries[cat_idx]
+                cat_words.append(words)
+                n_words += len(words)
+
+            # Negative children encode leaves as ~leaf_index.
+            left_c, right_c = (
+                np.where(c >= 0, offset + c, offset + n_internal + ~c)
+                for c in (_ints(block, "left_child"), _ints(block, "right_child"))
+            )
+
+            roots.append(offset)
+            feature.append(np.concatenate([_ints(block, "split_feature"), np.zeros(n_leaves, dtype=np.int64)]))
+            threshold.append(np.concatenate([node_thr, np.zeros(n_leaves)]))
+            left.append(np.concatenate([left_c, leaf_ids]))
+            right.append(np.concatenate([right_c, leaf_ids]))
+            default_left.append(np.concatenate([(decision & _DEFAULT_LEFT_MASK) > 0, np.zeros(n_leaves, dtype=bool)]))
+            missing_type.append(np.concatenate([(decision >> 2) & 3, np.zeros(n_leaves, dtype=np.int64)]).astype(np.uint8))
+            is_cat.append(np.concatenate([node_is_cat, np.zeros(n_leaves, dtype=bool)]))
+            cat_start.append(np.concatenate([node_cat_start, np.zeros(n_leaves, dtype=np.int64)]))
+            cat_len.append(np.concatenate([node_cat_len, np.zeros(n_leaves, dtype=np.int64)]))
+            value.append(np.concatenate([np.zeros(n_internal), leaf_value]))
+
+            max_depth = max(max_depth, _tree_depth(left_c - offset, right_c - offset, n_internal))
+            offset += n_internal + n_leaves
+
+        def cat(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype=dtype)
+
+        return cls(
+            feature_names=header.get("feature_names", "").split(),
+            objective=objective,
+            sigmoid=sigmoid,
+            average_output="average_output" in header,
+            num_tree_per_iteration=int(header.get("num_tree_per_iteration", "1")),
+            roots=np.asarray(roots, dtype=np.int64),
+            feature=cat(feature, np.int64),
+            threshold=cat(threshold, np.float64),
+            left=cat(left, np.int64),
+            right=cat(right, np.int64),
+            default_left=cat(default_left, bool),
+            missing_type=cat(missing_type, np.uint8),
+            is_categorical=cat(is_cat, bool),
+            cat_start=cat(cat_start, np.int64),
+            cat_len=cat(cat_len, np.int64),
+            cat_words=cat(cat_words, np.uint32),
+            value=cat(value, np.float64),
+            max_depth=max_depth,
+            pandas_categorical=pandas_categorical,
+        )
+
+    def predict_raw(self, X: np.ndarray, num_iteration: Optional[int] = None, block_rows: int = 2048) -> np.ndarray:
+        """
+        Raw scores (sum of leaf values) for an (n, F) matrix, evaluated in
+        blocks of `block_rows` rows. All trees advance together one level per
+        step (at most max_depth steps), using gathers on the node arrays.
+        """
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise ValueError("X must be 2-d")
+        T = self.n_trees
+        if num_iteration is not None and num_iteration > 0:
+            T = min(T, int(num_iteration) * self.num_tree_per_iteration)
+        roots = self.roots[:T]
+
+        out = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), max(1, int(block_rows))):
+            out[start:start + block_rows] = self._raw_block(X[start:start + block_rows], roots)
+        if self.average_output and T > 0:
+            out /= T
+        return out
+
+    def _raw_block(self, X: np.ndarray, roots: np.ndarray) -> np.ndarray:
+        n, F = X.shape
+        T = len(roots)
+        flat = np.ascontiguousarray(X).reshape(-1)
+        has_nan = bool(np.isnan(flat).any())
+        zero_nodes = self.missing_type == _MISSING_ZERO
+        has_zero = bool(zero_nodes.any())
+        has_cat = bool(self.is_categorical.any())
+        index_dtype = np.int32 if n * F < 2 ** 31 else np.int64
+
+        # Active (row, tree) pairs. Pairs that reached a leaf stay put (leaves
+        # loop to themselves) and are dropped in bulk once they make up half
+        # of the active set, so deep paths do not drag the shallow ones along.
+        final = np.empty(n * T, dtype=np.int32)
+        pos = np.arange(n * T, dtype=np.int64)
+        node = np.tile(roots.astype(np.int32), n)
+        row_base = np.repeat(np.arange(n, dtype=index_dtype) * F, T)
+        compacted = len(node)
+
+        for _ in range(self.max_depth):
+            x = flat[row_base + self._feature32[node]]
+            go_right = x > self.threshold[node]
+            if has_nan:
+                nan = np.isnan(x)
+                if nan.any():
+                    go_right[nan] = ~self.nan_left[node[nan]]
+            if has_zero:
+                z = zero_nodes[node] & (np.abs(x) <= _ZERO_THRESHOLD)
+                go_right[z] = ~self.default_left[node[z]]
+            if has_cat:
+                c = self.is_categorical[node]
+                if c.any():
+                    go_right[c] = ~self._categorical_left(x[c], node[c])
+
+            node = self._children[2 * node + go_right]
+            done = self.is_leaf[node]
+            n_active = len(node) - int(np.count_nonzero(done))
+            if n_active == 0:
+                break
+            if 2 * n_active < compacted:
+                final[pos[done]] = node[done]
+                keep = ~done
+                pos, node, row_base = pos[keep], node[keep], row_base[keep]
+                compacted = n_active
+        final[pos] = node
+
+        values = self.value[final].reshape(n, T)
+        raw = np.zeros(n, dtype=np.float64)
+        for t in range(T):  # tree order, like LightGBM's running sum
+            raw += values[:, t]
+        return raw
+
+    def _categorical_left(self, x: np.ndarray, node: np.ndarray) -> np.ndarray:
+        # LightGBM: NaN and negative values go right; otherwise left iff the
+        # category's bit is set in the node's bitset.
+        iv = np.clip(np.nan_to_num(x, nan=-1.0), -1.0, 2.0 ** 31 - 1).astype(np.int64)
+        word = iv >> 5
+        valid = (iv >= 0) & (word < self.cat_len[node])
+        words = self.cat_words[np.where(valid, self.cat_start[node] + word, 0)].astype(np.int64)
+        return valid & (((words >> (iv & 31)) & 1) == 1)
+
+    def predict(self, X: np.ndarray, num_iteration: Optional[int] = None, block_rows: int = 2048) -> np.ndarray:
+        """Transformed prediction, like Booster.predict (sigmoid for binary objectives)."""
+        raw = self.predict_raw(X, num_iteration=num_iteration, block_rows=block_rows)
+        if self.objective in _SIGMOID_OBJECTIVES:
+            return 1.0 / (1.0 + np.exp(-self.sigmoid * raw))
+        raise ValueError(f"objective {self.objective!r} has no probability output; use predict_raw")
+
+
+def _tree_depth(left: np.ndarray, right: np.ndarray, n_internal: int) -> int:
+    """Longest root-to-leaf path (in splits) of one tree, from local child indices."""
+    depth = np.zeros(n_internal, dtype=np.int64)
+    best = 1
+    stack = [0]
+    while stack:
+        i = stack.pop()
+        for c in (left[i], right[i]):
+            if c < n_internal:
+                depth[c] = depth[i] + 1
+                stack.append(int(c))
+            else:
+                best = max(best, int(depth[i]) + 1)
+    return best
+
+
+@dataclass
+class NumpyLightGBMPredictor:
+    """
+    LightGBM predictor that evaluates the model file with NumPy only.
+
+    The trees are parsed once into a TreeEnsemble; scoring never touches
+    pandas or the lightgbm package, so it runs wherever NumPy does. Same
+    batch API as PandasLightGBMPredictor; pCTRs match Booster.predict to
+    float rounding. Features must be numeric (categoricals as codes, as
+    produced by frame_to_matrix).
+    """
+    model_path: str
+    feature_names: Optional[List[str]] = None  # if None, read from the model file
+    num_iteration: Optional[int] = None
+    batch_size: int = 4096    # impressions per predict_pctr_many chunk
+    block_rows: int = 2048    # rows traversed together (temporaries scale with rows * n_trees)
+
+    def __post_init__(self) -> None:
+        self._ensemble = TreeEnsemble.from_model_file(self.model_path)
+        if self.feature_names is None:
+            self.feature_names = list(self._ensemble.feature_names)
+
+    @property
+    def ensemble(self) -> TreeEnsemble:
+        return self._ensemble
+
+    @property
+    def pandas_categorical(self) -> Optional[List[list]]:
+        """Category lists the model was trained with, for frame_to_matrix (None if none)."""
+        return self._ensemble.pandas_categorical
+
+    def predict_pctr(self, impression: Impression) -> Dict[int, float]:
+        if not impression.candidates:
+            return {}
+        assert self.feature_names is not None
+        p = self.predict_pctr_matrix(stack_candidate_features([impression], self.feature_names)).tolist()
+        return {c.ad_id: pi for c, pi in zip(impression.candidates, p)}
+
+    def predict_pctr_many(self, impressions: Sequence[Impression]) -> List[Dict[int, float]]:
+        assert self.feature_names is not None
+        out: List[Dict[int, float]] = []
+        for start in range(0, len(impressions), max(1, self.batch_size)):
+            chunk = impressions[start:start + max(1, self.batch_size)]
+            X = stack_candidate_features(chunk, self.feature_names)
+            p = self.predict_pctr_matrix(X).tolist() if len(X) else []
+            r = 0
+            for imp in chunk:
+                n = len(imp.candidates)
+                out.append({c.ad_id: pi for c, pi in zip(imp.candidates, p[r:r + n])})
+                r += n
+        return out
+
+    def predict_pctr_matrix(self, X: np.ndarray) -> np.ndarray:
+        """Score a dense (n_rows, F) matrix whose columns follow feature_names."""
+        p = self._ensemble.predict(X, num_iteration=self.num_iteration, block_rows=self.block_rows)
+        return np.clip(p, 1e-6, 1.0 - 1e-6)
+
+    def predict_pctr_batch(self, batch: ImpressionBatch) -> np.ndarray:
+        """Return a (B, C) pCTR matrix for a columnar batch."""
+        assert self.feature_names is not None
+        p = self.predict_pctr_matrix(batch_feature_matrix(batch, self.feature_names))
+        return p.reshape(batch.n_impressions, batch.n_candidates)
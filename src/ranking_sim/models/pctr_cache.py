@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch
+from ranking_sim.data.feature_bank import FeatureBankSource
+from ranking_sim.data.schema import Impression
+
+
+def file_digest(path: str, chunk_bytes: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def feature_bank_digest(features: np.ndarray, feature_names) -> str:
+    h = hashlib.sha256()
+    h.update("\x1f".join(feature_names).encode())
+    h.update(str(features.dtype).encode())
+    h.update(repr(features.shape).encode())
+    h.update(np.ascontiguousarray(features).data)
+    return h.hexdigest()
+
+
+@dataclass(frozen=True)
+class PCTRCacheKey:
+    """
+    Identifies one (n_impressions, n_candidates) pCTR matrix. `sampler`
+    distinguishes impression streams that share a seed (e.g. rng_mode).
+    """
+    model_hash: str
+    bank_hash: str
+    seed: int
+    n_impressions: int
+    n_candidates: int
+    sampler: str = "legacy"
+
+    def filename(self) -> str:
+        h = hashlib.sha256(repr(self).encode()).hexdigest()[:20]
+        return f"pctr_{h}.npy"
+
+
+@dataclass
+class PCTRCache:
+    """
+    In-memory pCTR matrices, optionally persisted as .npy files under
+    cache_dir and reopened memory-mapped (read-only) on later runs.
+    """
+    cache_dir: Optional[str] = None
+    hits: int = 0
+    misses: int = 0
+    _mem: Dict[PCTRCacheKey, np.ndarray] = field(default_factory=dict, repr=False)
+
+    def get_or_compute(self, key: PCTRCacheKey, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        if key in self._mem:
+            self.hits += 1
+            return self._mem[key]
+
+        path = os.path.join(self.cache_dir, key.filename()) if self.cache_dir else None
+        if path is not None and os.path.exists(path):
+            self.hits += 1
+            pctr = np.load(path, mmap_mode="r")
+        else:
+            self.misses += 1
+            pctr = np.asarray(compute(), dtype=np.float64)
+            if path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp = path + f".tmp{os.getpid()}.npy"
+                np.save(tmp, pctr)
+                os.replace(tmp, path)
+                pctr = np.load(path, mmap_mode="r")
+
+        self._mem[key] = pctr
+        return pctr
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def source_identity(source: FeatureBankSource) -> Dict[str, Any]:
+    """
+    The PCTRCacheKey fields that identify a sampled source's impressions:
+    bank digest, seed, shape and sampler. Sources that do not hold the
+    bank in memory (StreamingBankSource) provide a precomputed
+    `bank_digest`.
+    """
+    sampler = source.rng_mode if source.rng_mode == "legacy" else f"{source.rng_mode}:{source.chunk_size}"
+    bank_hash = getattr(source, "bank_digest", None)
+    if bank_hash is None:
+        bank_hash = feature_bank_digest(source.features, source.feature_names)
+    return {
+        "bank_hash": bank_hash,
+        "seed": int(source.seed),
+        "n_impressions": int(source.n_impressions),
+        "n_candidates": int(source.n_candidates),
+        "sampler": sampler,
+    }
+
+
+def source_cache_key(model_path: str, source: FeatureBankSource, num_iteration: Optional[int] = None) -> PCTRCacheKey:
+    """Cache key for a sampled source scored by the model at `model_path`."""
+    model_hash = file_digest(model_path)
+    if num_iteration is not None:
+        model_hash += f":it{num_iteration}"
+    return PCTRCacheKey(model_hash=model_hash, **source_identity(source))
+
+
+def compute_source_pctr(predictor, source: FeatureBankSource) -> np.ndarray:
+    """Run predict_pctr_batch over every batch of `source` into one (N, C) matrix."""
+    out = np.empty((source.n_impressions, source.n_candidates), dtype=np.float64)
+    for batch in source.iter_batches():
+        out[batch.imp_ids] = predictor.predict_pctr_batch(batch)
+    return out
+
+
+@dataclass
+class CachedPCTRPredictor:
+    """
+    Predictor that serves rows of a precomputed pCTR matrix by imp_id.
+    Row i must hold the candidates of impression i in candidate order.
+    """
+    pctr: np.ndarray  # (n_impressions, n_candidates)
+
+    def predict_pctr(self, impression: Impression) -> Dict[int, float]:
+        row = self.pctr[impression.imp_id].tolist()
+        return {c.ad_id: p for c, p in zip(impression.candidates, row)}
+
+    def predict_pctr_batch(self, batch: ImpressionBatch) -> np.ndarray:
+        return np.asarray(self.pctr[batch.imp_ids], dtype=np.float64)
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, Protocol, Optional, Any, List
+from typing import Dict, Protocol, Optional, Any, List, Sequence
 
 import numpy as np
-import pandas as pd
 
+from ranking_sim.data.batch import ImpressionBatch
 from ranking_sim.data.schema import Impression
+from ranking_sim.models.features import batch_feature_matrix, stack_candidate_features
 
 
 class Predictor(Protocol):
@@ -14,6 +15,14 @@ class Predictor(Protocol):
         """Return mapping {ad_id: pCTR} for all candidates in impression."""
 
 
+class BatchPredictor(Predictor, Protocol):
+    def predict_pctr_many(self, impressions: Sequence[Impression]) -> List[Dict[int, float]]:
+        """Score many impressions at once; one {ad_id: pCTR} mapping per impression."""
+
+    def predict_pctr_batch(self, batch: ImpressionBatch) -> np.ndarray:
+        """Return a (B, C) pCTR matrix for a columnar batch."""
+
+
 @dataclass
 class DummyPredictor:
     """
@@ -46,10 +55,18 @@ class PandasLightGBMPredictor:
       For each AdCandidate c in impression.candidates:
         c.features is a dict mapping column name -> value
       covering all required columns (feature_names).
+
+    predict_pctr_many / predict_pctr_batch stack candidates from many
+    impressions into one contiguous matrix, so Booster.predict is called
+    once per `batch_size` impressions instead of once per impression.
+    Only predict_pctr (a per-row DataFrame) needs pandas, which is
+    imported on first use.
     """
     model_path: str
     feature_names: Optional[List[str]] = None  # if None, read from booster
     num_iteration: Optional[int] = None
+    batch_size: int = 4096   # impressions per Booster.predict call
+    num_threads: int = 0     # LightGBM prediction threads; 0 = library default
 
     def __post_init__(self) -> None:
         try:
@@ -63,6 +80,11 @@ class PandasLightGBMPredictor:
         if self.feature_names is None:
             self.feature_names = list(self._booster.feature_name())
 
+    @property
+    def pandas_categorical(self) -> Optional[List[list]]:
+        """Category lists the booster was trained with, for frame_to_matrix (None if none)."""
+        return self._booster.pandas_categorical
+
     def predict_pctr(self, impression: Impression) -> Dict[int, float]:
         if not impression.candidates:
             return {}
@@ -86,10 +108,43 @@ class PandasLightGBMPredictor:
             rows.append(row)
             ad_ids.append(c.ad_id)
 
+        try:
+            import pandas as pd
+        except ImportError as e:
+            raise ImportError("pandas is not installed. pip install pandas") from e
         X = pd.DataFrame(rows, columns=self.feature_names)
 
         p = self._booster.predict(X, num_iteration=self.num_iteration)
         p = np.asarray(p, dtype=np.float64).reshape(-1)
         p = np.clip(p, 1e-6, 1.0 - 1e-6)
 
-        return {ad_id: float(pi) for ad_id, pi in zip(ad_ids, p)}
\ No newline at end of file
+        return {ad_id: float(pi) for ad_id, pi in zip(ad_ids, p)}
+
+    def predict_pctr_many(self, impressions: Sequence[Impression]) -> List[Dict[int, float]]:
+        assert self.feature_names is not None
+        out: List[Dict[int, float]] = []
+
+        for start in range(0, len(impressions), max(1, self.batch_size)):
+            chunk = impressions[start:start + max(1, self.batch_size)]
+            X = stack_candidate_features(chunk, self.feature_names)
+            p = self.predict_pctr_matrix(X).tolist() if len(X) else []
+
+            r = 0
+            for imp in chunk:
+                n = len(imp.candidates)
+                out.append({c.ad_id: pi for c, pi in zip(imp.candidates, p[r:r + n])})
+                r += n
+        return out
+
+    def predict_pctr_matrix(self, X: np.ndarray) -> np.ndarray:
+        """Score a dense (n_rows, F) matrix whose columns follow feature_names."""
+        kwargs = {"num_threads": self.num_threads} if self.num_threads > 0 else {}
+        p = self._booster.predict(X, num_iteration=self.num_iteration, **kwargs)
+        p = np.asarray(p, dtype=np.float64).reshape(-1)
+        return np.clip(p, 1e-6, 1.0 - 1e-6)
+
+    def predict_pctr_batch(self, batch: ImpressionBatch) -> np.ndarray:
+        """Return a (B, C) pCTR matrix for a columnar batch in one predict call."""
+        assert self.feature_names is not None
+        p = self.predict_pctr_matrix(batch_feature_matrix(batch, self.feature_names))
+        return p.reshape(batch.n_impressions, batch.n_candidates)
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, Protocol
+from typing import Dict, Protocol, Sequence
 
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch
 from ranking_sim.data.schema import Impression
 
 
@@ -11,6 +14,11 @@ class RankingPolicy(Protocol):
         """Return mapping {ad_id: score} used for ranking."""
 
 
+class BatchRankingPolicy(Protocol):
+    def score_batch(self, bids: np.ndarray, pctr: np.ndarray) -> np.ndarray:
+        """Return a (B, C) score matrix for (B, C) bid and pCTR matrices."""
+
+
 @dataclass(frozen=True)
 class BidTimesPCTR:
     def score(self, impression: Impression, pctr: Dict[int, float]) -> Dict[int, float]:
@@ -19,6 +27,9 @@ class BidTimesPCTR:
             scores[c.ad_id] = float(c.bid_cpc) * float(pctr[c.ad_id])
         return scores
 
+    def score_batch(self, bids: np.ndarray, pctr: np.ndarray) -> np.ndarray:
+        return np.multiply(bids, pctr, dtype=np.float64)
+
 
 @dataclass(frozen=True)
 class BidTimesPCTRPow:
@@ -30,8 +41,63 @@ class BidTimesPCTRPow:
             scores[c.ad_id] = float(c.bid_cpc) * (float(pctr[c.ad_id]) ** float(self.alpha))
         return scores
 
+    def score_batch(self, bids: np.ndarray, pctr: np.ndarray) -> np.ndarray:
+        return np.multiply(bids, np.power(pctr, float(self.alpha)), dtype=np.float64)
+
+    @staticmethod
+    def score_alphas(bids: np.ndarray, pctr: np.ndarray, alphas: Sequence[float]) -> np.ndarray:
+        """
+        (A, B, C) scores for A alphas at once: bid * exp(alpha * log pCTR).
+
+        log pCTR is taken once and each alpha costs one multiply and one exp
+        instead of a pow. Agrees with score_batch to a few ulps, so rankings
+        only differ on near-exact ties. alpha == 0 gives the bid (0 ** 0 == 1).
+        """
+        bids = np.asarray(bids, dtype=np.float64)
+        alphas = np.asarray(alphas, dtype=np.float64).reshape(-1)
+        with np.errstate(divide="ignore"):
+            logp = np.log(np.asarray(pctr, dtype=np.float64))
+
+        out = np.empty((alphas.size,) + bids.shape, dtype=np.float64)
+        for i, a in enumerate(alphas.tolist()):
+            if a == 0.0:
+                out[i] = bids
+                continue
+            np.multiply(logp, a, out=out[i])
+            np.exp(out[i], out=out[i])
+            out[i] *= bids
+        return out
+
 
 @dataclass(frozen=True)
 class BidOnly:
     def score(self, impression: Impression, pctr: Dict[int, float]) -> Dict[int, float]:
-        return {c.ad_id: float(c.bid_cpc) for c in impression.candidates}
\ No newline at end of file
+        return {c.ad_id: float(c.bid_cpc) for c in impression.candidates}
+
+    def score_batch(self, bids: np.ndarray, pctr: np.ndarray) -> np.ndarray:
+        return np.array(bids, dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class DictPolicyAdapter:
+    """
+    Runs a dict-based RankingPolicy over a whole ImpressionBatch, one
+    impression at a time. Slow, but lets policies that need features or
+    context (and have no score_batch) work with the array engines.
+    """
+    policy: RankingPolicy
+
+    def score_impressions(self, batch: ImpressionBatch, pctr: np.ndarray) -> np.ndarray:
+        out = np.empty(pctr.shape, dtype=np.float64)
+        for i, (imp, ad_ids, row) in enumerate(zip(batch.impressions(), batch.ad_ids.tolist(), pctr.tolist())):
+            s = self.policy.score(imp, dict(zip(ad_ids, row)))
+            out[i] = [s[a] for a in ad_ids]
+        return out
+
+
+def score_batch(policy: RankingPolicy, batch: ImpressionBatch, pctr: np.ndarray) -> np.ndarray:
+    """(B, C) scores for a batch: the policy's score_batch kernel if it has one, else DictPolicyAdapter."""
+    kernel = getattr(policy, "score_batch", None)
+    if kernel is not None:
+        return kernel(batch.bids, pctr)
+    return DictPolicyAdapter(policy).score_impressions(batch, pctr)
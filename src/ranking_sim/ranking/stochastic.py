@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class PlackettLuce:
+    """
+    Stochastic ranking over policy scores: each slot is filled by drawing
+    one of the remaining candidates with probability proportional to
+    w = score ** (1 / temperature). temperature -> 0 approaches the
+    deterministic top-K; larger values explore more. Candidates with a
+    score of -inf (ineligible) or <= 0 are never drawn.
+    """
+    temperature: float = 1.0
+
+    def log_weights(self, scores: np.ndarray) -> np.ndarray:
+        """(B, C) log w, -inf where a candidate cannot be drawn."""
+        s = np.asarray(scores, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logw = np.log(np.where(s > 0.0, s, 0.0)) / float(self.temperature)
+        return logw
+
+    def sample(self, scores: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        (B, k) column indices of one Plackett-Luce draw per row, in slot
+        order (Gumbel-top-k: the k largest of log w + Gumbel noise).
+        Rows with fewer than k drawable candidates are padded with
+        undrawable ones, which callers see as -inf scores.
+        """
+        logw = self.log_weights(scores)
+        keys = logw + rng.gumbel(size=logw.shape)
+        return np.argsort(-keys, axis=1, kind="stable")[:, :k]
+
+    def log_prefix_propensity(
+        self, scores: np.ndarray, ranked: np.ndarray, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        (B, K) log probability that a draw starts with ranked[:, :k + 1],
+        for each k. Unfilled slots (filled False) leave it unchanged;
+        a prefix this ranker cannot produce gets -inf.
+        """
+        logw = self.log_weights(scores)
+        B, K = ranked.shape
+        m = np.max(logw, axis=1, keepdims=True)
+        m[~np.isfinite(m)] = 0.0
+        w = np.exp(logw - m)                       # 0 where undrawable
+        rows = np.arange(B)
+
+        out = np.zeros((B, K), dtype=np.float64)
+        total = np.zeros(B, dtype=np.float64)
+        for k in range(K):
+            # Re-summed each slot rather than subtracted, which would cancel
+            # badly once a heavy candidate has been drawn.
+            remaining = w.sum(axis=1)
+            chosen = w[rows, ranked[:, k]]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step = np.log(chosen) - np.log(remaining)
+            if filled is not None:
+                step = np.where(filled[:, k], step, 0.0)
+            total = total + step
+            out[:, k] = total
+            w[rows, ranked[:, k]] = 0.0
+        return out
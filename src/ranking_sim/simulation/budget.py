@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+PACING_MODES = ("none", "throttle", "shade")
+
+
+@dataclass
+class BudgetPacer:
+    """
+    Per-advertiser daily budgets, pacing and spend tracking for the array
+    engine.
+
+    Advertiser ids index dense (A,) state arrays, so ids must lie in
+    [0, A). Each impression chunk goes through gate() before ranking and
+    record() after pricing; both are whole-array ops (gathers and
+    bincounts), with no per-impression Python work.
+
+      gate():   a candidate is eligible only while its advertiser's
+                remaining day budget covers its bid (one click at most
+                costs the bid). "throttle" also drops each candidate with
+                probability 1 - rate[a]; "shade" multiplies bids by rate[a].
+      record(): adds the chunk's spend, clicks and shown slots, then moves
+                rate[a] towards even delivery: multiplicatively down when
+                day spend is ahead of budget * elapsed day fraction, up
+                (capped at 1) when behind.
+
+    A day is `impressions_per_day` impressions; day spend and rates reset
+    at the first chunk boundary past it. Budgets are checked once per
+    chunk, so an advertiser with several clicks in one chunk can still
+    overspend; keep chunks small relative to a day for tight budgets.
+    Throttling draws from its own generator and leaves the click stream
+    alone.
+    """
+    daily_budget: np.ndarray        # (A,) float64; np.inf = unlimited
+    impressions_per_day: int
+    pacing: str = "throttle"
+    gain: float = 0.5
+    min_rate: float = 0.05
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        if self.pacing not in PACING_MODES:
+            raise ValueError(f"unknown pacing: {self.pacing!r}; expected one of {PACING_MODES}")
+        if self.impressions_per_day <= 0:
+            raise ValueError("impressions_per_day must be positive")
+        self.daily_budget = np.asarray(self.daily_budget, dtype=np.float64)
+        A = self.n_advertisers
+        self.spend = np.zeros(A, dtype=np.float64)       # whole run
+        self.day_spend = np.zeros(A, dtype=np.float64)
+        self.overspend = np.zeros(A, dtype=np.float64)   # spend past the budget, summed over days
+        self.clicks = np.zeros(A, dtype=np.int64)
+        self.shown = np.zeros(A, dtype=np.int64)
+        self.rate = np.ones(A, dtype=np.float64)
+        self.n_days = 1
+        self._day_t = 0
+        self._rng = np.random.default_rng(self.seed)
+
+    @classmethod
+    def lognormal(
+        cls,
+        n_advertisers: int,
+        mean_budget: float,
+        impressions_per_day: int,
+        sigma: float = 1.0,
+        seed: int = 0,
+        **kwargs,
+    ) -> "BudgetPacer":
+        """Budgets drawn log-normally around `mean_budget` (a long tail of large advertisers)."""
+        rng = np.random.default_rng(seed)
+        budgets = mean_budget * rng.lognormal(-0.5 * sigma**2, sigma, size=int(n_advertisers))
+        return cls(budgets, impressions_per_day, seed=seed, **kwargs)
+
+    @property
+    def n_advertisers(self) -> int:
+        return int(self.daily_budget.shape[0])
+
+    @property
+    def exhausted(self) -> np.ndarray:
+        """(A,) bool: day budget used up."""
+        return self.day_spend >= self.daily_budget
+
+    def gate(self, advertiser_ids: np.ndarray, bids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (bids, eligible) for a (B, C) candidate block."""
+        adv = np.asarray(advertiser_ids)
+        if adv.size and (adv.min() < 0 or adv.max() >= self.n_advertisers):
+            raise ValueError(f"advertiser ids must lie in [0, {self.n_advertisers})")
+        if self.pacing == "throttle":
+            eligible = self._rng.random(adv.shape) < self.rate[adv]
+        elif self.pacing == "shade":
+            bids = bids * self.rate[adv]
+            eligible = np.ones(adv.shape, dtype=bool)
+        else:
+            eligible = np.ones(adv.shape, dtype=bool)
+        eligible &= bids <= (self.daily_budget - self.day_spend)[adv]
+        return bids, eligible
+
+    def record(
+        self,
+        advertiser_ids: np.ndarray,
+        revenue: np.ndarray,
+        clicked: np.ndarray,
+        filled: np.ndarray,
+        n_impressions: int,
+    ) -> None:
+        """
+        Book one chunk. advertiser_ids, revenue, clicked and filled are the
+        (B, K) shown-slot arrays of SlotArrays; n_impressions is B.
+        """
+        A = self.n_advertisers
+        adv = np.asarray(advertiser_ids)[filled]
+        spent = np.bincount(adv, weights=np.asarray(revenue)[filled], minlength=A)
+        self.spend += spent
+        self.day_spend += spent
+        self.clicks += np.bincount(adv, weights=np.asarray(clicked)[filled], minlength=A).astype(np.int64)
+        self.shown += np.bincount(adv, minlength=A)
+
+        self._day_t += int(n_impressions)
+        if self._day_t >= self.impressions_per_day:
+            self._end_day()
+        elif self.pacing != "none":
+            self._update_rates()
+
+    def _update_rates(self) -> None:
+        target = self.daily_budget * (self._day_t / self.impressions_per_day)
+        paced = np.isfinite(self.daily_budget) & (self.daily_budget > 0)
+        ratio = np.clip(self.day_spend / np.where(paced, np.maximum(target, 1e-12), 1.0), 1e-3, 1e3)
+        rate = self.rate * np.exp(-self.gain * np.log(ratio))
+        self.rate = np.where(paced, np.clip(rate, self.min_rate, 1.0), 1.0)
+
+    def _end_day(self) -> None:
+        with np.errstate(invalid="ignore"):
+            self.overspend += np.maximum(self.day_spend - self.daily_budget, 0.0)
+        self.day_spend[:] = 0.0
+        self.rate[:] = 1.0
+        self._day_t -= self.impressions_per_day
+        self.n_days += 1
+
+    def summary(self) -> dict:
+        finite = np.isfinite(self.daily_budget)
+        with np.errstate(invalid="ignore"):
+            over = self.overspend + np.maximum(self.day_spend - self.daily_budget, 0.0)
+        days = self.n_days - 1 + self._day_t / self.impressions_per_day
+        capacity = float(self.daily_budget[finite].sum()) * days
+        return {
+            "n_advertisers": self.n_advertisers,
+            "pacing": self.pacing,
+            "days": days,
+            "total_spend": float(self.spend.sum()),
+            "budget_utilization": float(self.spend[finite].sum() / capacity) if capacity > 0 else float("nan"),
+            "overspend": float(over[finite].sum()),
+            "n_exhausted": int(self.exhausted.sum()),
+            "n_active": int((self.shown > 0).sum()),
+            "mean_rate": float(self.rate.mean()) if self.n_advertisers else float("nan"),
+        }
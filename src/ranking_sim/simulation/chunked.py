@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ranking_sim.auction.mechanisms import BatchAuction
+from ranking_sim.data.batch import ImpressionBatch, ImpressionSource
+from ranking_sim.evaluation.metrics import MetricsAggregator
+from ranking_sim.models.pctr_cache import file_digest, source_identity
+from ranking_sim.ranking.policy import RankingPolicy
+from ranking_sim.simulation.runner import RunOutput, run_simulation
+from ranking_sim.simulation.vectorized import run_vectorized
+
+ENGINES = ("loop", "array")
+
+_RUN_FILE = "run.json"
+_CHUNK_RE = re.compile(r"^chunk_(\d+)\.json$")
+
+
+def chunk_seed(seed: int, chunk_index: int) -> np.random.SeedSequence:
+    """Child SeedSequence `chunk_index` of `seed` (as in feature_bank.bulk_draws)."""
+    return np.random.SeedSequence(seed, spawn_key=(chunk_index,))
+
+
+@dataclass(frozen=True)
+class _OneBatch:
+    """ImpressionSource over a single batch, so each chunk runs through the usual entry points."""
+    batch: ImpressionBatch
+
+    def iter_batches(self) -> Iterator[ImpressionBatch]:
+        yield self.batch
+
+    def __iter__(self):
+        return self.batch.impressions()
+
+
+def _iter_chunks(impressions, chunk_size: int, batches_only: bool = False) -> Iterator[Any]:
+    """
+    Chunks in order: the batches of a columnar source (or of an iterable of
+    ImpressionBatch), else runs of `chunk_size` Impression objects, which
+    raise ValueError if `batches_only`.
+    """
+    iter_batches = getattr(impressions, "iter_batches", None)
+    it = iter_batches() if iter_batches is not None else iter(impressions)
+    while True:
+        chunk = list(itertools.islice(it, 1 if iter_batches is not None else max(1, int(chunk_size))))
+        if not chunk:
+            return
+        if isinstance(chunk[0], ImpressionBatch):
+            for batch in chunk:
+                yield _OneBatch(batch)
+        elif batches_only:
+            raise ValueError(
+                "engine='array' needs an ImpressionSource or ImpressionBatch blocks, got "
+                f"{type(chunk[0]).__name__} objects; use engine='loop' or a columnar source such as ArraySource"
+            )
+        else:
+            yield chunk
+
+
+def _arrays_digest(*arrays: np.ndarray) -> str:
+    h = hashlib.sha256()
+    for a in arrays:
+        h.update(f"{a.dtype.str}{a.shape}".encode())
+        h.update(np.ascontiguousarray(a).data)
+    return h.hexdigest()
+
+
+def _predictor_identity(predictor) -> str:
+    """Model file digest (and num_iteration), cached pCTR digest, else repr."""
+    model_path = getattr(predictor, "model_path", None)
+    if model_path is not None:
+        ident = f"{type(predictor).__name__}:{file_digest(model_path)}"
+        num_iteration = getattr(predictor, "num_iteration", None)
+        return ident + (f":it{num_iteration}" if num_iteration is not None else "")
+    pctr = getattr(predictor, "pctr", None)
+    if pctr is not None:
+        return f"{type(predictor).__name__}:{_arrays_digest(np.asarray(pctr))}"
+    return repr(predictor)
+
+
+def _source_identity(impressions) -> Optional[Dict[str, Any]]:
+    """
+    Sampled sources by source_identity, ArraySource by its arrays; None
+    for plain iterables, which cannot be fingerprinted without consuming
+    them.
+    """
+    if hasattr(impressions, "rng_mode") and hasattr(impressions, "seed"):
+        return source_identity(impressions)
+    if isinstance(getattr(impressions, "bids", None), np.ndarray) and hasattr(impressions, "iter_batches"):
+        arrays = [np.asarray(impressions.bids), np.asarray(impressions.advertiser_ids)]
+        if getattr(impressions, "features", None) is not None:
+            arrays.append(np.asarray(impressions.features))
+        return {"arrays": _arrays_digest(*arrays), "chunk_size": int(impressions.chunk_size)}
+    return None
+
+
+def _write_json(path: str, obj: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def load_chunks(path: str) -> Dict[int, MetricsAggregator]:
+    """Chunk index -> aggregator for every chunk checkpointed under `path`."""
+    out: Dict[int, MetricsAggregator] = {}
+    if not os.path.isdir(path):
+        return out
+    for name in os.listdir(path):
+        m = _CHUNK_RE.match(name)
+        if m is None:
+            continue
+        with open(os.path.join(path, name)) as f:
+            out[int(m.group(1))] = MetricsAggregator.from_state(json.load(f))
+    return out
+
+
+def _fold(chunks: Dict[int, MetricsAggregator], ndcg_k: int, ndcg_ideal: str) -> MetricsAggregator:
+    # Always the same left fold in chunk order from an empty aggregator, so
+    # the float sums do not depend on how the chunks were produced.
+    total = MetricsAggregator(ndcg_k=ndcg_k, ndcg_ideal=ndcg_ideal)
+    for i in sorted(chunks):
+        total = total.merge(chunks[i])
+    return total
+
+
+def run_chunked(
+    impressions: Union[ImpressionSource, Iterable[Any]],
+    predictor,
+    policy: RankingPolicy,
+    user_model,
+    n_slots: int = 1,
+    seed: int = 42,
+    engine: str = "loop",
+    chunk_size: int = 65_536,
+    ndcg_ideal: str = "shown",
+    auction: Optional[BatchAuction] = None,
+    checkpoint_dir: Optional[str] = None,
+    shard: Tuple[int, int] = (0, 1),
+) -> RunOutput:
+    """
+    Run a simulation chunk by chunk, with each chunk's randomness drawn from
+    its own chunk_seed(seed, i) and its metrics kept in its own
+    MetricsAggregator. The run's metrics are those aggregators merged in
+    chunk order, so they are bit-identical however the work was done: in
+    one go, interrupted and resumed, or split over workers.
+
+    Chunks are the batches of a columnar source (ArraySource.chunk_size) or,
+    for a plain iterable of Impression, runs of `chunk_size` impressions;
+    engine="loop" runs each through run_simulation, engine="array" through
+    run_vectorized (which needs batches; Impression objects raise
+    ValueError up front). Numbers differ from a single run_simulation /
+    run_vectorized call, whose one generator runs across chunk boundaries.
+
+    With `checkpoint_dir`, every finished chunk is written to
+    chunk_XXXXXX.json (a few hundred bytes) and chunks already there are
+    skipped, so calling again with the same arguments resumes. run.json
+    records the configuration, the predictor (model file or cached pCTR
+    digest) and the source (bank digest and sampling, or array digest;
+    plain iterables are not fingerprinted), and a mismatch raises
+    ValueError rather than mixing runs. `shard=(w, n)` runs only chunks
+    with i % n == w; point every worker at the same (or a copied-together)
+    directory and combine them with merge_checkpoints. Skipped chunks are
+    still read from the source, but not scored.
+
+    Budgets, early stopping and step logs carry state across chunks and
+    are not supported here.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine: {engine!r}; expected one of {ENGINES}")
+    worker, n_workers = int(shard[0]), int(shard[1])
+    if not 0 <= worker < n_workers:
+        raise ValueError(f"shard must be (w, n) with 0 <= w < n, got {shard!r}")
+
+    # Pull the first chunk now, so unusable inputs fail before anything is written.
+    chunks = _iter_chunks(impressions, chunk_size, batches_only=engine == "array")
+    first = next(chunks, None)
+    chunks = itertools.chain([first] if first is not None else [], chunks)
+
+    done: Dict[int, MetricsAggregator] = {}
+    if checkpoint_dir is not None:
+        config = {
+            "engine": engine,
+            "seed": int(seed),
+            "n_slots": int(n_slots),
+            "chunk_size": int(chunk_size),
+            "ndcg_ideal": ndcg_ideal,
+            "policy": repr(policy),
+            "user_model": repr(user_model),
+            "auction": repr(auction),
+            "predictor": _predictor_identity(predictor),
+            "source": _source_identity(impressions),
+        }
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        run_path = os.path.join(checkpoint_dir, _RUN_FILE)
+        if os.path.exists(run_path):
+            with open(run_path) as f:
+                previous = json.load(f)
+            if previous != config:
+                raise ValueError(f"checkpoint at {checkpoint_dir} is from a different run: {previous}")
+        else:
+            _write_json(run_path, config)
+        done = {i: agg for i, agg in load_chunks(checkpoint_dir).items() if i % n_workers == worker}
+
+    run = run_simulation if engine == "loop" else run_vectorized
+    mine: Dict[int, MetricsAggregator] = dict(done)
+    for i, chunk in enumerate(chunks):
+        if i % n_workers != worker or i in done:
+            continue
+        agg = MetricsAggregator(ndcg_k=n_slots, ndcg_ideal=ndcg_ideal)
+        run(
+            chunk,
+            predictor=predictor,
+            policy=policy,
+            user_model=user_model,
+            n_slots=n_slots,
+            seed=chunk_seed(seed, i),
+            ndcg_ideal=ndcg_ideal,
+            auction=auction,
+            aggregator=agg,
+        )
+        mine[i] = agg
+        if checkpoint_dir is not None:
+            _write_json(os.path.join(checkpoint_dir, f"chunk_{i:06d}.json"), agg.state_dict())
+
+    metrics = _fold(mine, n_slots, ndcg_ideal)
+    return RunOutput(metrics=metrics.finalize(), n_steps=metrics.impressions)
+
+
+def merge_checkpoints(paths: Union[str, Sequence[str]], n_chunks: Optional[int] = None) -> RunOutput:
+    """
+    Combine the chunks checkpointed by run_chunked workers under one or
+    more directories into the run's metrics. Raises ValueError if chunk
+    indices are missing (0 .. n_chunks - 1 when given, otherwise up to the
+    largest one found) or the directories come from different runs.
+    """
+    paths = [paths] if isinstance(paths, str) else list(paths)
+    configs: List[dict] = []
+    chunks: Dict[int, MetricsAggregator] = {}
+    for path in paths:
+        with open(os.path.join(path, _RUN_FILE)) as f:
+            configs.append(json.load(f))
+        chunks.update(load_chunks(path))
+    if any(c != configs[0] for c in configs[1:]):
+        raise ValueError("checkpoints come from runs with different configurations")
+
+    expected = n_chunks if n_chunks is not None else (max(chunks) + 1 if chunks else 0)
+    missing = sorted(set(range(expected)) - set(chunks))
+    if missing:
+        shown = ", ".join(map(str, missing[:10])) + (" ..." if len(missing) > 10 else "")
+        raise ValueError(f"{len(missing)} chunk(s) not checkpointed: {shown}")
+
+    config = configs[0]
+    metrics = _fold(chunks, int(config["n_slots"]), config["ndcg_ideal"])
+    return RunOutput(metrics=metrics.finalize(), n_steps=metrics.impressions)
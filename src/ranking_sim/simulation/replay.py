@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterable, Mapping, Optional, Union
+
+import numpy as np
+
+from ranking_sim.auction.mechanisms import BatchAuction
+from ranking_sim.data.batch import ImpressionBatch, ImpressionSource
+from ranking_sim.evaluation.metrics import MetricsAggregator
+from ranking_sim.evaluation.stats import RunningMoments
+from ranking_sim.ranking.policy import RankingPolicy
+from ranking_sim.simulation.user import PositionBiasClickModel
+from ranking_sim.simulation.vectorized import SlotArrays, _iter_batches, score_matrix, simulate_arrays
+
+# Per-impression quantities compared between policies.
+DELTA_METRICS = ("clicks_per_impression", "revenue_per_impression", "ndcg")
+
+
+@dataclass
+class ReplayOutput:
+    metrics: Dict[str, dict]              # policy name -> MetricsAggregator.finalize()
+    deltas: Dict[str, Dict[str, dict]]    # policy name -> metric -> paired delta summary vs baseline
+    baseline: str
+    n_steps: int
+
+
+def crn_uniforms(
+    rng: np.random.Generator,
+    n_impressions: int,
+    n_candidates: int,
+    n_slots: int,
+    uniforms_per_slot: int = 1,
+) -> np.ndarray:
+    """
+    One uniform per (impression, candidate, position) (times
+    uniforms_per_slot): shape (B, C, K) or (B, C, K, u).
+    """
+    shape = (n_impressions, n_candidates, n_slots)
+    return rng.random(shape if uniforms_per_slot == 1 else shape + (uniforms_per_slot,))
+
+
+def _impression_values(slots: SlotArrays, row_ndcg: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    (B,) per-impression value of each DELTA_METRICS entry. `row_ndcg` is
+    what MetricsAggregator.update_many returned for the same slots (NaN
+    where no slot was filled).
+    """
+    return {
+        "clicks_per_impression": slots.clicked.sum(axis=1).astype(np.float64),
+        "revenue_per_impression": slots.revenue.sum(axis=1),
+        "ndcg": row_ndcg,
+    }
+
+
+def _delta_summary(delta: RunningMoments, a: RunningMoments, b: RunningMoments, level: float) -> dict:
+    out = delta.summary(level)
+    # Stderr the same comparison would have with independent draws per policy.
+    indep = math.sqrt((a.variance + b.variance) / delta.n) if delta.n > 1 else math.inf
+    out["independent_stderr"] = indep
+    out["variance_reduction"] = (indep / out["stderr"]) ** 2 if out["stderr"] > 0 else math.inf
+    return out
+
+
+def run_replay(
+    impressions: Union[ImpressionSource, Iterable[ImpressionBatch]],
+    predictor,
+    policies: Mapping[str, RankingPolicy],
+    user_model,
+    n_slots: int = 1,
+    seed: int = 42,
+    auction: Optional[BatchAuction] = None,
+    baseline: Optional[str] = None,
+    ndcg_ideal: str = "shown",
+    ci_level: float = 0.95,
+) -> ReplayOutput:
+    """
+    Common-random-numbers evaluation of several policies in one pass.
+
+    Each batch is scored by the predictor once and one uniform matrix is
+    drawn per (impression, candidate, position) (see crn_uniforms). Every
+    policy then ranks the same candidates and clicks with the same draws:
+    an ad shown at the same position under two policies gets the same
+    click outcome, so only real ranking differences show up in the deltas.
+
+    Deltas are per impression (policy minus `baseline`, default: the first
+    policy), summarized with streaming moments; NDCG deltas skip
+    impressions where either slate is empty. `independent_stderr` is what
+    the comparison would give with independent runs of the same size,
+    from each policy's MetricsAggregator moments.
+    The uniform matrix costs B * C * n_slots floats per batch, so keep
+    batches to a few thousand impressions.
+    """
+    if not policies:
+        raise ValueError("need at least one policy")
+    names = list(policies)
+    baseline = names[0] if baseline is None else baseline
+    if baseline not in policies:
+        raise KeyError(f"unknown baseline policy: {baseline!r}")
+
+    rng = np.random.default_rng(seed)
+    position_bias = list(getattr(user_model, "position_bias", ()))
+    click_model = user_model if hasattr(user_model, "sample_clicks") else PositionBiasClickModel(position_bias)
+    per_slot = int(getattr(click_model, "uniforms_per_slot", 1))
+
+    metrics = {name: MetricsAggregator(ndcg_k=n_slots, ndcg_ideal=ndcg_ideal, ci_level=ci_level) for name in names}
+    deltas = {name: {m: RunningMoments() for m in DELTA_METRICS} for name in names if name != baseline}
+
+    n = 0
+    for batch in _iter_batches(impressions):
+        pctr = np.asarray(predictor.predict_pctr_batch(batch), dtype=np.float64)
+        B, C = pctr.shape
+        u = crn_uniforms(rng, B, C, n_slots, per_slot)
+        candidate_rels = pctr if ndcg_ideal == "candidates" else None
+
+        values = {}
+        for name in names:
+            scores = score_matrix(policies[name], batch, pctr)
+            slots = simulate_arrays(batch.bids, pctr, scores, position_bias, n_slots, rng, auction, click_model, u)
+            row_ndcg = metrics[name].update_many(
+                slots.pctr, slots.bids, slots.clicked, slots.revenue, slots.filled, candidate_rels=candidate_rels
+            )
+            values[name] = _impression_values(slots, row_ndcg)
+
+        for name, acc in deltas.items():
+            for m in DELTA_METRICS:
+                d = values[name][m] - values[baseline][m]
+                acc[m].update_many(d[~np.isnan(d)])
+        n += B
+
+    delta_out = {
+        name: {
+            m: _delta_summary(d, metrics[name].moments(m), metrics[baseline].moments(m), ci_level)
+            for m, d in acc.items()
+        }
+        for name, acc in deltas.items()
+    }
+
+    return ReplayOutput(
+        metrics={name: agg.finalize() for name, agg in metrics.items()},
+        deltas=delta_out,
+        baseline=baseline,
+        n_steps=n,
+    )
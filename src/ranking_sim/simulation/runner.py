@@ -1,15 +1,19 @@
 from __future__ import annotations
 
+import itertools
 from dataclasses import dataclass
-from typing import Iterable, Optional, List
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple, Union
 
 import numpy as np
 
+from ranking_sim.auction.mechanisms import BatchAuction
+from ranking_sim.data.batch import ImpressionSource
 from ranking_sim.data.schema import Impression, SimStepResult, SlotOutcome
 from ranking_sim.models.predictor import Predictor
 from ranking_sim.ranking.policy import RankingPolicy
-from ranking_sim.simulation.user import UserModel
-from ranking_sim.evaluation.metrics import MetricsAggregator
+from ranking_sim.simulation.step_log import StepLogWriter
+from ranking_sim.simulation.user import BatchClickModel, UserModel, position_bias_vector
+from ranking_sim.evaluation.metrics import EarlyStop, MetricsAggregator
 
 
 @dataclass
@@ -17,42 +21,164 @@ class RunOutput:
     metrics: dict
     n_steps: int
     steps: Optional[list[SimStepResult]] = None
+    stopped_early: bool = False
+    budget: Optional[dict] = None   # BudgetPacer.summary() when run with budgets
+    slices: Optional[dict] = None   # SliceAggregator.finalize() when run with slices
+    service: Optional[dict] = None  # latency / timeout report of simulate_service
+
+
+def _iter_scored(
+    impressions: Union[Iterable[Impression], ImpressionSource],
+    predictor: Predictor,
+    batch_size: Optional[int] = None,
+) -> Iterator[Tuple[Impression, Dict[int, float]]]:
+    """
+    Yield (impression, pctr) pairs.
+
+    Columnar sources are scored one ImpressionBatch at a time when the
+    predictor has predict_pctr_batch. Plain iterables are pulled in chunks of
+    `batch_size` impressions (default: predictor.batch_size) and scored with
+    one predict_pctr_many call per chunk. Predictors without a batch API fall
+    back to predict_pctr per impression.
+    """
+    iter_batches = getattr(impressions, "iter_batches", None)
+    predict_batch = getattr(predictor, "predict_pctr_batch", None)
+    predict_many = getattr(predictor, "predict_pctr_many", None)
+
+    if iter_batches is not None and predict_batch is not None:
+        for batch in iter_batches():
+            p = predict_batch(batch)
+            for imp, ad_ids, row in zip(batch.impressions(), batch.ad_ids.tolist(), p.tolist()):
+                yield imp, dict(zip(ad_ids, row))
+        return
+
+    if predict_many is None:
+        for imp in impressions:
+            yield imp, predictor.predict_pctr(imp)
+        return
+
+    if batch_size is None:
+        batch_size = int(getattr(predictor, "batch_size", 1024))
+    it = iter(impressions)
+    while True:
+        chunk = list(itertools.islice(it, max(1, batch_size)))
+        if not chunk:
+            return
+        yield from zip(chunk, predict_many(chunk))
+
+
+def _auction_stage(
+    auction: BatchAuction,
+    ranked: List[int],
+    scores: Dict[int, float],
+    pctr: Dict[int, float],
+    bids: Dict[int, float],
+    n_slots: int,
+    position_bias,
+) -> Tuple[List[int], List[float]]:
+    """Apply the auction's eligibility filter and price the shown slots of one impression."""
+    eligible = getattr(auction, "eligible", None)
+    if eligible is not None and ranked:
+        ok = eligible(
+            np.array([[bids[a] for a in ranked]]),
+            np.array([[pctr[a] for a in ranked]]),
+            np.array([[scores[a] for a in ranked]]),
+        )[0]
+        ranked = [a for a, keep in zip(ranked, ok.tolist()) if keep]
+
+    shown = ranked[: max(0, int(n_slots))]
+    K = len(shown)
+    ranked_scores = np.full((1, K + 1), np.nan)
+    ranked_scores[0, :len(ranked[:K + 1])] = [scores[a] for a in ranked[:K + 1]]
+    prices = auction.price_batch(
+        ranked_scores,
+        np.array([[bids[a] for a in shown]], dtype=np.float64).reshape(1, K),
+        np.array([[pctr[a] for a in shown]], dtype=np.float64).reshape(1, K),
+        position_bias_vector(position_bias, K),
+    )
+    return shown, prices[0].tolist()
 
 
 def run_simulation(
-    impressions: Iterable[Impression],
+    impressions: Union[Iterable[Impression], ImpressionSource],
     predictor: Predictor,
     policy: RankingPolicy,
-    user_model: UserModel,
+    user_model: Union[UserModel, BatchClickModel],
     n_slots: int = 1,
     seed: int = 42,
     keep_steps: bool = False,
+    batch_size: Optional[int] = None,
+    early_stop: Optional[EarlyStop] = None,
+    ndcg_ideal: str = "shown",
+    step_log: Optional[StepLogWriter] = None,
+    auction: Optional[BatchAuction] = None,
+    aggregator: Optional[MetricsAggregator] = None,
 ) -> RunOutput:
+    """
+    Per-impression simulation loop. With `early_stop`, the run ends as soon
+    as the chosen metric's CI is tight enough (checked every
+    early_stop.check_every impressions). ndcg_ideal="candidates" scores
+    NDCG against the best K of all candidates instead of the shown slots.
+
+    keep_steps holds every SimStepResult in memory; for long runs pass a
+    StepLogWriter as `step_log` instead, which streams slot outcomes to
+    disk in typed columnar chunks (flushed, not closed, at the end).
+
+    Without `auction`, shown ads pay first-price CPC. Otherwise the auction
+    filters eligible candidates and prices the slots (GSP, VCG, reserves),
+    using the user model's position_bias where the mechanism needs it.
+
+    `seed` may be anything np.random.default_rng takes (e.g. a
+    SeedSequence). Pass `aggregator` to update an existing
+    MetricsAggregator in place instead of a fresh one.
+    """
     rng = np.random.default_rng(seed)
-    metrics = MetricsAggregator(ndcg_k=n_slots)
+    metrics = aggregator if aggregator is not None else MetricsAggregator(ndcg_k=n_slots, ndcg_ideal=ndcg_ideal)
+    stopped_early = False
     steps: Optional[list[SimStepResult]] = [] if keep_steps else None
 
     n = 0
-    for imp in impressions:
+    for imp, pctr in _iter_scored(impressions, predictor, batch_size):
         n += 1
-        pctr = predictor.predict_pctr(imp)
         scores = policy.score(imp, pctr)
 
         ranked: List[int] = sorted(scores.keys(), key=lambda ad_id: scores[ad_id], reverse=True)
-        shown = ranked[: max(0, int(n_slots))]
+        by_id = {c.ad_id: c for c in imp.candidates}
+        if auction is None:
+            shown = ranked[: max(0, int(n_slots))]
+            prices = None
+        else:
+            bids = {a: float(c.bid_cpc) for a, c in by_id.items()}
+            shown, prices = _auction_stage(
+                auction, ranked, scores, pctr, bids, n_slots, getattr(user_model, "position_bias", ())
+            )
+
+        # Slate-level click models (cascade, DBN) have no per-slot sample_click.
+        slate_clicks = None
+        if not hasattr(user_model, "sample_click"):
+            shown_pctr = np.array([[pctr[a] for a in shown]], dtype=np.float64).reshape(1, len(shown))
+            slate_clicks = user_model.sample_clicks(shown_pctr, rng)[0].tolist()
 
         slot_outcomes: List[SlotOutcome] = []
         total_clicks = 0
         total_revenue = 0.0
 
         for pos, ad_id in enumerate(shown):
-            c = next(x for x in imp.candidates if x.ad_id == ad_id)
+            c = by_id[ad_id]
             this_pctr = float(pctr[ad_id])
 
-            clicked = user_model.sample_click(this_pctr, position=pos, rng=rng)
-
-            # Minimal pricing: first-price CPC (pay bid if clicked)
-            price_cpc = float(c.bid_cpc) if clicked else 0.0
+            if slate_clicks is None:
+                clicked = user_model.sample_click(this_pctr, position=pos, rng=rng)
+            else:
+                clicked = bool(slate_clicks[pos])
+
+            # Default pricing: first-price CPC (pay bid if clicked)
+            if not clicked:
+                price_cpc = 0.0
+            elif prices is None:
+                price_cpc = float(c.bid_cpc)
+            else:
+                price_cpc = float(prices[pos])
             revenue = price_cpc
 
             total_clicks += int(clicked)
@@ -79,8 +205,16 @@ def run_simulation(
             total_revenue=float(total_revenue),
         )
 
-        metrics.update(step)
+        metrics.update(step, candidate_rels=list(pctr.values()) if ndcg_ideal == "candidates" else None)
         if steps is not None:
             steps.append(step)
+        if step_log is not None:
+            step_log.log_step(step)
+
+        if early_stop is not None and n % early_stop.check_every == 0 and early_stop.should_stop(metrics):
+            stopped_early = True
+            break
 
-    return RunOutput(metrics=metrics.finalize(), n_steps=n, steps=steps)
\ No newline at end of file
+    if step_log is not None:
+        step_log.flush()
+    return RunOutput(metrics=metrics.finalize(), n_steps=n, steps=steps, stopped_early=stopped_early)
\ No newline at end of file
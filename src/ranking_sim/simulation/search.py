@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from ranking_sim.auction.mechanisms import BatchAuction
+from ranking_sim.data.batch import ImpressionBatch, ImpressionSource
+from ranking_sim.evaluation.metrics import MetricsAggregator
+from ranking_sim.evaluation.stats import z_value
+from ranking_sim.ranking.policy import BidTimesPCTRPow, RankingPolicy
+from ranking_sim.simulation.replay import DELTA_METRICS, _impression_values, crn_uniforms
+from ranking_sim.simulation.user import PositionBiasClickModel
+from ranking_sim.simulation.vectorized import _iter_batches, score_matrix, simulate_arrays
+
+
+@dataclass
+class SearchResult:
+    best: float                          # parameter value of the constrained optimum
+    feasible: bool                       # best meets the constraint (by its point estimate)
+    metrics: Dict[str, dict]             # metric -> {"mean", "stderr", "lo", "hi"} at best
+    n_impressions: int                   # impressions best was evaluated on
+    simulated_impressions: int           # sum over every evaluated value of its impressions
+    rounds: List[dict] = field(default_factory=list)
+
+
+@dataclass
+class _Candidate:
+    """Per-impression metric values of one parameter value, batch by batch."""
+    value: float
+    metrics: MetricsAggregator
+    batches: Dict[str, List[np.ndarray]] = field(default_factory=lambda: {m: [] for m in DELTA_METRICS})
+    active: bool = True
+
+    @property
+    def n_batches(self) -> int:
+        return len(self.batches[DELTA_METRICS[0]])
+
+    def values(self, metric: str, n_batches: Optional[int] = None) -> np.ndarray:
+        parts = self.batches[metric][:n_batches]
+        return np.concatenate(parts) if parts else np.empty(0)
+
+
+def _mean_ci(x: np.ndarray, z: float) -> dict:
+    n = len(x)
+    mean = float(x.mean()) if n else math.nan
+    stderr = float(x.std(ddof=1) / math.sqrt(n)) if n > 1 else math.inf
+    return {"mean": mean, "stderr": stderr, "lo": mean - z * stderr, "hi": mean + z * stderr}
+
+
+def _score_policies(policies: List[RankingPolicy], batch: ImpressionBatch, pctr: np.ndarray) -> List[np.ndarray]:
+    """(B, C) scores per policy; BidTimesPCTRPow alphas share one log pCTR (score_alphas)."""
+    if policies and all(type(p) is BidTimesPCTRPow for p in policies):
+        return list(BidTimesPCTRPow.score_alphas(batch.bids, pctr, [p.alpha for p in policies]))
+    return [score_matrix(p, batch, pctr) for p in policies]
+
+
+def _grid(lo: float, hi: float, n_points: int) -> List[float]:
+    return [float(v) for v in np.linspace(lo, hi, n_points)]
+
+
+def adaptive_search(
+    impressions: Union[ImpressionSource, Iterable[ImpressionBatch]],
+    predictor,
+    make_policy: Callable[[float], RankingPolicy],
+    bounds: Tuple[float, float],
+    user_model,
+    n_slots: int = 1,
+    objective: str = "revenue_per_impression",
+    constraint: Optional[Tuple[str, float]] = None,
+    n_points: int = 5,
+    n_rounds: int = 4,
+    min_impressions: int = 2_000,
+    tolerance: float = 0.0,
+    seed: int = 42,
+    auction: Optional[BatchAuction] = None,
+    ci_level: float = 0.95,
+) -> SearchResult:
+    """
+    Coarse-to-fine search for the parameter value that maximizes
+    `objective` subject to mean `constraint[0]` >= constraint[1] (e.g.
+    ("ndcg", 0.93)). Metrics are per impression, as in DELTA_METRICS.
+
+    Each round evaluates n_points evenly spaced values on common random
+    numbers (uniforms seeded per batch, so every value and every round
+    sees the same draws) and doubles the impression count between looks,
+    starting at min_impressions. At each look a value stops being
+    simulated once its CI shows it cannot be the answer: it is
+    significantly worse than the current leader on the paired objective
+    delta (or, with `tolerance` > 0, cannot beat it by more than that),
+    or its constraint metric is significantly below the bound. Look j tests
+    at level (1 - ci_level) / (2**j * (n_points - 1)), so repeated looks
+    over many pairs still drop a good value with probability at most
+    1 - ci_level per round. A round ends when only the leader is left and
+    its feasibility is settled, or the source runs out. The next round
+    zooms in on the leader's neighbours; values seen before keep their
+    results, so only the new points cost impressions.
+
+    Looks happen on batch boundaries, so a chunk_size of a few thousand
+    works best; use a cached predictor (CachedPCTRPredictor) as the
+    source is re-read every round.
+    `make_policy` maps a value to a policy, e.g. lambda a: BidTimesPCTRPow(alpha=a);
+    a grid of BidTimesPCTRPow is scored in log space with score_alphas.
+    """
+    if objective not in DELTA_METRICS:
+        raise ValueError(f"unknown objective: {objective!r}; expected one of {DELTA_METRICS}")
+    if constraint is not None and constraint[0] not in DELTA_METRICS:
+        raise ValueError(f"unknown constraint metric: {constraint[0]!r}; expected one of {DELTA_METRICS}")
+    if n_points < 3:
+        raise ValueError("n_points must be at least 3")
+
+    z = z_value(ci_level)
+    position_bias = list(getattr(user_model, "position_bias", ()))
+    click_model = user_model if hasattr(user_model, "sample_clicks") else PositionBiasClickModel(position_bias)
+    per_slot = int(getattr(click_model, "uniforms_per_slot", 1))
+    seen: Dict[float, _Candidate] = {}
+
+    def feasible(c: _Candidate) -> bool:
+        return constraint is None or _mean_ci(c.values(constraint[0]), z)["mean"] >= constraint[1]
+
+    def leader_of(cands: List[_Candidate]) -> _Candidate:
+        ok = [c for c in cands if feasible(c)]
+        if ok:
+            return max(ok, key=lambda c: _mean_ci(c.values(objective), z)["mean"])
+        return max(cands, key=lambda c: _mean_ci(c.values(constraint[0]), z)["mean"])
+
+    def resolved(c: _Candidate, leader: _Candidate, z_look: float) -> bool:
+        if constraint is not None and _mean_ci(c.values(constraint[0]), z_look)["hi"] < constraint[1]:
+            return True
+        n = min(c.n_batches, leader.n_batches)
+        delta = leader.values(objective, n) - c.values(objective, n)
+        return _mean_ci(delta, z_look)["lo"] > -tolerance
+
+    def leader_settled(c: _Candidate, z_look: float) -> bool:
+        if constraint is None:
+            return True
+        ci = _mean_ci(c.values(constraint[0]), z_look)
+        return ci["lo"] >= constraint[1] or ci["hi"] < constraint[1]
+
+    lo, hi = float(bounds[0]), float(bounds[1])
+    rounds: List[dict] = []
+    leader: Optional[_Candidate] = None
+    for _ in range(int(n_rounds)):
+        grid = _grid(lo, hi, n_points)
+        cands = [seen.setdefault(v, _Candidate(v, MetricsAggregator(ndcg_k=n_slots))) for v in grid]
+        for c in cands:
+            c.active = True
+
+        n_seen, n_looks, next_look = 0, 0, int(min_impressions)
+        for k, batch in enumerate(_iter_batches(impressions)):
+            todo = [c for c in cands if c.active and c.n_batches <= k]
+            if todo:
+                pctr = np.asarray(predictor.predict_pctr_batch(batch), dtype=np.float64)
+                B, C = pctr.shape
+                u = crn_uniforms(np.random.default_rng([seed, k]), B, C, n_slots, per_slot)
+                for c, scores in zip(todo, _score_policies([make_policy(c.value) for c in todo], batch, pctr)):
+                    slots = simulate_arrays(batch.bids, pctr, scores, position_bias, n_slots, None, auction, click_model, u)
+                    row_ndcg = c.metrics.update_many(slots.pctr, slots.bids, slots.clicked, slots.revenue, slots.filled)
+                    # An empty slate counts as NDCG 0 here, so every value keeps one row per impression.
+                    for m, v in _impression_values(slots, np.nan_to_num(row_ndcg, nan=0.0)).items():
+                        c.batches[m].append(v)
+            n_seen += batch.n_impressions
+
+            if n_seen < next_look:
+                continue
+            n_looks += 1
+            next_look = 2 * n_seen
+            z_look = z_value(1.0 - (1.0 - ci_level) / (2**n_looks * (n_points - 1)))
+            active = [c for c in cands if c.active]
+            leader = leader_of(active)
+            for c in active:
+                if c is not leader and resolved(c, leader, z_look):
+                    c.active = False
+            if all(not c.active for c in cands if c is not leader) and leader_settled(leader, z_look):
+                break
+
+        leader = leader_of([c for c in cands if c.active and c.n_batches])
+        rounds.append({
+            "grid": grid,
+            "leader": leader.value,
+            "n_impressions": {c.value: len(c.values(objective)) for c in cands},
+            "objective": {c.value: _mean_ci(c.values(objective), z)["mean"] for c in cands},
+        })
+        i = grid.index(leader.value)
+        lo, hi = grid[max(0, i - 1)], grid[min(len(grid) - 1, i + 1)]
+
+    assert leader is not None
+    return SearchResult(
+        best=leader.value,
+        feasible=feasible(leader),
+        metrics={m: _mean_ci(leader.values(m), z) for m in DELTA_METRICS},
+        n_impressions=len(leader.values(objective)),
+        simulated_impressions=sum(len(c.values(objective)) for c in seen.values()),
+        rounds=rounds,
+    )
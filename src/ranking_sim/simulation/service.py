@@ -0,0 +1,399 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Protocol, Set, Tuple, Union
+
+import numpy as np
+
+from ranking_sim.auction.mechanisms import BatchAuction
+from ranking_sim.data.batch import ImpressionBatch, ImpressionSource
+from ranking_sim.data.schema import Impression
+from ranking_sim.evaluation.metrics import MetricsAggregator
+from ranking_sim.ranking.policy import BidOnly, RankingPolicy
+from ranking_sim.simulation.replay import crn_uniforms
+from ranking_sim.simulation.runner import RunOutput
+from ranking_sim.simulation.user import PositionBiasClickModel
+from ranking_sim.simulation.vectorized import _iter_batches, score_matrix, simulate_arrays
+
+LATENCY_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class AsyncPredictor(Protocol):
+    async def predict(self, impression: Impression) -> Dict[int, float]:
+        """Return {ad_id: pCTR} for one impression, however long that takes."""
+
+
+@dataclass(frozen=True)
+class LatencyModel:
+    """
+    Service time in ms: (median_ms + per_item_ms * n_items) times
+    log-normal noise of shape `sigma` (0 = constant), plus `spike_ms` with
+    probability `spike_prob` (GC pauses, cold caches) for a heavier tail.
+    """
+    median_ms: float = 5.0
+    sigma: float = 0.5
+    per_item_ms: float = 0.0
+    spike_prob: float = 0.0
+    spike_ms: float = 0.0
+
+    def sample(self, rng: np.random.Generator, n_items: int = 1) -> float:
+        """One service time in seconds."""
+        ms = (self.median_ms + self.per_item_ms * n_items) * (rng.lognormal(0.0, self.sigma) if self.sigma > 0 else 1.0)
+        if self.spike_prob > 0 and rng.random() < self.spike_prob:
+            ms += self.spike_ms
+        return ms / 1000.0
+
+
+@dataclass
+class SimulatedService:
+    """
+    In-process stand-in for a pCTR service: each request takes one
+    LatencyModel draw (per_item_ms counts candidates) and is answered by
+    a synchronous predictor's predict_pctr, run in a thread while the
+    draw elapses so model time only counts where it exceeds the draw.
+    Requests do not queue behind each other.
+    """
+    predictor: object
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        self._rng = np.random.default_rng(self.seed)
+
+    async def predict(self, impression: Impression) -> Dict[int, float]:
+        answer = asyncio.get_running_loop().run_in_executor(None, self.predictor.predict_pctr, impression)
+        await asyncio.sleep(self.latency.sample(self._rng, len(impression.candidates)))
+        return await answer
+
+
+@dataclass
+class MicroBatchServer:
+    """
+    pCTR server that coalesces concurrent requests into batch calls.
+
+    A worker takes the first queued request, waits up to `window_ms` for
+    more (or until `max_batch_size` are queued) and scores them with one
+    predict_pctr_many call (e.g. PandasLightGBMPredictor), run in a
+    thread so the event loop keeps accepting requests. `latency`, if set,
+    adds simulated per-batch service time (per_item_ms counts requests).
+    With n_workers > 1 several batches are in flight at once. Batch sizes
+    are recorded in `batch_sizes`.
+    """
+    predictor: object
+    max_batch_size: int = 256
+    window_ms: float = 2.0
+    n_workers: int = 1
+    latency: Optional[LatencyModel] = None
+    seed: int = 0
+    batch_sizes: List[int] = field(default_factory=list, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._rng = np.random.default_rng(self.seed)
+        self._queue: Optional[asyncio.Queue] = None
+        self._full: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(max(1, self.n_workers))]
+
+    async def aclose(self) -> None:
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def predict(self, impression: Impression) -> Dict[int, float]:
+        if not self._workers:
+            await self.start()
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((impression, fut))
+        if self._queue.qsize() >= self.max_batch_size:
+            self._full.set()
+        return await fut
+
+    def _score(self, impressions: List[Impression]) -> List[Dict[int, float]]:
+        many = getattr(self.predictor, "predict_pctr_many", None)
+        if many is not None:
+            return many(impressions)
+        return [self.predictor.predict_pctr(imp) for imp in impressions]
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            if self._queue.qsize() + 1 < self.max_batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window_ms / 1000.0)
+                except asyncio.TimeoutError:
+                    pass
+            while len(items) < self.max_batch_size and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            if self._queue.qsize() < self.max_batch_size:
+                self._full.clear()
+
+            self.batch_sizes.append(len(items))
+            try:
+                preds = await loop.run_in_executor(None, self._score, [imp for imp, _ in items])
+                if self.latency is not None:
+                    await asyncio.sleep(self.latency.sample(self._rng, len(items)))
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), p in zip(items, preds):
+                if not fut.done():
+                    fut.set_result(p)
+
+
+# Impressions are materialized this many rows at a time while serving,
+# so building them never holds the event loop for a whole source batch.
+_SERVE_BLOCK = 64
+# Event-loop lag is sampled by a task waking up this often (s).
+_LAG_INTERVAL = 0.001
+
+
+@dataclass
+class _Served:
+    """One source batch's answers, filled in by request callbacks while serving."""
+    batch: ImpressionBatch
+    pctr: np.ndarray         # (B, C) answered pCTRs
+    latency: np.ndarray      # (B,) service latency in s
+    timed_out: np.ndarray    # (B,) bool
+
+
+def _latency_summary(seconds: np.ndarray) -> Dict[str, float]:
+    if not seconds.size:
+        return {}
+    ms = seconds * 1000.0
+    out = {f"p{p:g}": float(v) for p, v in zip(LATENCY_PERCENTILES, np.percentile(ms, LATENCY_PERCENTILES))}
+    out["mean"] = float(ms.mean())
+    out["max"] = float(ms.max())
+    return out
+
+
+def _impression_blocks(batch: ImpressionBatch, block: int) -> Iterator[Impression]:
+    """batch.impressions(), built `block` rows at a time."""
+    C = batch.n_candidates
+    for s in range(0, batch.n_impressions, block):
+        e = min(s + block, batch.n_impressions)
+        part = ImpressionBatch(
+            imp_ids=batch.imp_ids[s:e],
+            ad_ids=batch.ad_ids[s:e],
+            advertiser_ids=batch.advertiser_ids[s:e],
+            bids=batch.bids[s:e],
+            features=batch.features[s * C:e * C],
+            feature_names=batch.feature_names,
+            contexts=batch.contexts[s:e] if batch.contexts is not None else None,
+        )
+        yield from part.impressions()
+
+
+async def _watch_lag(lags: List[float], interval: float = _LAG_INTERVAL) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        t = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - t - interval, 0.0))
+
+
+def _replay_served(
+    served: List[_Served],
+    policy: RankingPolicy,
+    fallback: RankingPolicy,
+    click_model,
+    position_bias: List[float],
+    n_slots: int,
+    seed: int,
+    auction: Optional[BatchAuction],
+    ndcg_ideal: str,
+) -> Tuple[MetricsAggregator, int, float]:
+    """Rank, click and price every served batch; returns (metrics, n_timeouts, revenue lost)."""
+    rng = np.random.default_rng(seed)
+    metrics = MetricsAggregator(ndcg_k=n_slots, ndcg_ideal=ndcg_ideal)
+    per_slot = int(getattr(click_model, "uniforms_per_slot", 1))
+    n_timeouts = 0
+    revenue_lost = 0.0
+    for rec in served:
+        batch, pctr, timed_out = rec.batch, rec.pctr, rec.timed_out
+        scores = score_matrix(policy, batch, pctr)
+        B, C = pctr.shape
+        u = crn_uniforms(rng, B, C, n_slots, per_slot)
+        if timed_out.any():
+            prior = float(pctr[~timed_out].mean()) if (~timed_out).any() else float(pctr.mean())
+            fb = score_matrix(fallback, batch, np.full_like(pctr, prior))
+            out = simulate_arrays(
+                batch.bids, pctr, np.where(timed_out[:, None], fb, scores),
+                position_bias, n_slots, None, auction, click_model, u,
+            )
+            unhurried = simulate_arrays(batch.bids, pctr, scores, position_bias, n_slots, None, auction, click_model, u)
+            lost = unhurried.revenue.sum(axis=1) - out.revenue.sum(axis=1)
+            revenue_lost += float(lost[timed_out].sum())
+            n_timeouts += int(timed_out.sum())
+        else:
+            out = simulate_arrays(batch.bids, pctr, scores, position_bias, n_slots, None, auction, click_model, u)
+        metrics.update_many(
+            out.pctr, out.bids, out.clicked, out.revenue, out.filled,
+            candidate_rels=pctr if ndcg_ideal == "candidates" else None,
+        )
+    return metrics, n_timeouts, revenue_lost
+
+
+async def simulate_service(
+    impressions: Union[ImpressionSource, Iterable[ImpressionBatch]],
+    service: AsyncPredictor,
+    policy: RankingPolicy,
+    user_model,
+    n_slots: int = 1,
+    seed: int = 42,
+    timeout_ms: float = 10.0,
+    fallback: RankingPolicy = BidOnly(),
+    concurrency: int = 64,
+    qps: Optional[float] = None,
+    auction: Optional[BatchAuction] = None,
+    ndcg_ideal: str = "shown",
+) -> RunOutput:
+    """
+    Serve impressions through an async pCTR service under a per-impression
+    deadline.
+
+    Every impression is sent to `service.predict` as its own request: with
+    `qps`, at Poisson arrival times (open loop, bounded by `concurrency`
+    in flight); otherwise by `concurrency` clients back to back (closed
+    loop). A request that misses `timeout_ms` is ranked by `fallback`
+    instead, on a flat pCTR prior (the batch's mean answered pCTR). The
+    service still finishes the request, and that pCTR stays the user's
+    true click probability. Each timed-out impression is also replayed
+    under `policy` with the same click uniforms, and the paired difference
+    is reported as revenue_lost_to_timeouts.
+
+    The event loop only sends requests and keeps deadlines while serving:
+    source batches are read in a thread, impressions are built a few rows
+    at a time, and answers are stored as (B, C) pCTR rows. Ranking, clicks
+    and pricing run on whole source batches after the serving phase, in a
+    thread, as in run_vectorized; the answered pCTRs of the whole run are
+    held until then. The pacing is wall-clock real time, so which requests
+    time out depends on the machine and load; everything else follows
+    `seed`.
+
+    RunOutput.service reports service and client-side latency percentiles
+    (ms), timeouts, revenue lost, the event loop's scheduling lag while
+    serving (loop_lag_ms; when its tail nears timeout_ms, timeouts are
+    the emulator's, not the service's) and, for a MicroBatchServer, batch
+    sizes.
+    """
+    loop = asyncio.get_running_loop()
+    arrivals = np.random.default_rng([seed, 1])
+    position_bias = list(getattr(user_model, "position_bias", ()))
+    click_model = user_model if hasattr(user_model, "sample_clicks") else PositionBiasClickModel(position_bias)
+    timeout = float(timeout_ms) / 1000.0
+    sem = asyncio.Semaphore(max(1, int(concurrency)))
+    served: List[_Served] = []
+    inflight: Set[asyncio.Future] = set()
+
+    start = getattr(service, "start", None)
+    if start is not None:
+        await start()
+
+    def expire(rec: _Served, i: int, task: asyncio.Future) -> None:
+        # Decided one loop hop later, in FIFO order with task wakeups, so a
+        # response whose timer fired before the deadline's in the same loop
+        # iteration is still on time.
+        loop.call_soon(give_up, rec, i, task)
+
+    def give_up(rec: _Served, i: int, task: asyncio.Future) -> None:
+        # Deadline passed first: the client gives up (and frees its slot),
+        # but the request keeps running.
+        if not task.done():
+            rec.timed_out[i] = True
+            sem.release()
+
+    def settle(rec: _Served, i: int, deadline: asyncio.TimerHandle, task: asyncio.Future) -> None:
+        inflight.discard(task)
+        if not rec.timed_out[i]:
+            deadline.cancel()
+            sem.release()
+
+    async def call(rec: _Served, i: int, imp: Impression, started: float) -> None:
+        try:
+            answer = await service.predict(imp)
+        finally:
+            rec.latency[i] = loop.time() - started
+        rec.pctr[i] = [answer[c.ad_id] for c in imp.candidates]
+
+    async def produce() -> None:
+        t_next = loop.time()
+        batches = _iter_batches(impressions)
+        while (batch := await loop.run_in_executor(None, next, batches, None)) is not None:
+            B = batch.n_impressions
+            rec = _Served(batch, np.empty(batch.ad_ids.shape), np.empty(B), np.zeros(B, dtype=bool))
+            served.append(rec)
+            for i, imp in enumerate(_impression_blocks(batch, _SERVE_BLOCK)):
+                if qps is not None:
+                    t_next += arrivals.exponential(1.0 / qps)
+                    delay = t_next - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await sem.acquire()
+                task = asyncio.ensure_future(call(rec, i, imp, loop.time()))
+                inflight.add(task)
+                deadline = loop.call_later(timeout, expire, rec, i, task)
+                task.add_done_callback(lambda t, r=rec, i=i, d=deadline: settle(r, i, d, t))
+
+    lags: List[float] = []
+    watcher = asyncio.ensure_future(_watch_lag(lags))
+    t0 = time.perf_counter()
+    try:
+        await produce()
+        # Timed-out requests still finish server-side; their pCTRs are the truth.
+        while inflight:
+            await asyncio.gather(*list(inflight))
+    finally:
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+        for task in inflight:
+            task.cancel()
+        aclose = getattr(service, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    wall = time.perf_counter() - t0
+
+    metrics, n_timeouts, revenue_lost = await loop.run_in_executor(
+        None, _replay_served, served, policy, fallback, click_model, position_bias, n_slots, seed, auction, ndcg_ideal
+    )
+    n = metrics.impressions
+    finalized = metrics.finalize()
+    latencies = np.concatenate([rec.latency for rec in served]) if served else np.zeros(0)
+    report = {
+        "n_requests": n,
+        "wall_seconds": wall,
+        "requests_per_sec": n / wall if wall > 0 else float("inf"),
+        "timeout_ms": float(timeout_ms),
+        "n_timeouts": n_timeouts,
+        "timeout_rate": n_timeouts / n if n else 0.0,
+        "revenue_lost_to_timeouts": revenue_lost,
+        "revenue_lost_share": revenue_lost / (finalized["revenue"] + revenue_lost) if n else 0.0,
+        "service_latency_ms": _latency_summary(latencies),
+        "client_latency_ms": _latency_summary(np.minimum(latencies, timeout)),
+        "loop_lag_ms": _latency_summary(np.asarray(lags)),
+    }
+    batch_sizes = getattr(service, "batch_sizes", None)
+    if batch_sizes:
+        sizes = np.asarray(batch_sizes)
+        report["batch_size"] = {
+            "n_batches": int(sizes.size),
+            "mean": float(sizes.mean()),
+            "p50": float(np.percentile(sizes, 50)),
+            "p99": float(np.percentile(sizes, 99)),
+            "max": int(sizes.max()),
+        }
+    return RunOutput(metrics=finalized, n_steps=n, service=report)
+
+
+def run_service(*args, **kwargs) -> RunOutput:
+    """Blocking wrapper: asyncio.run(simulate_service(...))."""
+    return asyncio.run(simulate_service(*args, **kwargs))
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from ranking_sim.data.schema import SimStepResult
+
+# One row per shown slot. revenue == price_cpc, so it is not stored.
+STEP_LOG_SCHEMA: Dict[str, np.dtype] = {
+    "imp_id": np.dtype(np.int64),
+    "position": np.dtype(np.int16),
+    "ad_id": np.dtype(np.int64),
+    "advertiser_id": np.dtype(np.int64),
+    "bid_cpc": np.dtype(np.float64),
+    "pctr": np.dtype(np.float64),
+    "clicked": np.dtype(np.bool_),
+    "price_cpc": np.dtype(np.float64),
+}
+
+_META_FILE = "meta.json"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("pyarrow is not installed. pip install pyarrow") from e
+    return pa, pq
+
+
+class StepLogWriter:
+    """
+    Append-only slot-outcome log backed by preallocated typed arrays.
+
+    Rows accumulate in fixed-size column buffers and are flushed every
+    `chunk_rows` rows to `path/chunk_XXXXX/<column>.npy` (format="npy") or
+    `path/chunk_XXXXX.parquet` (format="parquet", needs pyarrow), so memory
+    stays bounded whatever the run length. meta.json lists the chunks and
+    is rewritten on every flush. Use as a context manager or call close().
+    """
+
+    def __init__(self, path: str, chunk_rows: int = 1 << 20, format: str = "npy") -> None:
+        if format not in ("npy", "parquet"):
+            raise ValueError(f"unknown format: {format!r}")
+        if format == "parquet":
+            _require_pyarrow()
+        self.path = path
+        self.format = format
+        self.chunk_rows = int(chunk_rows)
+        self._buf = {name: np.empty(self.chunk_rows, dtype=dt) for name, dt in STEP_LOG_SCHEMA.items()}
+        self._n = 0
+        self._chunks: List[Dict[str, object]] = []
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def n_rows(self) -> int:
+        return sum(int(c["rows"]) for c in self._chunks) + self._n
+
+    def append(self, **columns: np.ndarray) -> None:
+        """Append equal-length 1-d arrays, one per STEP_LOG_SCHEMA column."""
+        missing = set(STEP_LOG_SCHEMA) - set(columns)
+        if missing:
+            raise KeyError(f"missing step-log columns: {sorted(missing)}")
+        cols = {name: np.asarray(columns[name]).reshape(-1) for name in STEP_LOG_SCHEMA}
+        n = len(cols["imp_id"])
+
+        start = 0
+        while start < n:
+            take = min(n - start, self.chunk_rows - self._n)
+            for name, col in cols.items():
+                self._buf[name][self._n:self._n + take] = col[start:start + take]
+            self._n += take
+            start += take
+            if self._n == self.chunk_rows:
+                self.flush()
+
+    def log_step(self, step: SimStepResult) -> None:
+        """Append the slot outcomes of one SimStepResult (per-impression runner)."""
+        for s in step.slot_outcomes:
+            i = self._n
+            b = self._buf
+            b["imp_id"][i] = step.imp_id
+            b["position"][i] = s.position
+            b["ad_id"][i] = s.ad_id
+            b["advertiser_id"][i] = s.advertiser_id
+            b["bid_cpc"][i] = s.bid_cpc
+            b["pctr"][i] = s.pctr
+            b["clicked"][i] = s.clicked
+            b["price_cpc"][i] = s.price_cpc
+            self._n += 1
+            if self._n == self.chunk_rows:
+                self.flush()
+
+    def log_slots(
+        self,
+        imp_ids: np.ndarray,
+        ad_ids: np.ndarray,
+        advertiser_ids: np.ndarray,
+        bids: np.ndarray,
+        pctr: np.ndarray,
+        clicked: np.ndarray,
+        price_cpc: np.ndarray,
+        shown: Optional[np.ndarray] = None,
+    ) -> None:
+        """Append a block of (B, K) slot arrays in rank order (vectorized runner)."""
+        B, K = pctr.shape
+        keep = np.ones((B, K), dtype=bool) if shown is None else np.asarray(shown, dtype=bool)
+        self.append(
+            imp_id=np.broadcast_to(np.asarray(imp_ids)[:, None], (B, K))[keep],
+            position=np.broadcast_to(np.arange(K), (B, K))[keep],
+            ad_id=ad_ids[keep],
+            advertiser_id=advertiser_ids[keep],
+            bid_cpc=bids[keep],
+            pctr=pctr[keep],
+            clicked=clicked[keep],
+            price_cpc=price_cpc[keep],
+        )
+
+    def flush(self) -> None:
+        if self._n == 0:
+            return
+        name = f"chunk_{len(self._chunks):05d}"
+        cols = {k: v[:self._n] for k, v in self._buf.items()}
+        if self.format == "npy":
+            chunk_dir = os.path.join(self.path, name)
+            os.makedirs(chunk_dir, exist_ok=True)
+            for col, arr in cols.items():
+                np.save(os.path.join(chunk_dir, f"{col}.npy"), arr)
+        else:
+            pa, pq = _require_pyarrow()
+            pq.write_table(pa.table(cols), os.path.join(self.path, f"{name}.parquet"))
+        self._chunks.append({"name": name, "rows": self._n})
+        self._n = 0
+        self._write_meta()
+
+    def close(self) -> None:
+        self.flush()
+        self._write_meta()
+
+    def _write_meta(self) -> None:
+        meta = {
+            "format": self.format,
+            "schema": {k: v.str for k, v in STEP_LOG_SCHEMA.items()},
+            "chunks": self._chunks,
+        }
+        tmp = os.path.join(self.path, _META_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, _META_FILE))
+
+    def __enter__(self) -> "StepLogWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class StepLogReader:
+    """
+    Lazy reader for a StepLogWriter directory. Only the requested columns
+    are touched: .npy chunks are memory-mapped, Parquet chunks are read
+    column-selectively.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        self.format: str = meta["format"]
+        self.schema: Dict[str, np.dtype] = {k: np.dtype(v) for k, v in meta["schema"].items()}
+        self.chunks: List[Dict[str, object]] = meta["chunks"]
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.schema)
+
+    @property
+    def n_rows(self) -> int:
+        return sum(int(c["rows"]) for c in self.chunks)
+
+    def iter_chunks(self, columns: Optional[Sequence[str]] = None) -> Iterator[Dict[str, np.ndarray]]:
+        cols = list(self.schema if columns is None else columns)
+        unknown = set(cols) - set(self.schema)
+        if unknown:
+            raise KeyError(f"unknown step-log columns: {sorted(unknown)}")
+
+        for chunk in self.chunks:
+            name = str(chunk["name"])
+            if self.format == "npy":
+                yield {
+                    c: np.load(os.path.join(self.path, name, f"{c}.npy"), mmap_mode="r")
+                    for c in cols
+                }
+            else:
+                _, pq = _require_pyarrow()
+                table = pq.read_table(os.path.join(self.path, f"{name}.parquet"), columns=cols)
+                yield {c: table.column(c).to_numpy() for c in cols}
+
+    def read(self, columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """Concatenate the selected columns across all chunks."""
+        cols = list(self.schema if columns is None else columns)
+        parts: Dict[str, List[np.ndarray]] = {c: [] for c in cols}
+        for chunk in self.iter_chunks(cols):
+            for c in cols:
+                parts[c].append(np.asarray(chunk[c]))
+        return {
+            c: np.concatenate(p) if p else np.empty(0, dtype=self.schema[c])
+            for c, p in parts.items()
+        }
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import product
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ranking_sim.auction.mechanisms import FirstPriceCPC
+from ranking_sim.data.batch import ArraySource
+from ranking_sim.models.pctr_cache import CachedPCTRPredictor
+from ranking_sim.ranking.policy import BidTimesPCTRPow
+from ranking_sim.simulation.user import PositionBiasClickModel
+from ranking_sim.simulation.vectorized import run_vectorized
+
+
+METRIC_FIELDS = ["clicks_per_impression", "ctr_per_slot", "revenue", "ecpm", "mean_ndcg"]
+CELL_FIELDS = ["cell_id", "alpha", "n_slots", "position_bias", "auction", "seed"]
+
+# Imported once by the forkserver, so pool workers fork with them loaded.
+WORKER_PRELOAD = (
+    "numpy",
+    "ranking_sim.models.pctr_cache",
+    "ranking_sim.simulation.sweep",
+    "ranking_sim.simulation.vectorized",
+)
+
+
+def worker_context(start_method: str = "forkserver", preload: Sequence[str] = WORKER_PRELOAD):
+    """
+    multiprocessing context for worker pools. With "forkserver", a server
+    process imports `preload` once and every worker is forked from it,
+    so a pool pays interpreter and import startup once instead of per
+    worker (as "spawn" does) and without inheriting the parent's memory
+    and threads (as "fork" does).
+    """
+    ctx = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        ctx.set_forkserver_preload(list(preload))
+    return ctx
+
+
+@dataclass(frozen=True)
+class SweepCell:
+    """One grid point. Everything a worker needs besides the shared arrays."""
+    cell_id: int
+    alpha: float
+    n_slots: int
+    position_bias: Tuple[float, ...]
+    auction: Any
+    seed: int
+
+    def params(self) -> Dict[str, Any]:
+        return {
+            "cell_id": self.cell_id,
+            "alpha": self.alpha,
+            "n_slots": self.n_slots,
+            "position_bias": "|".join(f"{b:g}" for b in self.position_bias),
+            "auction": repr(self.auction),
+            "seed": self.seed,
+        }
+
+
+def build_grid(
+    alphas: Sequence[float],
+    n_slots: Sequence[int] = (4,),
+    position_biases: Sequence[Sequence[float]] = ((1.0, 0.7, 0.5, 0.3),),
+    auctions: Sequence[Any] = (FirstPriceCPC(),),
+    seed: int = 42,
+) -> List[SweepCell]:
+    """
+    Cartesian grid of cells. Every cell uses the same click seed, so cells
+    are compared on common random numbers (as the serial sweep did).
+    """
+    cells = []
+    for i, (alpha, k, pb, auction) in enumerate(product(alphas, n_slots, position_biases, auctions)):
+        cells.append(
+            SweepCell(
+                cell_id=i,
+                alpha=float(alpha),
+                n_slots=int(k),
+                position_bias=tuple(float(b) for b in pb),
+                auction=auction,
+                seed=int(seed),
+            )
+        )
+    return cells
+
+
+def export_shared(data_dir: str, source: ArraySource, pctr: np.ndarray) -> str:
+    """Write the read-only arrays every worker maps: bids, advertiser ids, pCTR."""
+    os.makedirs(data_dir, exist_ok=True)
+    np.save(os.path.join(data_dir, "bids.npy"), np.asarray(source.bids, dtype=np.float64))
+    np.save(os.path.join(data_dir, "advertiser_ids.npy"), np.asarray(source.advertiser_ids, dtype=np.int64))
+    np.save(os.path.join(data_dir, "pctr.npy"), np.asarray(pctr, dtype=np.float64))
+    return data_dir
+
+
+# Per-process view of the shared arrays, set once by _init_worker.
+_SHARED: Dict[str, Any] = {}
+
+
+def _init_worker(data_dir: str, chunk_size: int) -> None:
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(data_dir, f"{name}.npy"), mmap_mode="r")
+
+    _SHARED["source"] = ArraySource(
+        bids=load("bids"),
+        advertiser_ids=load("advertiser_ids"),
+        chunk_size=chunk_size,
+    )
+    _SHARED["predictor"] = CachedPCTRPredictor(load("pctr"))
+
+
+def _run_cell(cell: SweepCell) -> Dict[str, Any]:
+    out = run_vectorized(
+        impressions=_SHARED["source"],
+        predictor=_SHARED["predictor"],
+        policy=BidTimesPCTRPow(alpha=cell.alpha),
+        user_model=PositionBiasClickModel(position_bias=list(cell.position_bias)),
+        n_slots=cell.n_slots,
+        seed=cell.seed,
+        auction=cell.auction,
+    )
+    row = cell.params()
+    row.update({k: out.metrics[k] for k in METRIC_FIELDS})
+    return row
+
+
+def run_sweep(
+    cells: Sequence[SweepCell],
+    data_dir: str,
+    out_csv: Optional[str] = None,
+    n_workers: Optional[int] = None,
+    chunk_size: int = 65_536,
+    start_method: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run every cell against the arrays in `data_dir` (see export_shared).
+
+    Cells are spread over a process pool; workers memory-map the shared
+    arrays instead of receiving pickled copies. Each row is appended to
+    `out_csv` as soon as its cell finishes, so the file is in completion
+    order; rows are returned sorted by cell_id. A cell's numbers depend
+    only on its own parameters and seed, never on n_workers.
+    n_workers <= 1 runs in-process. `start_method` picks the pool's
+    multiprocessing start method (default: the platform's); "forkserver"
+    pre-forks workers with WORKER_PRELOAD already imported (see
+    worker_context).
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    rows: List[Dict[str, Any]] = []
+
+    f = open(out_csv, "w", newline="") if out_csv else None
+    try:
+        writer = None
+        if f is not None:
+            writer = csv.DictWriter(f, fieldnames=CELL_FIELDS + METRIC_FIELDS)
+            writer.writeheader()
+
+        def emit(row: Dict[str, Any]) -> None:
+            rows.append(row)
+            if writer is not None:
+                writer.writerow(row)
+                f.flush()
+
+        if n_workers <= 1:
+            _init_worker(data_dir, chunk_size)
+            for cell in cells:
+                emit(_run_cell(cell))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=worker_context(start_method) if start_method is not None else None,
+                initializer=_init_worker,
+                initargs=(data_dir, chunk_size),
+            ) as pool:
+                futures = [pool.submit(_run_cell, cell) for cell in cells]
+                for fut in as_completed(futures):
+                    emit(fut.result())
+    finally:
+        if f is not None:
+            f.close()
+
+    return sorted(rows, key=lambda r: r["cell_id"])
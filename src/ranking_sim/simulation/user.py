@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List, Protocol
+from typing import List, Optional, Protocol, Sequence
 
 import numpy as np
 
@@ -11,6 +11,57 @@ class UserModel(Protocol):
         """Return click outcome for shown ad."""
 
 
+class BatchClickModel(Protocol):
+    """
+    Click model over whole slates. pctr is (B, K) in rank order; `filled`
+    marks slots that actually hold an ad (unfilled slots never click).
+    clicks_from_uniforms maps a (B, K) or (B, K, uniforms_per_slot) uniform
+    array to clicks, so common random numbers can be fed in from outside.
+    """
+    uniforms_per_slot: int
+
+    def sample_clicks(
+        self, pctr: np.ndarray, rng: np.random.Generator, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Return a (B, K) bool click matrix from one RNG draw."""
+
+    def clicks_from_uniforms(
+        self, pctr: np.ndarray, u: np.ndarray, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Return a (B, K) bool click matrix for the given uniforms."""
+
+    def click_probs(self, pctr: np.ndarray) -> np.ndarray:
+        """Return the (B, K) marginal click probabilities."""
+
+
+def _draw_uniforms(rng: np.random.Generator, shape, uniforms_per_slot: int) -> np.ndarray:
+    return rng.random(shape if uniforms_per_slot == 1 else tuple(shape) + (uniforms_per_slot,))
+
+
+def _mask(clicked: np.ndarray, filled: Optional[np.ndarray]) -> np.ndarray:
+    return clicked if filled is None else clicked & filled
+
+
+def _reached(go_on: np.ndarray) -> np.ndarray:
+    """
+    Examination of a cascade: slot k is reached iff the user went on past
+    every slot above it. go_on is (B, K) bool; returns (B, K) bool with
+    column 0 all True (a shifted running AND, i.e. a boolean cumprod).
+    """
+    reached = np.ones_like(go_on, dtype=bool)
+    if go_on.shape[1] > 1:
+        np.logical_and.accumulate(go_on[:, :-1], axis=1, out=reached[:, 1:])
+    return reached
+
+
+def _shifted_cumprod(p: np.ndarray) -> np.ndarray:
+    """(B, K) products of p over the slots strictly above each slot."""
+    out = np.ones_like(p, dtype=np.float64)
+    if p.shape[1] > 1:
+        np.cumprod(p[:, :-1], axis=1, out=out[:, 1:])
+    return out
+
+
 @dataclass(frozen=True)
 class PositionBiasClickModel:
     """
@@ -25,4 +76,97 @@ class PositionBiasClickModel:
             pb = float(self.position_bias[position])
 
         click_prob = float(np.clip(float(pctr) * pb, 0.0, 1.0))
-        return bool(rng.random() < click_prob)
\ No newline at end of file
+        return bool(rng.random() < click_prob)
+
+    uniforms_per_slot = 1
+
+    def click_probs(self, pctr: np.ndarray) -> np.ndarray:
+        return np.clip(pctr * position_bias_vector(self.position_bias, pctr.shape[1]), 0.0, 1.0)
+
+    def sample_clicks(
+        self, pctr: np.ndarray, rng: np.random.Generator, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        # One (B, K) draw: same stream as B * K sample_click calls in rank order.
+        return self.clicks_from_uniforms(pctr, rng.random(pctr.shape), filled)
+
+    def clicks_from_uniforms(
+        self, pctr: np.ndarray, u: np.ndarray, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        return _mask(u < self.click_probs(pctr), filled)
+
+
+@dataclass(frozen=True)
+class CascadeClickModel:
+    """
+    Cascade model: the user scans top-down, clicks the first attractive ad
+    (attractiveness = pCTR) and leaves. After a skipped slot they go on to
+    the next one with probability continue_prob (1.0 = classic cascade).
+    At most one click per slate.
+    """
+    continue_prob: float = 1.0
+
+    @property
+    def uniforms_per_slot(self) -> int:
+        return 1 if self.continue_prob >= 1.0 else 2
+
+    def click_probs(self, pctr: np.ndarray) -> np.ndarray:
+        a = np.clip(pctr, 0.0, 1.0)
+        return _shifted_cumprod((1.0 - a) * min(float(self.continue_prob), 1.0)) * a
+
+    def sample_clicks(
+        self, pctr: np.ndarray, rng: np.random.Generator, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        return self.clicks_from_uniforms(pctr, _draw_uniforms(rng, pctr.shape, self.uniforms_per_slot), filled)
+
+    def clicks_from_uniforms(
+        self, pctr: np.ndarray, u: np.ndarray, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        u_attr = u if u.ndim == 2 else u[..., 0]
+        attractive = _mask(u_attr < np.clip(pctr, 0.0, 1.0), filled)
+        go_on = ~attractive
+        if u.ndim == 3:
+            go_on &= u[..., 1] < self.continue_prob
+        return attractive & _reached(go_on)
+
+
+@dataclass(frozen=True)
+class DBNClickModel:
+    """
+    Dynamic Bayesian network click model (Chapelle & Zhang, 2009).
+
+    At each examined slot the ad is clicked if attractive (prob = pCTR);
+    a click satisfies the user with prob `satisfaction`, ending the session.
+    An unsatisfied user examines the next slot with prob `perseverance`.
+    Uses three uniforms per slot (attraction, satisfaction, perseverance).
+    """
+    satisfaction: float = 0.5
+    perseverance: float = 0.9
+
+    uniforms_per_slot = 3
+
+    def click_probs(self, pctr: np.ndarray) -> np.ndarray:
+        a = np.clip(pctr, 0.0, 1.0)
+        go_on = (1.0 - a * float(self.satisfaction)) * float(self.perseverance)
+        return _shifted_cumprod(go_on) * a
+
+    def sample_clicks(
+        self, pctr: np.ndarray, rng: np.random.Generator, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        return self.clicks_from_uniforms(pctr, _draw_uniforms(rng, pctr.shape, 3), filled)
+
+    def clicks_from_uniforms(
+        self, pctr: np.ndarray, u: np.ndarray, filled: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        attractive = _mask(u[..., 0] < np.clip(pctr, 0.0, 1.0), filled)
+        satisfied = u[..., 1] < self.satisfaction
+        persevere = u[..., 2] < self.perseverance
+        stop = (attractive & satisfied) | ~persevere
+        return attractive & _reached(~stop)
+
+
+def position_bias_vector(position_bias: Sequence[float], k: int) -> np.ndarray:
+    """Bias for positions 0..k-1; positions past the list get 1.0 (as in sample_click)."""
+    pb = np.ones(k, dtype=np.float64)
+    n = min(k, len(position_bias))
+    pb[:n] = np.asarray(position_bias[:n], dtype=np.float64)
+    return pb
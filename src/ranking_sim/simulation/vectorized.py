@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from typing import Iterable, Iterator, Optional, Sequence, Union
+
+import numpy as np
+
+from ranking_sim.auction.mechanisms import BatchAuction, FirstPriceCPC
+from ranking_sim.data.batch import ImpressionBatch, ImpressionSource
+from ranking_sim.evaluation.metrics import EarlyStop, MetricsAggregator
+from ranking_sim.ranking.policy import RankingPolicy, score_batch
+from ranking_sim.simulation.budget import BudgetPacer
+from ranking_sim.simulation.runner import RunOutput
+from ranking_sim.simulation.step_log import StepLogWriter
+from ranking_sim.simulation.user import BatchClickModel, PositionBiasClickModel, position_bias_vector
+
+
+@dataclass(frozen=True)
+class SlotArrays:
+    """
+    Slot-level outcomes for a block of B impressions and K slots.
+    Column k is position k; `shown` holds candidate column indices and
+    `filled` is False where no eligible candidate was left for the slot.
+    """
+    shown: np.ndarray      # (B, K) int64
+    filled: np.ndarray     # (B, K) bool
+    bids: np.ndarray       # (B, K) float64
+    pctr: np.ndarray       # (B, K) float64
+    clicked: np.ndarray    # (B, K) bool
+    price_cpc: np.ndarray  # (B, K) float64, 0 where not clicked
+    revenue: np.ndarray    # (B, K) float64
+    eligible: Optional[np.ndarray] = None         # (B, C) mask applied before ranking; None = all
+    log_propensity: Optional[np.ndarray] = None   # (B, K) log P(shown[:, :k+1]) under a stochastic ranker
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Column indices of the k highest scores per row, best first.
+
+    Uses argpartition, then a stable sort of the k survivors, so ties are
+    broken by candidate order like the sorted(...) in run_simulation.
+    """
+    B, C = scores.shape
+    k = min(int(k), C)
+    if k <= 0:
+        return np.empty((B, 0), dtype=np.int64)
+    if k < C:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        part.sort(axis=1)
+    else:
+        part = np.broadcast_to(np.arange(C), (B, C))
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+
+def score_matrix(policy: RankingPolicy, batch: ImpressionBatch, pctr: np.ndarray) -> np.ndarray:
+    """(B, C) ranking scores for a batch; see ranking.policy.score_batch."""
+    return score_batch(policy, batch, pctr)
+
+
+def simulate_arrays(
+    bids: np.ndarray,
+    pctr: np.ndarray,
+    scores: np.ndarray,
+    position_bias: Sequence[float],
+    n_slots: int,
+    rng: np.random.Generator,
+    auction: Optional[BatchAuction] = None,
+    click_model: Optional[BatchClickModel] = None,
+    uniforms: Optional[np.ndarray] = None,
+    eligible: Optional[np.ndarray] = None,
+    ranker=None,
+    rank_rng: Optional[np.random.Generator] = None,
+) -> SlotArrays:
+    """
+    Rank, show, click and price a (B, C) block in one pass.
+
+    Clicks come from click_model.sample_clicks (default: position-bias
+    model). For PositionBiasClickModel that is a single (B, K) uniform draw,
+    consuming the generator in the same order as run_simulation's per-slot
+    rng.random() calls. Pricing defaults to first-price CPC; an auction with
+    an `eligible` mask (e.g. ReservePrice) can leave slots unfilled.
+
+    `uniforms` switches to common random numbers: a (B, C, n_slots) or
+    (B, C, n_slots, uniforms_per_slot) array indexed by (impression,
+    candidate, position). Each shown slot uses the entry of the candidate
+    placed there, and `rng` is not touched.
+
+    `eligible` is an extra (B, C) bool mask (e.g. from BudgetPacer.gate),
+    combined with the auction's own.
+
+    With a stochastic `ranker` (e.g. PlackettLuce) the slate is drawn with
+    ranker.sample(scores, n_slots + 1, rank_rng) instead of taking the top
+    scores, and the prefix log-propensities of the shown slots are
+    returned for off-policy evaluation. The (n_slots + 1)-th draw is the
+    "next" score the auction prices against.
+    """
+    auction = auction if auction is not None else FirstPriceCPC()
+    auction_eligible = getattr(auction, "eligible", None)
+    if auction_eligible is not None:
+        ok = auction_eligible(bids, pctr, scores)
+        eligible = ok if eligible is None else ok & eligible
+    if ranker is not None:
+        drawable = ranker.log_weights(scores) > -np.inf
+        eligible = drawable if eligible is None else eligible & drawable
+    if eligible is not None:
+        scores = np.where(eligible, scores, -np.inf)
+
+    B, C = scores.shape
+    K = max(0, min(int(n_slots), C))
+    if ranker is None:
+        ranked = top_k(scores, K + 1)
+    else:
+        ranked = ranker.sample(scores, min(K + 1, C), rank_rng)
+    shown = ranked[:, :K]
+
+    shown_bids = np.take_along_axis(bids, shown, axis=1)
+    shown_pctr = np.take_along_axis(pctr, shown, axis=1)
+    ranked_scores = np.full((B, K + 1), np.nan)
+    ranked_scores[:, :ranked.shape[1]] = np.take_along_axis(scores, ranked, axis=1)
+    filled = ranked_scores[:, :K] > -np.inf
+    ranked_scores[ranked_scores == -np.inf] = np.nan
+
+    if click_model is None:
+        click_model = PositionBiasClickModel(position_bias=list(position_bias))
+    if uniforms is None:
+        clicked = click_model.sample_clicks(shown_pctr, rng, filled)
+    else:
+        u = uniforms[np.arange(B)[:, None], shown, np.arange(K)[None, :]]
+        clicked = click_model.clicks_from_uniforms(shown_pctr, u, filled)
+
+    pb = position_bias_vector(position_bias, K)
+
+    price_if_clicked = auction.price_batch(ranked_scores, shown_bids, shown_pctr, pb)
+    price = np.where(clicked, price_if_clicked, 0.0)
+    log_propensity = None
+    if ranker is not None:
+        log_propensity = ranker.log_prefix_propensity(scores, shown, filled)
+    return SlotArrays(
+        shown=shown,
+        filled=filled,
+        bids=shown_bids,
+        pctr=shown_pctr,
+        clicked=clicked,
+        price_cpc=price,
+        revenue=price,
+        eligible=eligible,
+        log_propensity=log_propensity,
+    )
+
+
+def _iter_batches(impressions: Union[ImpressionSource, Iterable[ImpressionBatch]]) -> Iterator[ImpressionBatch]:
+    iter_batches = getattr(impressions, "iter_batches", None)
+    return iter_batches() if iter_batches is not None else iter(impressions)
+
+
+def run_vectorized(
+    impressions: Union[ImpressionSource, Iterable[ImpressionBatch]],
+    predictor,
+    policy: RankingPolicy,
+    user_model,
+    n_slots: int = 1,
+    seed: int = 42,
+    auction: Optional[BatchAuction] = None,
+    early_stop: Optional[EarlyStop] = None,
+    ndcg_ideal: str = "shown",
+    step_log: Optional[StepLogWriter] = None,
+    budgets: Optional[BudgetPacer] = None,
+    ranker=None,
+    slate_log=None,
+    aggregator: Optional[MetricsAggregator] = None,
+    slices=None,
+) -> RunOutput:
+    """
+    Array-based counterpart of run_simulation.
+
+    Works on whole ImpressionBatch blocks: the predictor's
+    predict_pctr_batch gives a (B, C) pCTR matrix, the policy a (B, C) score
+    matrix, and ranking, clicks and revenue are computed with array ops.
+    `user_model` must be a BatchClickModel (PositionBiasClickModel,
+    CascadeClickModel, DBNClickModel) or at least expose `position_bias`;
+    `auction` prices the shown slots (default: first-price CPC) and takes
+    its position weights from `position_bias` (1.0 where absent).
+
+    For the same impressions, seed and policy this reproduces
+    run_simulation's clicks and revenue (up to float summation order and
+    tie-breaking at the top-K boundary) as long as every slate is full;
+    when an eligibility mask leaves slots empty, uniforms are still drawn
+    for them, so the two click streams diverge from that point on.
+    No per-step objects are kept.
+    With `early_stop`, the CI target is checked after every batch;
+    ndcg_ideal and step_log are as in run_simulation.
+
+    `budgets` gates each batch before ranking (budget exhaustion,
+    throttling or bid shading; shaded bids are what the policy ranks and
+    the auction charges) and books its spend afterwards; its summary is
+    returned as RunOutput.budget.
+
+    A stochastic `ranker` (ranking.stochastic.PlackettLuce) draws each
+    slate instead of taking the top scores, from its own generator so the
+    click stream is unchanged; `slate_log` (evaluation.ope.SlateLog) then
+    records candidates, slates and propensities for off-policy evaluation.
+
+    `slices` (evaluation.slices.SliceAggregator) breaks metrics down by
+    advertiser, pCTR bucket or context field as batches go by; it is
+    updated in place and its finalize() returned as RunOutput.slices.
+
+    `seed` and `aggregator` are as in run_simulation (`seed` must be an
+    int with a ranker, whose generator is seeded from [seed, 1]).
+    """
+    rng = np.random.default_rng(seed)
+    metrics = aggregator if aggregator is not None else MetricsAggregator(ndcg_k=n_slots, ndcg_ideal=ndcg_ideal)
+    stopped_early = False
+    position_bias = list(getattr(user_model, "position_bias", ()))
+    click_model = user_model if hasattr(user_model, "sample_clicks") else None
+    rank_rng = np.random.default_rng([seed, 1]) if ranker is not None else None
+    if slate_log is not None and ranker is None:
+        raise ValueError("slate_log needs a stochastic ranker to log propensities")
+
+    n = 0
+    for batch in _iter_batches(impressions):
+        pctr = np.asarray(predictor.predict_pctr_batch(batch), dtype=np.float64)
+        eligible = None
+        if budgets is not None:
+            bids, eligible = budgets.gate(batch.advertiser_ids, batch.bids)
+            if bids is not batch.bids:
+                batch = replace(batch, bids=bids)
+        scores = score_matrix(policy, batch, pctr)
+        slots = simulate_arrays(
+            batch.bids, pctr, scores, position_bias, n_slots, rng, auction, click_model,
+            eligible=eligible, ranker=ranker, rank_rng=rank_rng,
+        )
+        if slate_log is not None:
+            slate_log.append(batch.bids, pctr, slots)
+        row_ndcg = metrics.update_many(
+            slots.pctr, slots.bids, slots.clicked, slots.revenue, slots.filled,
+            candidate_rels=pctr if ndcg_ideal == "candidates" else None,
+        )
+        if slices is not None:
+            slices.update(batch, pctr, slots, row_ndcg)
+        if budgets is not None or step_log is not None:
+            shown_advertisers = np.take_along_axis(batch.advertiser_ids, slots.shown, axis=1)
+        if budgets is not None:
+            budgets.record(shown_advertisers, slots.revenue, slots.clicked, slots.filled, batch.n_impressions)
+        if step_log is not None:
+            step_log.log_slots(
+                batch.imp_ids,
+                np.take_along_axis(batch.ad_ids, slots.shown, axis=1),
+                shown_advertisers,
+                slots.bids, slots.pctr, slots.clicked, slots.price_cpc, slots.filled,
+            )
+        n += batch.n_impressions
+
+        if early_stop is not None and early_stop.should_stop(metrics):
+            stopped_early = True
+            break
+
+    if step_log is not None:
+        step_log.flush()
+    return RunOutput(
+        metrics=metrics.finalize(),
+        n_steps=n,
+        steps=None,
+        stopped_early=stopped_early,
+        budget=budgets.summary() if budgets is not None else None,
+        slices=slices.finalize() if slices is not None else None,
+    )
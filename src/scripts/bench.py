@@ -0,0 +1,449 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ranking_sim.data.batch import ImpressionBatch
+from ranking_sim.data.feature_bank import FeatureBankSource
+from ranking_sim.data.schema import Impression, SimStepResult, SlotOutcome
+from ranking_sim.evaluation.metrics import MetricsAggregator
+from ranking_sim.models.features import batch_feature_matrix, stack_candidate_features
+from ranking_sim.ranking.policy import BidTimesPCTR
+from ranking_sim.simulation.runner import run_simulation
+from ranking_sim.simulation.sweep import worker_context
+from ranking_sim.simulation.user import PositionBiasClickModel
+from ranking_sim.simulation.vectorized import run_vectorized, top_k
+
+ARRAY_STAGES = ("generate", "predict", "score", "rank", "click", "metrics")
+LOOP_STAGES = ("generate", "predict_pctr", "policy_score", "sort", "click", "metrics_update")
+
+# Entry points whose cold import time is held to --startup-budget-ms, and
+# optional backends none of them may pull in.
+STARTUP_MODULES = (
+    "ranking_sim.models.predictor",
+    "ranking_sim.simulation.runner",
+    "ranking_sim.simulation.vectorized",
+    "ranking_sim.simulation.sweep",
+    "scripts.run_sim",
+    "scripts.sweep_alpha",
+)
+HEAVY_MODULES = ("pandas", "lightgbm", "pyarrow")
+
+
+def synthetic_bank(
+    n_rows: int, n_features: int, seed: int = 0, nan_rate: float = 0.02
+) -> Tuple[np.ndarray, List[str]]:
+    """Gaussian float32 feature bank with a sprinkling of NaNs; no artifacts needed."""
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((n_rows, n_features), dtype=np.float32)
+    X[rng.random(X.shape) < nan_rate] = np.nan
+    return X, [f"f{j}" for j in range(n_features)]
+
+
+@dataclass
+class LinearCTRPredictor:
+    """Logistic pCTR over a random linear model; cheap stand-in for a trained model."""
+    feature_names: List[str]
+    seed: int = 0
+    base_rate: float = 0.05
+    batch_size: int = 4096
+
+    def __post_init__(self) -> None:
+        rng = np.random.default_rng(self.seed)
+        self._w = rng.normal(0.0, 1.0 / np.sqrt(max(1, len(self.feature_names))), len(self.feature_names))
+        self._b = float(np.log(self.base_rate / (1.0 - self.base_rate)))
+
+    def predict_pctr_matrix(self, X: np.ndarray) -> np.ndarray:
+        z = np.nan_to_num(np.asarray(X, dtype=np.float64)) @ self._w + self._b
+        return np.clip(1.0 / (1.0 + np.exp(-z)), 1e-6, 1.0 - 1e-6)
+
+    def predict_pctr(self, impression: Impression) -> Dict[int, float]:
+        return self.predict_pctr_many([impression])[0]
+
+    def predict_pctr_many(self, impressions: Sequence[Impression]) -> List[Dict[int, float]]:
+        p = self.predict_pctr_matrix(stack_candidate_features(impressions, self.feature_names)).tolist()
+        out, r = [], 0
+        for imp in impressions:
+            n = len(imp.candidates)
+            out.append({c.ad_id: pi for c, pi in zip(imp.candidates, p[r:r + n])})
+            r += n
+        return out
+
+    def predict_pctr_batch(self, batch: ImpressionBatch) -> np.ndarray:
+        p = self.predict_pctr_matrix(batch_feature_matrix(batch, self.feature_names))
+        return p.reshape(batch.n_impressions, batch.n_candidates)
+
+
+@dataclass
+class StageTimer:
+    seconds: Dict[str, float] = field(default_factory=lambda: defaultdict(float))
+
+    def add(self, stage: str, t0: float) -> float:
+        t1 = time.perf_counter()
+        self.seconds[stage] += t1 - t0
+        return t1
+
+    def report(self, stages: Sequence[str], n_impressions: int) -> Dict[str, Any]:
+        total = sum(self.seconds[s] for s in stages)
+        return {
+            "n_impressions": n_impressions,
+            "seconds": total,
+            "impressions_per_sec": n_impressions / total if total > 0 else float("inf"),
+            "stages": {
+                s: {"seconds": self.seconds[s], "share": self.seconds[s] / total if total > 0 else 0.0}
+                for s in stages
+            },
+        }
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Process peak resident set size so far (None where `resource` is
+    unavailable). It never goes down, so run_isolated measures each size
+    in its own process.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def bench_array_stages(source, predictor, policy, click_model, n_slots: int, seed: int) -> Dict[str, Any]:
+    """Time every stage of the array engine separately, batch by batch."""
+    timer = StageTimer()
+    rng = np.random.default_rng(seed)
+    metrics = MetricsAggregator(ndcg_k=n_slots)
+    it = source.iter_batches()
+    n = 0
+    while True:
+        t = time.perf_counter()
+        batch = next(it, None)
+        if batch is None:
+            break
+        t = timer.add("generate", t)
+        pctr = predictor.predict_pctr_batch(batch)
+        t = timer.add("predict", t)
+        scores = policy.score_batch(batch.bids, pctr)
+        t = timer.add("score", t)
+        shown = top_k(scores, n_slots)
+        shown_pctr = np.take_along_axis(pctr, shown, axis=1)
+        shown_bids = np.take_along_axis(batch.bids, shown, axis=1)
+        t = timer.add("rank", t)
+        clicked = click_model.sample_clicks(shown_pctr, rng)
+        revenue = np.where(clicked, shown_bids, 0.0)
+        t = timer.add("click", t)
+        metrics.update_many(shown_pctr, shown_bids, clicked, revenue)
+        timer.add("metrics", t)
+        n += batch.n_impressions
+    return timer.report(ARRAY_STAGES, n)
+
+
+def bench_loop_stages(
+    source, predictor, policy, user_model, n_slots: int, seed: int, max_impressions: int
+) -> Dict[str, Any]:
+    """Time the per-impression stages of run_simulation on up to max_impressions impressions."""
+    timer = StageTimer()
+    rng = np.random.default_rng(seed)
+    metrics = MetricsAggregator(ndcg_k=n_slots)
+    n = 0
+    for batch in source.iter_batches():
+        t = time.perf_counter()
+        imps = list(batch.impressions())[: max_impressions - n]
+        t = timer.add("generate", t)
+        for imp in imps:
+            pctr = predictor.predict_pctr(imp)
+            t = timer.add("predict_pctr", t)
+            scores = policy.score(imp, pctr)
+            t = timer.add("policy_score", t)
+            shown = sorted(scores.keys(), key=lambda a: scores[a], reverse=True)[:n_slots]
+            t = timer.add("sort", t)
+            by_id = {c.ad_id: c for c in imp.candidates}
+            clicks = [user_model.sample_click(pctr[a], position=pos, rng=rng) for pos, a in enumerate(shown)]
+            t = timer.add("click", t)
+            outcomes = [
+                SlotOutcome(
+                    position=pos, ad_id=a, advertiser_id=by_id[a].advertiser_id, bid_cpc=by_id[a].bid_cpc,
+                    pctr=pctr[a], clicked=c, price_cpc=by_id[a].bid_cpc if c else 0.0,
+                    revenue=by_id[a].bid_cpc if c else 0.0,
+                )
+                for pos, (a, c) in enumerate(zip(shown, clicks))
+            ]
+            metrics.update(
+                SimStepResult(
+                    imp_id=imp.imp_id, shown_ad_ids=shown, slot_outcomes=outcomes,
+                    total_clicks=sum(clicks), total_revenue=sum(o.revenue for o in outcomes),
+                )
+            )
+            t = timer.add("metrics_update", t)
+        n += len(imps)
+        if n >= max_impressions:
+            break
+    return timer.report(LOOP_STAGES, n)
+
+
+def bench_end_to_end(fn, **kwargs) -> Dict[str, Any]:
+    t = time.perf_counter()
+    out = fn(**kwargs)
+    seconds = time.perf_counter() - t
+    return {
+        "n_impressions": out.n_steps,
+        "seconds": seconds,
+        "impressions_per_sec": out.n_steps / seconds if seconds > 0 else float("inf"),
+    }
+
+
+def import_time(module: str, repeat: int = 3) -> Dict[str, Any]:
+    """
+    Cumulative import time of `module` in a fresh interpreter, from
+    `python -X importtime` (best of `repeat`), and which HEAVY_MODULES it
+    loaded.
+    """
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    best, heavy = float("inf"), []
+    for _ in range(max(1, repeat)):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env, check=True
+        )
+        for line in proc.stderr.splitlines():
+            # "import time: <self us> | <cumulative us> | <indented name>"
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                best = min(best, int(parts[1]) / 1000.0)
+        heavy = [m for m in proc.stdout.strip().split(",") if m]
+    return {"ms": best, "heavy": heavy}
+
+
+def _pool_task(delay: float) -> int:
+    import ranking_sim.simulation.vectorized  # noqa: F401  (what a sweep worker needs)
+    time.sleep(delay)
+    return os.getpid()
+
+
+def pool_startup(start_method: str, n_workers: int) -> Dict[str, Any]:
+    """Seconds until a fresh pool of n_workers has run one short task in every worker."""
+    t = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=worker_context(start_method)) as pool:
+        pids = set(pool.map(_pool_task, [0.05] * n_workers))
+    return {"seconds": time.perf_counter() - t, "workers": len(pids)}
+
+
+def startup_check(budget_ms: float, n_workers: int) -> Dict[str, Any]:
+    imports = {m: import_time(m) for m in STARTUP_MODULES}
+    pools = {}
+    for method in ("spawn", "forkserver"):
+        try:
+            pools[method] = pool_startup(method, n_workers)
+        except ValueError:  # start method unavailable on this platform
+            continue
+    ok = all(r["ms"] <= budget_ms and not r["heavy"] for r in imports.values())
+    return {"budget_ms": budget_ms, "ok": ok, "imports": imports, "pool_workers": n_workers, "pools": pools}
+
+
+def print_startup(r: Dict[str, Any]) -> None:
+    print(f"== startup (budget {r['budget_ms']:.0f} ms per import) ==")
+    for m, d in r["imports"].items():
+        notes = [f"loads {','.join(d['heavy'])}"] if d["heavy"] else []
+        if d["ms"] > r["budget_ms"]:
+            notes.append("over budget")
+        print(f"{m:>36}: {d['ms']:8.1f} ms" + (f"  <-- {'; '.join(notes)}" if notes else ""))
+    for method, d in r["pools"].items():
+        print(f"{method + ' pool':>36}: {d['seconds'] * 1000:8.1f} ms for {d['workers']} workers")
+
+
+def parse_size(spec: str) -> Tuple[int, int, int]:
+    """'50000x30x4' -> (impressions, candidates, slots)."""
+    parts = [int(p) for p in spec.lower().split("x")]
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError(f"size must be IMPRESSIONSxCANDIDATESxSLOTS, got {spec!r}")
+    return parts[0], parts[1], parts[2]
+
+
+def run_size(
+    bank: np.ndarray,
+    names: List[str],
+    predictor,
+    size: Tuple[int, int, int],
+    seed: int,
+    loop_max: int,
+    chunk_size: int,
+) -> Dict[str, Any]:
+    n_impressions, n_candidates, n_slots = size
+    source = FeatureBankSource(bank, names, n_impressions, n_candidates, seed, chunk_size=chunk_size, rng_mode="bulk")
+    policy = BidTimesPCTR()
+    position_bias = [1.0 / (1.0 + 0.5 * k) for k in range(n_slots)]
+    user_model = PositionBiasClickModel(position_bias=position_bias)
+    loop_n = min(n_impressions, loop_max)
+    loop_source = FeatureBankSource(bank, names, loop_n, n_candidates, seed, chunk_size=chunk_size, rng_mode="bulk")
+
+    result: Dict[str, Any] = {
+        "size": {"impressions": n_impressions, "candidates": n_candidates, "slots": n_slots},
+        "array_stages": bench_array_stages(source, predictor, policy, user_model, n_slots, seed),
+        "loop_stages": bench_loop_stages(loop_source, predictor, policy, user_model, n_slots, seed, loop_n),
+        "run_vectorized": bench_end_to_end(
+            run_vectorized, impressions=source, predictor=predictor, policy=policy,
+            user_model=user_model, n_slots=n_slots, seed=seed,
+        ),
+        "run_simulation": bench_end_to_end(
+            run_simulation, impressions=loop_source, predictor=predictor, policy=policy,
+            user_model=user_model, n_slots=n_slots, seed=seed,
+        ),
+    }
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def setup(
+    bank_rows: int, n_features: int, model: Optional[str], seed: int
+) -> Tuple[np.ndarray, List[str], Any]:
+    """Synthetic bank and predictor: a LightGBM file on the NumPy backend, or LinearCTRPredictor."""
+    if model is not None:
+        from ranking_sim.models.lgb_numpy import NumpyLightGBMPredictor
+        predictor = NumpyLightGBMPredictor(model)
+        names = list(predictor.feature_names)
+        bank, _ = synthetic_bank(bank_rows, len(names), seed=seed)
+    else:
+        bank, names = synthetic_bank(bank_rows, n_features, seed=seed)
+        predictor = LinearCTRPredictor(names, seed=seed)
+    return bank, names, predictor
+
+
+def _run_size_fresh(config: Dict[str, Any], size: Tuple[int, int, int]) -> Dict[str, Any]:
+    bank, names, predictor = setup(config["bank_rows"], config["features"], config["model"], config["seed"])
+    setup_rss = peak_rss_mb()
+    result = run_size(bank, names, predictor, size, config["seed"], config["loop_max"], config["chunk_size"])
+    result["setup_rss_mb"] = setup_rss
+    return result
+
+
+def run_isolated(config: Dict[str, Any], size: Tuple[int, int, int]) -> Dict[str, Any]:
+    """
+    run_size in a freshly spawned process that builds its own bank and
+    predictor, so peak_rss_mb belongs to this size alone (setup_rss_mb is
+    the part taken by the bank and model before the size ran).
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=worker_context("spawn")) as pool:
+        return pool.submit(_run_size_fresh, config, size).result()
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        from importlib.metadata import version
+        pkg_version = version("ranking-sim")
+    except Exception:
+        pkg_version = None
+    return {
+        "ranking_sim": pkg_version,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def print_result(r: Dict[str, Any]) -> None:
+    s = r["size"]
+    print(f"\n== {s['impressions']} impressions x {s['candidates']} candidates x {s['slots']} slots ==")
+    for name in ("run_vectorized", "run_simulation"):
+        e = r[name]
+        print(f"{name:>15}: {e['impressions_per_sec']:>12,.0f} imps/s  ({e['n_impressions']} imps, {e['seconds']:.3f} s)")
+    for name in ("array_stages", "loop_stages"):
+        st = r[name]
+        shares = "  ".join(f"{k}={v['share']:.0%}" for k, v in st["stages"].items())
+        print(f"{name:>15}: {st['impressions_per_sec']:>12,.0f} imps/s  {shares}")
+    if r["peak_rss_mb"] is not None:
+        print(f"{'peak RSS':>15}: {r['peak_rss_mb']:.1f} MB ({r['setup_rss_mb']:.1f} MB after setup)")
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    """Print throughput and peak RSS ratios against an earlier JSON report, matched by size."""
+    with open(baseline_path) as f:
+        old = {json.dumps(r["size"], sort_keys=True): r for r in json.load(f)["results"]}
+    print(f"\nvs {baseline_path} (new / old imps/s, new / old peak RSS):")
+    for r in results:
+        o = old.get(json.dumps(r["size"], sort_keys=True))
+        if o is None:
+            continue
+        ratios = "  ".join(
+            f"{k}={r[k]['impressions_per_sec'] / o[k]['impressions_per_sec']:.2f}x"
+            for k in ("run_vectorized", "run_simulation", "array_stages", "loop_stages")
+            if k in o and o[k]["impressions_per_sec"] > 0
+        )
+        if r.get("peak_rss_mb") and o.get("peak_rss_mb"):
+            ratios += f"  rss={r['peak_rss_mb'] / o['peak_rss_mb']:.2f}x"
+        s = r["size"]
+        print(f"  {s['impressions']}x{s['candidates']}x{s['slots']}: {ratios}")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Throughput benchmark of the simulation pipeline.")
+    ap.add_argument("--sizes", nargs="+", type=parse_size, default=[(10_000, 30, 4), (50_000, 30, 4), (20_000, 100, 8)],
+                    metavar="NxCxK", help="impressions x candidates x slots")
+    ap.add_argument("--bank-rows", type=int, default=100_000)
+    ap.add_argument("--features", type=int, default=94)
+    ap.add_argument("--model", default=None,
+                    help="LightGBM model file scored with the NumPy backend (default: synthetic linear model)")
+    ap.add_argument("--loop-max", type=int, default=20_000,
+                    help="cap on impressions for the per-impression runs")
+    ap.add_argument("--chunk-size", type=int, default=4096)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", default="bench.json", help="where to write the report")
+    ap.add_argument("--compare", default=None, help="earlier JSON report to compare against")
+    ap.add_argument("--startup-budget-ms", type=float, default=400.0,
+                    help="fail if a STARTUP_MODULES import takes longer (or loads pandas/lightgbm/pyarrow)")
+    ap.add_argument("--startup-only", action="store_true", help="only run the startup check")
+    ap.add_argument("--pool-workers", type=int, default=4, help="workers in the pool startup comparison")
+    args = ap.parse_args(argv)
+
+    startup = startup_check(args.startup_budget_ms, args.pool_workers)
+    print_startup(startup)
+    if args.startup_only:
+        if not startup["ok"]:
+            sys.exit(1)
+        return
+
+    config = {
+        "bank_rows": args.bank_rows,
+        "features": args.features,
+        "model": args.model,
+        "loop_max": args.loop_max,
+        "chunk_size": args.chunk_size,
+        "seed": args.seed,
+    }
+    results = []
+    for size in args.sizes:
+        r = run_isolated(config, size)
+        print_result(r)
+        results.append(r)
+
+    report = {
+        "environment": environment(),
+        "config": dict(config, model=args.model or "linear"),
+        "startup": startup,
+        "results": results,
+    }
+    with open(args.json, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.json}")
+    if args.compare:
+        compare(results, args.compare)
+    if not startup["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,70 @@
 from __future__ import annotations
 
 from dataclasses import asdict
-from typing import Iterable, List, Dict, Any
+from typing import TYPE_CHECKING, Iterable, List, Dict, Any, Optional, Sequence
 
 import numpy as np
-import pandas as pd
 
 from ranking_sim.data.schema import Impression, AdCandidate
+from ranking_sim.data.bank_store import StreamingBankSource, build_column_cache
+from ranking_sim.data.feature_bank import FeatureBankSource
 from ranking_sim.models.predictor import DummyPredictor, PandasLightGBMPredictor
+from ranking_sim.models.pctr_cache import (
+    CachedPCTRPredictor,
+    PCTRCache,
+    compute_source_pctr,
+    source_cache_key,
+)
 from ranking_sim.ranking.policy import BidTimesPCTR
 from ranking_sim.auction.mechanisms import SecondPriceSingleSlot
 from ranking_sim.simulation.user import PositionBiasClickModel
 from ranking_sim.simulation.runner import run_simulation
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 def make_impressions_from_feature_bank(
-        feature_bank: pd.DataFrame, n_impressions: int, n_candidates: int, seed: int
-) -> Iterable[Impression]:
-    rng = np.random.default_rng(seed)
-    N = len(feature_bank)
+        feature_bank: "pd.DataFrame",
+        n_impressions: int,
+        n_candidates: int,
+        seed: int,
+        feature_names: Optional[Sequence[str]] = None,
+        pandas_categorical: Optional[List[list]] = None,
+) -> FeatureBankSource:
+    # Columnar source; iterating it yields the same Impressions as the old
+    # per-row generator, and run_simulation scores it batch by batch. Pass
+    # the model's feature_names / pandas_categorical so only its columns
+    # are kept and categorical codes match training.
+    return FeatureBankSource.from_frame(
+        feature_bank,
+        n_impressions=n_impressions,
+        n_candidates=n_candidates,
+        seed=seed,
+        feature_names=feature_names,
+        pandas_categorical=pandas_categorical,
+    )
 
-    for imp_id in range(n_impressions):
-        # sample candidate rows
-        idx = rng.integers(0, N, size=n_candidates)
-        cand_rows = feature_bank.iloc[idx]
 
-        candidates = []
-        for j, (_, row) in enumerate(cand_rows.iterrows()):
-            ad_id = imp_id * 10_000 + j
-            advertiser_id = int(rng.integers(0, 200))
-            bid_cpc = float(np.clip(rng.lognormal(mean=-0.2, sigma=0.7), 0.05, 10.0))
-
-            candidates.append(
-                AdCandidate(
-                    ad_id=ad_id,
-                    advertiser_id=advertiser_id,
-                    bid_cpc=bid_cpc,
-                    features=row.to_dict(),  # <- keys match your 94 columns
-                )
-            )
-
-        yield Impression(imp_id=imp_id, context={}, candidates=candidates)
+def make_impressions_from_column_cache(
+        parquet_path: str,
+        cache_dir: str,
+        n_impressions: int,
+        n_candidates: int,
+        seed: int,
+        feature_names: Optional[Sequence[str]] = None,
+        pandas_categorical: Optional[List[list]] = None,
+) -> StreamingBankSource:
+    # Out-of-core source for banks larger than RAM: the Parquet bank is
+    # converted once (row group by row group) into a memory-mapped float32
+    # column cache and only sampled rows are read. Uses bulk sampling, so
+    # impressions differ from make_impressions_from_feature_bank's.
+    return StreamingBankSource(
+        build_column_cache(parquet_path, cache_dir, feature_names, pandas_categorical),
+        n_impressions=n_impressions,
+        n_candidates=n_candidates,
+        seed=seed,
+    )
 
 
 def make_synthetic_impressions(
@@ -79,14 +103,27 @@ def make_synthetic_impressions(
 
 
 def main() -> None:
+    import pandas as pd
+
     # Components
-    predictor = PandasLightGBMPredictor(model_path="artifacts/lgb_ctr_model_8M.txt")
+    model_path = "artifacts/lgb_ctr_model_8M.txt"
     policy = BidTimesPCTR()
     # auction = SecondPriceSingleSlot()
     # user_model = PositionBiasClickModel(position_bias=[1.0])  # single-slot
     # impressions = make_synthetic_impressions(n_impressions=50_000, n_candidates=30, seed=7)
+    model = PandasLightGBMPredictor(model_path=model_path)
     feature_bank = pd.read_parquet("artifacts/feature_bank.parquet")
-    impressions = make_impressions_from_feature_bank(feature_bank, n_impressions=50_000, n_candidates=30, seed=7)
+    impressions = make_impressions_from_feature_bank(
+        feature_bank, n_impressions=50_000, n_candidates=30, seed=7,
+        feature_names=model.feature_names, pandas_categorical=model.pandas_categorical,
+    )
+    # impressions = make_impressions_from_column_cache("artifacts/feature_bank.parquet", "artifacts/feature_bank_cache", n_impressions=50_000, n_candidates=30, seed=7, feature_names=model.feature_names, pandas_categorical=model.pandas_categorical)
+    cache = PCTRCache(cache_dir="artifacts/pctr_cache")
+    pctr = cache.get_or_compute(
+        source_cache_key(model_path, impressions),
+        lambda: compute_source_pctr(model, impressions),
+    )
+    predictor = CachedPCTRPredictor(pctr)
     user_model = PositionBiasClickModel(position_bias=[1.0, 0.7, 0.5, 0.3])
     n_slots = 4
 
@@ -100,10 +137,13 @@ def main() -> None:
         keep_steps=False,
     )
 
-    print("Done.")
+    stats = cache.stats()
+    print(f"Done. pCTR cache: hits={stats['hits']} misses={stats['misses']}")
     m = out.metrics
     print("\nOverall metrics:")
     print(f"clicks_per_impression: {m['clicks_per_impression']}, ctr_per_slot: {m['ctr_per_slot']}, revenue: {m['revenue']},  ecpm: {m['ecpm']}, ndcg_k: {m['ndcg_k']:.3f} mean_ndcg: {m['mean_ndcg']:.4f}")
+    for name, ci in m["ci"].items():
+        print(f"{name}: {ci['mean']:.4f} ({m['ci_level']:.0%} CI {ci['lo']:.4f} .. {ci['hi']:.4f})")
     print("\nPosition-level metrics:")
     for pos, d in m["pos"].items():
         print(
@@ -1,64 +1,98 @@
 from __future__ import annotations
 
-import csv
+import sys
+
 import numpy as np
-import pandas as pd
 
+from ranking_sim.data.batch import ArraySource
 from ranking_sim.models.predictor import DummyPredictor, PandasLightGBMPredictor
+from ranking_sim.models.pctr_cache import CachedPCTRPredictor, PCTRCache, compute_source_pctr, source_cache_key
 from ranking_sim.ranking.policy import BidTimesPCTRPow
-from ranking_sim.auction.mechanisms import SecondPriceSingleSlot
+from ranking_sim.auction.mechanisms import FirstPriceCPC, SecondPriceSingleSlot
+from ranking_sim.simulation.search import adaptive_search
+from ranking_sim.simulation.sweep import build_grid, export_shared, run_sweep
 from ranking_sim.simulation.user import PositionBiasClickModel
-from ranking_sim.simulation.runner import run_simulation
-from scripts.run_sim import make_impressions_from_feature_bank
+from scripts.run_sim import make_impressions_from_column_cache, make_impressions_from_feature_bank
+
+
+def run_adaptive(source: ArraySource, pctr: np.ndarray, min_ndcg: float = 0.95) -> None:
+    # Coarse-to-fine search for the revenue-maximizing alpha with mean
+    # NDCG >= min_ndcg, on the same cached pCTRs; values are dropped as soon
+    # as their CIs separate, so far fewer impressions are simulated. The
+    # 2k-impression chunks are the steps the sample size grows by.
+    result = adaptive_search(
+        source,
+        CachedPCTRPredictor(pctr),
+        lambda a: BidTimesPCTRPow(alpha=a),
+        bounds=(0.2, 2.0),
+        user_model=PositionBiasClickModel(position_bias=[1.0, 0.7, 0.5, 0.3]),
+        n_slots=4,
+        constraint=("ndcg", min_ndcg),
+        seed=42,
+    )
+    for i, r in enumerate(result.rounds):
+        grid = " ".join(f"{a:.3f}" for a in r["grid"])
+        print(f"round {i}: alphas=[{grid}] leader={r['leader']:.3f}")
+    m = result.metrics
+    print(
+        f"\nbest alpha={result.best:.4f} feasible={result.feasible} "
+        f"rev/imp={m['revenue_per_impression']['mean']:.4f} ndcg={m['ndcg']['mean']:.4f} "
+        f"(simulated {result.simulated_impressions:,} impressions)"
+    )
 
 
 def main() -> None:
+    import pandas as pd
+
     alphas = np.linspace(0.2, 2.0, 10)
 
-    predictor = PandasLightGBMPredictor(model_path="artifacts/lgb_ctr_model_8M.txt")
+    model_path = "artifacts/lgb_ctr_model_8M.txt"
     # auction = SecondPriceSingleSlot()
     # user_model = PositionBiasClickModel(position_bias=[1.0])
 
-    rows = []
-
-    for alpha in alphas:
-        policy = BidTimesPCTRPow(alpha=float(alpha))
-
+    # Impressions are identical for every alpha, so score them once and
+    # replay the cached pCTRs (persisted for later reruns).
+    # --column-cache samples from a memory-mapped column cache of the bank
+    # instead of loading it into pandas (bulk sampling: other impressions).
+    model = PandasLightGBMPredictor(model_path=model_path)
+    columns = dict(feature_names=model.feature_names, pandas_categorical=model.pandas_categorical)
+    if "--column-cache" in sys.argv[1:]:
+        impressions = make_impressions_from_column_cache(
+            "artifacts/feature_bank.parquet", "artifacts/feature_bank_cache",
+            n_impressions=50_000, n_candidates=30, seed=7, **columns,
+        )
+    else:
         feature_bank = pd.read_parquet("artifacts/feature_bank.parquet")
-        impressions = make_impressions_from_feature_bank(feature_bank, n_impressions=50_000, n_candidates=30, seed=7)
-
-        user_model = PositionBiasClickModel(position_bias=[1.0, 0.7, 0.5, 0.3])
-        n_slots = 4
-
-        out = run_simulation(
-            impressions=impressions,
-            predictor=predictor,
-            policy=policy,
-            user_model=user_model,
-            n_slots=n_slots,
-            seed=42,
-            keep_steps=False,
+        impressions = make_impressions_from_feature_bank(
+            feature_bank, n_impressions=50_000, n_candidates=30, seed=7, **columns,
         )
-        
-        metrics = out.metrics
-        rows.append({
-            "alpha": float(alpha),
-            "clicks_per_impression": metrics["clicks_per_impression"],
-            "ctr_per_slot": metrics["ctr_per_slot"],
-            "revenue": metrics["revenue"],
-            "ecpm": metrics["ecpm"],
-            "mean_ndcg": metrics["mean_ndcg"],
-        })
-
-        print(f"alpha={alpha:.2f}  clicks_per_impression={metrics['clicks_per_impression']:.4f}  ctr_per_slot={metrics['ctr_per_slot']:.4f}  Rev={metrics['revenue']:.2f} ecpm={metrics['ecpm']:.4f} mean_ndcg={metrics['mean_ndcg']:3f}")
-
-    # Write CSV
-    with open("alpha_sweep_lightGBM.csv", "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=["alpha", "clicks_per_impression", "ctr_per_slot", "revenue", "ecpm", "mean_ndcg"])
-        writer.writeheader()
-        writer.writerows(rows)
-
-    print("\nSaved to alpha_sweep.csv")
+    cache = PCTRCache(cache_dir="artifacts/pctr_cache")
+    pctr = cache.get_or_compute(
+        source_cache_key(model_path, impressions),
+        lambda: compute_source_pctr(model, impressions),
+    )
+
+    if "--adaptive" in sys.argv[1:]:
+        run_adaptive(ArraySource.from_source(impressions, chunk_size=2_000), pctr)
+        return
+
+    # Workers memory-map bids / pCTRs; the feature bank stays in this process.
+    data_dir = export_shared("artifacts/sweep_data", ArraySource.from_source(impressions), pctr)
+    cells = build_grid(
+        alphas,
+        n_slots=(4,),
+        position_biases=((1.0, 0.7, 0.5, 0.3),),
+        auctions=(FirstPriceCPC(),),
+        seed=42,
+    )
+    rows = run_sweep(cells, data_dir, out_csv="alpha_sweep_lightGBM.csv")
+
+    for r in rows:
+        print(f"alpha={r['alpha']:.2f}  clicks_per_impression={r['clicks_per_impression']:.4f}  ctr_per_slot={r['ctr_per_slot']:.4f}  Rev={r['revenue']:.2f} ecpm={r['ecpm']:.4f} mean_ndcg={r['mean_ndcg']:3f}")
+
+    stats = cache.stats()
+    print(f"\npCTR cache: hits={stats['hits']} misses={stats['misses']}")
+    print("Saved to alpha_sweep_lightGBM.csv")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def arrays():
+    """(bids, advertiser_ids, pctr) for 600 impressions of 8 candidates."""
+    rng = np.random.default_rng(0)
+    N, C = 600, 8
+    bids = rng.lognormal(-0.2, 0.7, (N, C))
+    advertiser_ids = rng.integers(0, 20, (N, C))
+    pctr = rng.beta(1.0, 30.0, (N, C))
+    return bids, advertiser_ids, pctr
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from ranking_sim.auction.mechanisms import GSP
+from ranking_sim.data.batch import ArraySource
+from ranking_sim.models.pctr_cache import CachedPCTRPredictor
+from ranking_sim.ranking.policy import BidTimesPCTR
+from ranking_sim.simulation.budget import BudgetPacer
+from ranking_sim.simulation.user import PositionBiasClickModel
+from ranking_sim.simulation.vectorized import run_vectorized
+
+
+def _run(arrays, pacer, chunk_size, n_slots=1, auction=None):
+    bids, advertiser_ids, pctr = arrays
+    # Lift pCTRs so budgets actually bind within a day.
+    return run_vectorized(
+        ArraySource(bids, advertiser_ids, chunk_size=chunk_size),
+        CachedPCTRPredictor(np.minimum(pctr * 8.0, 0.9)),
+        BidTimesPCTR(),
+        PositionBiasClickModel([1.0, 0.7, 0.5]),
+        n_slots=n_slots,
+        seed=3,
+        auction=auction,
+        budgets=pacer,
+    )
+
+
+@pytest.mark.parametrize("pacing", ["none", "throttle", "shade"])
+@pytest.mark.parametrize("auction", [None, GSP()])
+def test_never_overspends_with_per_impression_chunks(arrays, pacing, auction):
+    # One impression per chunk and one slot: every shown bid is covered by
+    # the remaining day budget, and no price exceeds the bid.
+    pacer = BudgetPacer(np.full(20, 3.0), impressions_per_day=150, pacing=pacing)
+    out = _run(arrays, pacer, chunk_size=1, auction=auction)
+    summary = out.budget
+    assert summary["overspend"] == 0.0
+    assert summary["days"] == pytest.approx(4.0)
+    assert (pacer.spend <= 3.0 * 4 + 1e-9).all()
+    assert summary["budget_utilization"] > 0.5
+
+
+def test_gate_blocks_bids_above_the_remaining_budget(arrays):
+    pacer = BudgetPacer(np.full(20, 1.0), impressions_per_day=10_000, pacing="none")
+    _run(arrays, pacer, chunk_size=1)
+    # Budgets bind: most advertisers get close to theirs, none past it.
+    assert (pacer.day_spend > 0.8).sum() > 10
+    assert (pacer.day_spend <= 1.0 + 1e-12).all()
+
+    bids, advertiser_ids, _ = arrays
+    _, eligible = pacer.gate(advertiser_ids[:50], bids[:50])
+    remaining = (pacer.daily_budget - pacer.day_spend)[advertiser_ids[:50]]
+    np.testing.assert_array_equal(eligible, bids[:50] <= remaining)
+
+
+def test_rejects_out_of_range_advertisers():
+    pacer = BudgetPacer(np.ones(3), impressions_per_day=10)
+    with pytest.raises(ValueError, match="advertiser ids"):
+        pacer.gate(np.array([[0, 3]]), np.ones((1, 2)))
@@ -0,0 +1,109 @@
+import sys
+
+import numpy as np
+import pytest
+
+from ranking_sim.data.candidate_store import CandidateStore
+from ranking_sim.data.feature_bank import FeatureBankSource
+
+N_FEATURES = 94
+CATEGORICAL = ["f93"]
+
+
+@pytest.fixture(scope="module")
+def source():
+    rng = np.random.default_rng(6)
+    n = 3000
+    X = np.column_stack([
+        rng.normal(size=(n, 80)),
+        rng.exponential(3.0, (n, 6)),
+        rng.integers(0, 2, (n, 4)),        # flags
+        rng.integers(0, 5000, (n, 3)),     # wide counts
+        rng.integers(0, 40, n),            # category codes
+    ]).astype(np.float32)
+    X[::11, 0] = np.nan
+    X[::13, 93] = np.nan
+    names = [f"f{j}" for j in range(N_FEATURES)]
+    return FeatureBankSource(X, names, n_impressions=400, n_candidates=6, seed=2, chunk_size=128)
+
+
+def _features(store_or_source):
+    return np.concatenate([b.features for b in store_or_source.iter_batches()])
+
+
+def test_auto_precision_is_per_column(source):
+    store = CandidateStore.from_source(source, precision="auto", categorical=CATEGORICAL)
+    dtypes = store.column_dtypes
+    assert set(dtypes[:86]) == {"int16"}
+    assert dtypes[86:90] == ["int8"] * 4
+    assert dtypes[90:93] == ["int16"] * 3
+    assert dtypes[93] == "int8" and store.categories["f93"] == list(range(40))
+    assert store.precision == "mixed"
+
+    ref, got = _features(source), _features(store)
+    np.testing.assert_array_equal(np.isnan(got), np.isnan(ref))
+    # Whole-valued and categorical columns round-trip exactly; the rest
+    # are within half a quantization step.
+    np.testing.assert_array_equal(got[:, 86:], ref[:, 86:])
+    err = np.nanmax(np.abs(got - ref), axis=0)
+    assert (err[:86] <= 0.5 * store.scale[:86] * (1 + 1e-3) + 1e-6).all()
+
+
+def test_per_column_spec_and_max_error(source):
+    store = CandidateStore.from_source(source, precision={"f0": "int8", "f90": "auto"})
+    assert store.column_dtypes[0] == "int8" and store.column_dtypes[90] == "int16"
+    assert store.column_dtypes.count("float32") == N_FEATURES - 2
+
+    loose = CandidateStore.from_source(source, precision="auto", max_error=0.05)
+    assert set(loose.column_dtypes[:80]) == {"int8"}
+    err = np.nanmax(np.abs(_features(loose) - _features(source)))
+    assert err <= 0.05
+
+
+def test_round_trip_and_zero_copy(tmp_path, source):
+    for precision in ("float32", "auto"):
+        store = CandidateStore.from_source(source, precision=precision, categorical=CATEGORICAL)
+        store.save(str(tmp_path / precision))
+        loaded = CandidateStore.load(str(tmp_path / precision))
+        assert loaded.column_dtypes == store.column_dtypes
+        for a, b in zip(store.iter_batches(), loaded.iter_batches()):
+            np.testing.assert_array_equal(a.features, b.features)
+            np.testing.assert_array_equal(a.bids, b.bids)
+            np.testing.assert_array_equal(a.ad_ids, b.ad_ids)
+        imp = loaded.impression(5)
+        assert [c.ad_id for c in imp.candidates] == loaded.ad_ids[5].tolist()
+
+    store = CandidateStore.from_source(source)
+    batch = next(store.iter_batches())
+    assert np.shares_memory(batch.features, store.codes["float32"])
+
+
+def test_memory_drops_tenfold(source):
+    imp = next(iter(source))
+    features = dict(imp.candidates[0].features)
+    # Keys are shared strings; each candidate owns its dict and its floats.
+    dict_bytes = sys.getsizeof(features) + sum(sys.getsizeof(v) for v in features.values())
+    for precision in ("float32", "int16", "int8", "auto"):
+        store = CandidateStore.from_source(source, precision=precision, categorical=CATEGORICAL)
+        assert dict_bytes / store.bytes_per_candidate >= 10.0, precision
+
+
+def test_pctr_error_is_bounded(tmp_path, source):
+    lgb = pytest.importorskip("lightgbm")
+    from ranking_sim.models.lgb_numpy import NumpyLightGBMPredictor
+
+    X = _features(source).astype(np.float64)
+    rng = np.random.default_rng(7)
+    logit = 0.7 * np.nan_to_num(X[:, 0]) - 0.4 * X[:, 80] + 0.8 * X[:, 86] - 3.0
+    y = (rng.random(len(X)) < 1.0 / (1.0 + np.exp(-logit))).astype(np.float64)
+    params = {"objective": "binary", "num_leaves": 15, "verbose": -1}
+    booster = lgb.train(params, lgb.Dataset(X, y, feature_name=source.feature_names), num_boost_round=30)
+    path = str(tmp_path / "model.txt")
+    booster.save_model(path)
+    predictor = NumpyLightGBMPredictor(path)
+
+    expected = np.concatenate([predictor.predict_pctr_batch(b) for b in source.iter_batches()])
+    for precision, bound in (("auto", 1e-3), ("int8", 2e-2)):
+        store = CandidateStore.from_source(source, precision=precision, categorical=CATEGORICAL)
+        got = np.concatenate([predictor.predict_pctr_batch(b) for b in store.iter_batches()])
+        assert np.abs(got - expected).mean() <= bound, precision
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from ranking_sim.data.feature_bank import FeatureBankSource
+
+
+@pytest.fixture(scope="module")
+def bank():
+    rng = np.random.default_rng(3)
+    names = [f"f{j}" for j in range(5)]
+    return rng.normal(size=(50, len(names))).astype(np.float32), names
+
+
+def _baseline_draws(n_rows, n_impressions, n_candidates, seed):
+    # The per-row generator the columnar source replaced, minus the DataFrame.
+    rng = np.random.default_rng(seed)
+    for _ in range(n_impressions):
+        idx = rng.integers(0, n_rows, size=n_candidates)
+        advertisers, bids = [], []
+        for _ in range(n_candidates):
+            advertisers.append(int(rng.integers(0, 200)))
+            bids.append(float(np.clip(rng.lognormal(mean=-0.2, sigma=0.7), 0.05, 10.0)))
+        yield idx, advertisers, bids
+
+
+def test_legacy_mode_reproduces_baseline_generator(bank):
+    features, names = bank
+    source = FeatureBankSource(features, names, n_impressions=23, n_candidates=4, seed=11, chunk_size=5)
+    impressions = list(source)
+    assert len(impressions) == 23
+
+    for imp_id, (imp, (idx, advertisers, bids)) in enumerate(
+        zip(impressions, _baseline_draws(len(features), 23, 4, seed=11))
+    ):
+        assert imp.imp_id == imp_id
+        assert [c.ad_id for c in imp.candidates] == [imp_id * 10_000 + j for j in range(4)]
+        assert [c.advertiser_id for c in imp.candidates] == advertisers
+        assert [c.bid_cpc for c in imp.candidates] == bids
+        for c, row in zip(imp.candidates, idx):
+            assert dict(c.features) == {name: float(v) for name, v in zip(names, features[row])}
+
+
+def test_bulk_mode_matches_legacy_layout(bank):
+    features, names = bank
+    kwargs = dict(n_impressions=23, n_candidates=4, seed=11, chunk_size=5)
+    legacy = list(FeatureBankSource(features, names, **kwargs).iter_batches())
+    bulk = list(FeatureBankSource(features, names, rng_mode="bulk", **kwargs).iter_batches())
+    again = list(FeatureBankSource(features, names, rng_mode="bulk", **kwargs).iter_batches())
+
+    assert [b.n_impressions for b in bulk] == [b.n_impressions for b in legacy] == [5, 5, 5, 5, 3]
+    for a, b, c in zip(legacy, bulk, again):
+        np.testing.assert_array_equal(a.imp_ids, b.imp_ids)
+        np.testing.assert_array_equal(a.ad_ids, b.ad_ids)
+        np.testing.assert_array_equal(b.bids, c.bids)
+        np.testing.assert_array_equal(b.features, c.features)
+        assert b.features.shape == a.features.shape
+        assert ((b.bids >= 0.05) & (b.bids <= 10.0)).all()
+        assert ((b.advertiser_ids >= 0) & (b.advertiser_ids < 200)).all()
+        # Every candidate's features are a row of the bank.
+        assert (b.features[:, None, :] == features[None, :, :]).all(axis=2).any(axis=1).all()
+    assert not np.array_equal(legacy[0].bids, bulk[0].bids)
+
+
+def test_rejects_unknown_rng_mode(bank):
+    features, names = bank
+    with pytest.raises(ValueError, match="rng_mode"):
+        FeatureBankSource(features, names, n_impressions=1, n_candidates=1, seed=0, rng_mode="fast")
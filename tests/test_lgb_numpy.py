@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+
+def test_numpy_trees_match_booster(tmp_path):
+    lgb = pytest.importorskip("lightgbm")
+    from ranking_sim.models.lgb_numpy import NumpyLightGBMPredictor
+
+    rng = np.random.default_rng(1)
+    n = 4000
+    X = np.column_stack([
+        rng.normal(size=n),
+        np.where(rng.random(n) < 0.2, np.nan, rng.normal(size=n)),   # missing values
+        rng.integers(0, 5, n).astype(np.float64),
+        rng.integers(0, 12, n).astype(np.float64),                   # categorical codes
+    ])
+    logit = 0.8 * X[:, 0] - 0.5 * np.nan_to_num(X[:, 1]) + 0.3 * X[:, 2] + np.isin(X[:, 3], (2, 5, 7)) - 2.0
+    y = (rng.random(n) < 1.0 / (1.0 + np.exp(-logit))).astype(np.float64)
+    params = {"objective": "binary", "num_leaves": 15, "min_data_in_leaf": 20, "verbose": -1}
+    train = lgb.Dataset(X, y, feature_name=["f0", "f1", "f2", "f3"], categorical_feature=[3])
+    booster = lgb.train(params, train, num_boost_round=30)
+    model_path = str(tmp_path / "model.txt")
+    booster.save_model(model_path)
+
+    X_test = X[:1000].copy()
+    X_test[::7, 0] = np.nan
+    X_test[::11, 3] = 20.0   # category unseen in training
+    for num_iteration in (None, 10):
+        expected = np.clip(booster.predict(X_test, num_iteration=num_iteration), 1e-6, 1.0 - 1e-6)
+        got = NumpyLightGBMPredictor(model_path, num_iteration=num_iteration).predict_pctr_matrix(X_test)
+        np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,97 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from ranking_sim.auction.mechanisms import GSP, VCG, ReservePrice
+from ranking_sim.simulation.vectorized import simulate_arrays
+
+
+def _prices(auction, bids, pctr, n_slots, position_bias=(1.0, 0.6, 0.3)):
+    """Per-click price of every filled slot; zero uniforms make every filled slot click."""
+    bids = np.atleast_2d(np.asarray(bids, dtype=np.float64))
+    pctr = np.atleast_2d(np.asarray(pctr, dtype=np.float64))
+    B, C = bids.shape
+    slots = simulate_arrays(
+        bids, pctr, bids * pctr, list(position_bias), n_slots, np.random.default_rng(0), auction,
+        uniforms=np.zeros((B, C, n_slots)),
+    )
+    assert (slots.clicked == slots.filled).all()
+    return slots
+
+
+def test_gsp_lone_candidate_pays_zero_or_reserve():
+    assert _prices(GSP(), [2.0], [0.1], 1).price_cpc.tolist() == [[0.0]]
+    assert _prices(GSP(last_pays_bid=True), [2.0], [0.1], 1).price_cpc.tolist() == [[2.0]]
+    for inner in (GSP(), VCG()):
+        slots = _prices(ReservePrice(inner=inner, reserve_cpc=0.5), [2.0], [0.1], 1)
+        assert slots.price_cpc.tolist() == [[0.5]]
+
+
+def test_gsp_prices_against_the_next_score():
+    bids, pctr = [1.0, 3.0, 2.0], [0.2, 0.1, 0.05]   # scores 0.2, 0.3, 0.1
+    slots = _prices(GSP(), bids, pctr, 2)
+    assert slots.shown.tolist() == [[1, 0]]
+    np.testing.assert_allclose(slots.price_cpc, [[0.2 / 0.1, 0.1 / 0.2]])
+
+    # C == n_slots: the last shown ad has no next score.
+    slots = _prices(GSP(), bids, pctr, 3)
+    np.testing.assert_allclose(slots.price_cpc, [[2.0, 0.5, 0.0]])
+    slots = _prices(ReservePrice(inner=GSP(), reserve_cpc=0.25), bids, pctr, 3)
+    np.testing.assert_allclose(slots.price_cpc, [[2.0, 0.5, 0.25]])
+
+
+def test_zero_score_competitor_is_a_real_competitor():
+    # The runner-up bids 0, so its score is exactly 0: the winner pays 0,
+    # not its bid, even with last_pays_bid.
+    slots = _prices(GSP(last_pays_bid=True), [1.0, 0.0], [0.3, 0.2], 1)
+    assert slots.price_cpc.tolist() == [[0.0]]
+
+
+def test_reserve_filters_and_floors():
+    bids, pctr = [0.4, 3.0, 2.0, 1.0], [0.5, 0.1, 0.05, 0.02]   # scores 0.2, 0.3, 0.1, 0.02
+    # Ad 0 bids below the reserve and is not eligible. Ad 2's GSP price
+    # (0.02 / 0.05) and last-slot ad 3's (0) are raised to the reserve.
+    slots = _prices(ReservePrice(inner=GSP(), reserve_cpc=0.5), bids, pctr, 3)
+    assert slots.shown[slots.filled].tolist() == [1, 2, 3]
+    np.testing.assert_allclose(slots.price_cpc, [[1.0, 0.5, 0.5]])
+
+    # min_score: ads 2 and 3 drop out and slot 2 is left empty. Ad 1 pays
+    # the GSP price (above its floor 0.15 / 0.1); ad 0, now last, pays its
+    # floor 0.15 / 0.5.
+    slots = _prices(ReservePrice(inner=GSP(), min_score=0.15), bids, pctr, 3)
+    assert slots.filled.tolist() == [[True, True, False]]
+    np.testing.assert_allclose(slots.price_cpc, [[2.0, 0.3, 0.0]])
+
+
+def _vcg_brute_force(bids, pctr, n_slots, theta):
+    """Per-click VCG price of each shown ad from others' welfare with and without it."""
+    scores = [b * p for b, p in zip(bids, pctr)]
+
+    def welfare(ads):
+        ranked = sorted(ads, key=lambda a: -scores[a])[:n_slots]
+        return sum(theta[k] * scores[a] for k, a in enumerate(ranked)), ranked
+
+    everyone = list(range(len(bids)))
+    _, shown = welfare(everyone)
+    prices = []
+    for k, a in enumerate(shown):
+        others = [b for b in everyone if b != a]
+        without, _ = welfare(others)
+        with_a, _ = welfare(everyone)
+        harm = without - (with_a - theta[k] * scores[a])
+        prices.append(min(bids[a], harm / (theta[k] * pctr[a])))
+    return shown, prices
+
+
+@pytest.mark.parametrize("n_candidates, n_slots", [(1, 3), (3, 3), (5, 3), (6, 2)])
+def test_vcg_matches_brute_force_externalities(n_candidates, n_slots):
+    rng = np.random.default_rng(n_candidates * 10 + n_slots)
+    theta = [1.0, 0.6, 0.3]
+    for _ in range(20):
+        bids = rng.lognormal(-0.2, 0.7, n_candidates)
+        pctr = rng.beta(1.0, 10.0, n_candidates)
+        slots = _prices(VCG(), bids, pctr, n_slots, theta)
+        shown, expected = _vcg_brute_force(bids.tolist(), pctr.tolist(), n_slots, theta)
+        assert slots.shown[slots.filled].tolist() == shown
+        np.testing.assert_allclose(slots.price_cpc[slots.filled], expected, rtol=1e-9, atol=1e-12)
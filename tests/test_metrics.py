@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+import pytest
+
+from ranking_sim.evaluation.metrics import MetricsAggregator
+
+
+def _slot_blocks(n_blocks, B=50, K=3, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_blocks):
+        pctr = rng.beta(1.0, 20.0, (B, K))
+        bids = rng.lognormal(-0.2, 0.7, (B, K))
+        clicked = rng.random((B, K)) < pctr
+        filled = np.arange(K)[None, :] < rng.integers(0, K + 1, B)[:, None]
+        yield pctr, bids, clicked, np.where(clicked, bids, 0.0), filled
+
+
+def _feed(agg, blocks):
+    for pctr, bids, clicked, revenue, filled in blocks:
+        agg.update_many(pctr, bids, clicked, revenue, filled)
+    return agg
+
+
+def test_merge_matches_a_single_aggregator():
+    blocks = list(_slot_blocks(6))
+    whole = _feed(MetricsAggregator(ndcg_k=3, batch_means_size=40), blocks)
+    shards = [_feed(MetricsAggregator(ndcg_k=3, batch_means_size=40), blocks[i:i + 2]) for i in (0, 2, 4)]
+
+    left = shards[0].merge(shards[1]).merge(shards[2])
+    right = shards[0].merge(shards[1].merge(shards[2]))
+    for merged in (left, right):
+        assert (merged.impressions, merged.clicks, merged.ndcg_count) == (
+            whole.impressions, whole.clicks, whole.ndcg_count
+        )
+        assert merged.revenue == pytest.approx(whole.revenue, rel=1e-12)
+        np.testing.assert_array_equal(merged.pos_imps, whole.pos_imps)
+        np.testing.assert_allclose(merged.pos_rev, whole.pos_rev, rtol=1e-12)
+        for name in ("imp_clicks", "imp_revenue", "imp_ndcg"):
+            m, w = getattr(merged, name), getattr(whole, name)
+            assert m.n == w.n
+            assert m.mean == pytest.approx(w.mean, rel=1e-12)
+            assert m.m2 == pytest.approx(w.m2, rel=1e-9)
+        # 100 impressions per shard, batch size 40: each merge drops or folds partials.
+        bm = merged.batch_means["clicks_per_impression"]
+        assert bm.batches.n * 40 + bm.partial_n + bm.n_dropped == whole.impressions
+
+
+def test_state_dict_round_trip_is_exact():
+    agg = _feed(MetricsAggregator(ndcg_k=3, ndcg_ideal="shown", batch_means_size=40), _slot_blocks(3, seed=1))
+    state = json.loads(json.dumps(agg.state_dict()))
+    restored = MetricsAggregator.from_state(state)
+    assert restored.state_dict() == agg.state_dict()
+    assert json.dumps(restored.finalize(), default=str) == json.dumps(agg.finalize(), default=str)
+
+
+def test_merge_rejects_mismatched_settings():
+    base = MetricsAggregator(ndcg_k=3)
+    with pytest.raises(ValueError, match="ndcg_k"):
+        base.merge(MetricsAggregator(ndcg_k=4))
+    with pytest.raises(ValueError, match="batch_means_size"):
+        base.merge(MetricsAggregator(ndcg_k=3, batch_means_size=10))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from ranking_sim.data.batch import ArraySource
+from ranking_sim.evaluation.ope import SlateLog, evaluate_policies
+from ranking_sim.models.pctr_cache import CachedPCTRPredictor
+from ranking_sim.ranking.policy import BidTimesPCTR, BidTimesPCTRPow
+from ranking_sim.ranking.stochastic import PlackettLuce
+from ranking_sim.simulation.user import PositionBiasClickModel
+from ranking_sim.simulation.vectorized import run_vectorized
+
+POSITION_BIAS = [1.0, 0.7, 0.5]
+RANKER = PlackettLuce(temperature=1.0)
+
+
+@pytest.fixture(scope="module")
+def logged():
+    rng = np.random.default_rng(8)
+    N, C = 20_000, 6
+    bids = rng.lognormal(-0.2, 0.7, (N, C))
+    pctr = rng.beta(2.0, 10.0, (N, C))
+    log = SlateLog(n_slots=3, position_bias=POSITION_BIAS)
+    out = run_vectorized(
+        ArraySource(bids, rng.integers(0, 20, (N, C)), chunk_size=4096),
+        CachedPCTRPredictor(pctr),
+        BidTimesPCTR(),
+        PositionBiasClickModel(POSITION_BIAS),
+        n_slots=3,
+        seed=1,
+        ranker=RANKER,
+        slate_log=log,
+    )
+    return log, out.metrics, bids, pctr
+
+
+def _expected_value(policy, bids, pctr, n_draws=64):
+    """Clicks and revenue per impression of `policy` under RANKER, by averaging expectations over draws."""
+    rng = np.random.default_rng(9)
+    scores = policy.score_batch(bids, pctr)
+    pb = np.asarray(POSITION_BIAS)
+    clicks = revenue = 0.0
+    for _ in range(n_draws):
+        ranked = RANKER.sample(scores, len(pb), rng)
+        q = np.take_along_axis(pctr, ranked, axis=1) * pb
+        clicks += q.sum(axis=1).mean()
+        revenue += (q * np.take_along_axis(bids, ranked, axis=1)).sum(axis=1).mean()
+    return {"clicks_per_impression": clicks / n_draws, "revenue_per_impression": revenue / n_draws}
+
+
+def test_logging_policy_has_unit_weights(logged):
+    log, metrics, _, _ = logged
+    est = evaluate_policies(log, {"same": BidTimesPCTR()}, ranker=RANKER)["same"]
+    assert est.max_weight == pytest.approx(1.0)
+    assert est.estimates["ips"]["clicks_per_impression"]["mean"] == pytest.approx(
+        metrics["clicks_per_impression"], rel=1e-12
+    )
+    assert est.estimates["ips"]["revenue_per_impression"]["mean"] == pytest.approx(
+        metrics["revenue"] / metrics["impressions"], rel=1e-9
+    )
+
+
+@pytest.mark.parametrize("alpha", [0.5, 1.5])
+def test_estimators_recover_the_target_value(logged, alpha):
+    log, metrics, bids, pctr = logged
+    target = BidTimesPCTRPow(alpha=alpha)
+    truth = _expected_value(target, bids, pctr)
+    est = evaluate_policies(log, {"target": target}, ranker=RANKER)["target"]
+    # The target is far enough from the logging policy for the check to mean something.
+    ips = est.estimates["ips"]["clicks_per_impression"]
+    assert abs(truth["clicks_per_impression"] - metrics["clicks_per_impression"]) > 4.0 * ips["stderr"]
+    for estimator in ("ips", "snips", "dr"):
+        for metric, value in truth.items():
+            e = est.estimates[estimator][metric]
+            assert abs(e["mean"] - value) <= 4.0 * e["stderr"], (estimator, metric, e, value)
+    # The reward model is exact for position-bias clicks and first-price CPC.
+    for metric, value in truth.items():
+        assert est.estimates["dm"][metric]["mean"] == pytest.approx(value, rel=1e-2)
+    assert min(est.ess) > 1000
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from ranking_sim.data.schema import AdCandidate, Impression
+
+NAMES = ["f0", "f1", "f2"]
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    lgb = pytest.importorskip("lightgbm")
+    rng = np.random.default_rng(2)
+    X = rng.normal(size=(2000, len(NAMES)))
+    y = (rng.random(2000) < 1.0 / (1.0 + np.exp(2.0 - X[:, 0] + 0.5 * X[:, 2]))).astype(np.float64)
+    params = {"objective": "binary", "num_leaves": 7, "verbose": -1}
+    booster = lgb.train(params, lgb.Dataset(X, y, feature_name=NAMES), num_boost_round=15)
+    path = tmp_path_factory.mktemp("model") / "model.txt"
+    booster.save_model(str(path))
+    return str(path)
+
+
+def test_predict_pctr_many_matches_predict_pctr(model_path):
+    from ranking_sim.models.predictor import PandasLightGBMPredictor
+
+    rng = np.random.default_rng(4)
+    impressions = []
+    for imp_id, n_candidates in enumerate([3, 1, 0, 5, 2, 4]):
+        candidates = [
+            AdCandidate(
+                ad_id=imp_id * 10_000 + j,
+                advertiser_id=j,
+                bid_cpc=1.0,
+                # Extra and reordered keys: only the model's columns are used, in its order.
+                features={"extra": 9.0, **dict(zip(NAMES[::-1], rng.normal(size=len(NAMES))))},
+            )
+            for j in range(n_candidates)
+        ]
+        impressions.append(Impression(imp_id=imp_id, context={}, candidates=candidates))
+
+    predictor = PandasLightGBMPredictor(model_path, batch_size=2)
+    many = predictor.predict_pctr_many(impressions)
+    assert len(many) == len(impressions)
+    for imp, got in zip(impressions, many):
+        expected = predictor.predict_pctr(imp)
+        assert got.keys() == expected.keys()
+        for ad_id in expected:
+            assert got[ad_id] == pytest.approx(expected[ad_id], rel=1e-12)
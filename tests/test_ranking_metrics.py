@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from ranking_sim.evaluation.ranking_metrics import ndcg, ndcg_batch
+
+
+@pytest.mark.parametrize("k", [1, 3, 5])
+@pytest.mark.parametrize("with_ideal", [False, True])
+def test_ndcg_batch_matches_reference(k, with_ideal):
+    rng = np.random.default_rng(k)
+    B, K, C = 200, 5, 9
+    rels = rng.beta(1.0, 10.0, (B, K))
+    rels[::7, 2:] = 0.0   # unfilled slots padded with 0
+    rels[::13] = 0.0      # rows with no relevance at all
+    candidates = np.concatenate([rels, rng.beta(1.0, 10.0, (B, C - K))], axis=1)
+    candidates[::13] = 0.0
+    ideal = candidates if with_ideal else None
+
+    got = ndcg_batch(rels, k=k, ideal_rels=ideal)
+    expected = [
+        ndcg(rels[i].tolist(), k=k, ideal_rels=None if ideal is None else ideal[i].tolist())
+        for i in range(B)
+    ]
+    np.testing.assert_allclose(got, expected, rtol=1e-12, atol=0.0)
+    assert (got[::13] == 0.0).all()
+    if with_ideal:
+        assert (got <= 1.0 + 1e-12).all()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from ranking_sim.data.batch import ArraySource
+from ranking_sim.models.pctr_cache import CachedPCTRPredictor
+from ranking_sim.ranking.policy import BidTimesPCTR, BidTimesPCTRPow
+from ranking_sim.simulation.replay import crn_uniforms, run_replay
+from ranking_sim.simulation.user import CascadeClickModel, PositionBiasClickModel
+from ranking_sim.simulation.vectorized import simulate_arrays
+
+
+@pytest.mark.parametrize("user_model", [PositionBiasClickModel([1.0, 0.7, 0.5]), CascadeClickModel(0.8)])
+def test_identical_policies_have_zero_deltas(arrays, user_model):
+    bids, advertiser_ids, pctr = arrays
+    out = run_replay(
+        ArraySource(bids, advertiser_ids, chunk_size=128),
+        CachedPCTRPredictor(pctr),
+        {"base": BidTimesPCTR(), "same": BidTimesPCTRPow(alpha=1.0)},
+        user_model,
+        n_slots=3,
+    )
+    assert out.metrics["base"] == out.metrics["same"]
+    for summary in out.deltas["same"].values():
+        assert summary["mean"] == 0.0 and summary["stderr"] == 0.0
+
+
+def test_same_ad_same_position_same_click():
+    rng = np.random.default_rng(5)
+    B, C, K = 400, 6, 3
+    bids = rng.lognormal(-0.2, 0.7, (B, C))
+    pctr = rng.beta(2.0, 5.0, (B, C))
+    u = crn_uniforms(rng, B, C, K)
+    pb = [1.0, 0.7, 0.5]
+    a = simulate_arrays(bids, pctr, bids * pctr, pb, K, None, uniforms=u)
+    b = simulate_arrays(bids, pctr, bids * np.sqrt(pctr), pb, K, None, uniforms=u)
+    same = a.shown == b.shown
+    assert same.any() and (~same).any()
+    np.testing.assert_array_equal(a.clicked[same], b.clicked[same])
+
+
+def test_crn_reduces_delta_variance(arrays):
+    bids, advertiser_ids, pctr = arrays
+    out = run_replay(
+        ArraySource(bids, advertiser_ids, chunk_size=128),
+        CachedPCTRPredictor(pctr),
+        {"base": BidTimesPCTR(), "alpha": BidTimesPCTRPow(alpha=1.3)},
+        PositionBiasClickModel([1.0, 0.7, 0.5]),
+        n_slots=3,
+    )
+    for metric in ("clicks_per_impression", "revenue_per_impression"):
+        delta = out.deltas["alpha"][metric]
+        assert delta["variance_reduction"] > 2.0
+        assert delta["stderr"] < delta["independent_stderr"]
+    assert out.n_steps == len(bids)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from ranking_sim.data.batch import ArraySource
+from ranking_sim.models.pctr_cache import CachedPCTRPredictor
+from ranking_sim.ranking.policy import BidTimesPCTRPow
+from ranking_sim.simulation.search import adaptive_search
+from ranking_sim.simulation.user import PositionBiasClickModel
+
+
+@pytest.fixture(scope="module")
+def setup():
+    # Revenue per impression peaks near alpha = 1; mean NDCG rises with alpha.
+    rng = np.random.default_rng(0)
+    N, C = 20_000, 8
+    bids = rng.lognormal(-0.2, 0.7, (N, C))
+    advertiser_ids = rng.integers(0, 20, (N, C))
+    pctr = rng.beta(1.0, 30.0, (N, C))
+    return ArraySource(bids, advertiser_ids, chunk_size=1000), CachedPCTRPredictor(pctr)
+
+
+def _search(setup, constraint):
+    source, predictor = setup
+    return adaptive_search(
+        source, predictor, lambda a: BidTimesPCTRPow(alpha=a), (0.0, 3.0),
+        PositionBiasClickModel([1.0, 0.7, 0.5]), n_slots=3, constraint=constraint, min_impressions=1000,
+    )
+
+
+def test_constraint_moves_the_optimum(setup):
+    free = _search(setup, None)
+    bound = _search(setup, ("ndcg", 0.975))
+    assert 0.8 <= free.best <= 1.4
+    assert free.metrics["ndcg"]["mean"] < 0.975
+
+    assert bound.feasible
+    assert bound.metrics["ndcg"]["mean"] >= 0.975
+    assert 1.5 <= bound.best <= 2.1
+    assert bound.metrics["revenue_per_impression"]["mean"] < free.metrics["revenue_per_impression"]["mean"]
+    # A fraction of evaluating 5 points x 4 rounds on every impression.
+    assert bound.simulated_impressions < 0.5 * 20 * 20_000
+
+
+def test_unreachable_constraint_is_reported_infeasible(setup):
+    r = _search(setup, ("ndcg", 0.999))
+    assert not r.feasible
+    assert r.metrics["ndcg"]["mean"] < 0.999
+
+
+def test_rejects_unknown_metrics(setup):
+    with pytest.raises(ValueError, match="constraint metric"):
+        _search(setup, ("ctr", 0.5))
@@ -0,0 +1,70 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from ranking_sim.data.batch import ArraySource
+from ranking_sim.ranking.policy import BidOnly, BidTimesPCTR
+from ranking_sim.simulation.service import run_service
+from ranking_sim.simulation.user import PositionBiasClickModel
+
+
+class _Lookup:
+    """Async pCTR service over a fixed (N, C) table, with a constant delay."""
+
+    def __init__(self, pctr, delay_ms=0.0):
+        self.pctr = pctr
+        self.delay_ms = delay_ms
+
+    def predict_pctr_batch(self, batch):
+        return self.pctr[batch.imp_ids]
+
+    async def predict(self, impression):
+        if self.delay_ms:
+            await asyncio.sleep(self.delay_ms / 1000.0)
+        row = self.pctr[impression.imp_id]
+        return {c.ad_id: float(p) for c, p in zip(impression.candidates, row)}
+
+
+@pytest.fixture
+def setup(arrays):
+    bids, advertiser_ids, pctr = arrays
+    n = 120
+    source = ArraySource(bids[:n], advertiser_ids[:n], chunk_size=50)
+    return source, pctr[:n]
+
+
+def test_met_deadlines_are_reproducible(setup):
+    source, pctr = setup
+    user = PositionBiasClickModel([1.0, 0.7, 0.5])
+    a = run_service(source, _Lookup(pctr), BidTimesPCTR(), user, n_slots=3, seed=5, timeout_ms=1e4)
+    b = run_service(source, _Lookup(pctr), BidTimesPCTR(), user, n_slots=3, seed=5, timeout_ms=1e4, qps=1e5)
+
+    assert a.n_steps == b.n_steps == 120
+    assert a.service["n_timeouts"] == b.service["n_timeouts"] == 0
+    assert a.service["revenue_lost_to_timeouts"] == 0.0
+    # Without timeouts, arrival pacing does not touch the outcome.
+    assert a.metrics == b.metrics
+
+
+def test_missed_deadlines_fall_back(setup):
+    source, pctr = setup
+    user = PositionBiasClickModel([1.0, 0.7, 0.5])
+    out = run_service(
+        source, _Lookup(pctr, delay_ms=30.0), BidTimesPCTR(), user,
+        n_slots=3, seed=5, timeout_ms=2.0, concurrency=120,
+    )
+    fallback = run_service(source, _Lookup(pctr), BidOnly(), user, n_slots=3, seed=5, timeout_ms=1e4)
+
+    # Every request missed its deadline, so every impression was ranked by bid.
+    assert out.service["n_timeouts"] == out.n_steps == 120
+    assert out.service["timeout_rate"] == 1.0
+    assert out.service["client_latency_ms"]["max"] == pytest.approx(2.0)
+    assert out.service["service_latency_ms"]["p50"] >= 30.0
+    assert out.metrics["clicks"] == fallback.metrics["clicks"]
+    assert out.metrics["revenue"] == pytest.approx(fallback.metrics["revenue"])
+    # The paired replay under the real policy accounts for the whole gap.
+    unhurried = run_service(source, _Lookup(pctr), BidTimesPCTR(), user, n_slots=3, seed=5, timeout_ms=1e4)
+    assert out.metrics["revenue"] + out.service["revenue_lost_to_timeouts"] == pytest.approx(
+        unhurried.metrics["revenue"]
+    )
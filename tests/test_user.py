@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from ranking_sim.simulation.user import CascadeClickModel, DBNClickModel, PositionBiasClickModel
+
+MODELS = [
+    PositionBiasClickModel([1.0, 0.7, 0.5, 0.3]),
+    CascadeClickModel(),
+    CascadeClickModel(continue_prob=0.7),
+    DBNClickModel(satisfaction=0.6, perseverance=0.8),
+]
+
+
+@pytest.mark.parametrize("model", MODELS)
+def test_click_frequencies_match_click_probs(model):
+    pctr = np.array([[0.3, 0.5, 0.2, 0.6]])
+    n = 200_000
+    clicks = model.sample_clicks(np.repeat(pctr, n, axis=0), np.random.default_rng(0))
+    expected = model.click_probs(pctr)[0]
+    # 5 binomial standard errors per slot.
+    tol = 5.0 * np.sqrt(expected * (1.0 - expected) / n)
+    np.testing.assert_array_less(np.abs(clicks.mean(axis=0) - expected), tol)
+
+
+def test_slate_models_respect_filled():
+    pctr = np.full((1000, 4), 0.4)
+    filled = np.arange(4)[None, :] < np.random.default_rng(1).integers(0, 5, 1000)[:, None]
+    for model in MODELS[1:]:
+        clicks = model.sample_clicks(pctr, np.random.default_rng(2), filled)
+        assert not (clicks & ~filled).any()
+        if isinstance(model, CascadeClickModel):
+            assert (clicks.sum(axis=1) <= 1).all()
+
+
+def test_clicks_from_uniforms_replays_sample_clicks():
+    pctr = np.random.default_rng(3).beta(2.0, 5.0, (500, 4))
+    for model in MODELS:
+        drawn = model.sample_clicks(pctr, np.random.default_rng(4))
+        extra = (model.uniforms_per_slot,) if model.uniforms_per_slot > 1 else ()
+        u = np.random.default_rng(4).random(pctr.shape + extra)
+        np.testing.assert_array_equal(model.clicks_from_uniforms(pctr, u), drawn)
@@ -0,0 +1,41 @@
+import pytest
+
+from ranking_sim.auction.mechanisms import GSP, VCG
+from ranking_sim.data.batch import ArraySource
+from ranking_sim.models.pctr_cache import CachedPCTRPredictor
+from ranking_sim.ranking.policy import BidTimesPCTR
+from ranking_sim.simulation.runner import run_simulation
+from ranking_sim.simulation.user import CascadeClickModel, DBNClickModel, PositionBiasClickModel
+from ranking_sim.simulation.vectorized import run_vectorized
+
+USER_MODELS = [
+    (PositionBiasClickModel([1.0, 0.7, 0.5]), None),
+    (PositionBiasClickModel([1.0, 0.7, 0.5]), GSP()),
+    (PositionBiasClickModel([1.0, 0.7, 0.5]), VCG()),
+    (CascadeClickModel(continue_prob=0.8), GSP()),
+    (DBNClickModel(), None),
+]
+
+
+def _assert_close(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for k in a:
+            _assert_close(a[k], b[k])
+    elif isinstance(a, float):
+        assert a == pytest.approx(b, rel=1e-9, abs=1e-12)
+    else:
+        assert a == b
+
+
+@pytest.mark.parametrize("ndcg_ideal", ["shown", "candidates"])
+@pytest.mark.parametrize("user_model, auction", USER_MODELS)
+def test_array_engine_matches_run_simulation(arrays, user_model, auction, ndcg_ideal):
+    bids, advertiser_ids, pctr = arrays
+    source = ArraySource(bids, advertiser_ids, chunk_size=128)
+    kwargs = dict(
+        policy=BidTimesPCTR(), user_model=user_model, n_slots=3, seed=5, auction=auction, ndcg_ideal=ndcg_ideal
+    )
+    loop = run_simulation(source, CachedPCTRPredictor(pctr), **kwargs).metrics
+    array = run_vectorized(source, CachedPCTRPredictor(pctr), **kwargs).metrics
+    _assert_close(loop, array)